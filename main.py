@@ -7,7 +7,34 @@ A simple annotation tool for creating YOLO format labels with integrated with in
 import tkinter as tk
 from tkinter import filedialog, simpledialog, messagebox, ttk
 from PIL import Image, ImageTk
+import numpy as np
+import argparse
+import bisect
+import ctypes
+import hashlib
+import io
+import itertools
+import json
+import math
 import os
+import queue
+import random
+import re
+import shutil
+import socket
+import sqlite3
+import struct
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from xml.etree import ElementTree
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 try:
     from ultralytics import YOLO
@@ -15,618 +42,4454 @@ except ImportError:
     print("Warning: ultralytics not found. YOLO auto-detection will not be available.")
     YOLO = None
 
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    # Greedy matching is used instead
+    linear_sum_assignment = None
+
+try:
+    import cv2
+except ImportError:
+    print("Warning: opencv-python not found. Video sources will not be available.")
+    cv2 = None
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+
+# Decoded video frames kept around the current position
+VIDEO_CACHE_BYTES = 256 * 1024 * 1024
+
+# Perceptual hash: images within this many differing bits are near-duplicates
+PHASH_MAX_DISTANCE = 4
+PHASH_CACHE_NAME = ".phash-cache.json"
+# Hashes sharing a band are compared in tiles of this many rows and columns,
+# so memory stays bounded (~8 bytes per cell) however large a bucket grows
+HAMMING_BLOCK = 1024
+
+# Uncertainty ranking: images scored per batch, confidences this close to the threshold count as uncertain
+UNCERTAINTY_BATCH = 16
+UNCERTAINTY_BAND = 0.15
+
+# Merging detections into existing annotations: overlap threshold and policies
+MERGE_IOU = 0.5
+MERGE_POLICIES = {
+    "Keep existing": "keep",
+    "Replace existing": "replace",
+    "Keep higher confidence": "confidence",
+}
+
+# Watch mode: seconds between source directory polls, and the confidence
+# floor used when pre-running detection on newly arrived images
+WATCH_INTERVAL = 2.0
+# Filesystems where inotify misses changes made by other machines; these are polled
+NETWORK_FILESYSTEMS = ("nfs", "nfs4", "cifs", "smb3", "smbfs", "afs", "ceph", "glusterfs", "lustre", "fuse.sshfs")
+PREDETECT_CONF = 0.05
+
+# Image memory budget (MB of decoded pixels). Larger images are displayed from a
+# downsampled working copy; full-resolution regions are read only when zoomed in.
+IMAGE_MEMORY_BUDGET_MB = int(os.environ.get("YOLO_LABELER_IMAGE_BUDGET_MB", "256"))
+# Interactive renders use a fast filter; the viewport is re-rendered with
+# LANCZOS once input has been idle this many milliseconds
+RENDER_REFINE_DELAY = 150
+# Display-only filters: (gamma, contrast stretch, CLAHE, channel) with no effect,
+# the percentiles a contrast stretch maps to black and white, and the byte
+# budget for cached viewport renders of the current image
+DEFAULT_DISPLAY_FILTERS = (1.0, False, False, "all")
+DISPLAY_CHANNELS = {"red": 0, "green": 1, "blue": 2}
+STRETCH_PERCENTILES = (1, 99)
+VIEW_CACHE_BYTES = 64 * 1024 * 1024
+# Full-resolution region reads keep this fraction of the viewport as margin on each side
+REGION_MARGIN = 0.5
+# Box propagation keeps the previous working image if it is within this fraction
+# of the memory budget; larger ones are decoded again only when P is pressed
+PREVIOUS_FRAME_BUDGET_FRACTION = 0.25
+# Orthomosaics exceed Pillow's default decompression-bomb limit; the budget caps what is kept
+Image.MAX_IMAGE_PIXELS = 2_000_000_000
+
+# Session metrics: seconds between metrics file writes, and histogram buckets (seconds)
+METRICS_INTERVAL = 15
+METRICS_ENV = "YOLO_LABELER_METRICS"
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+IMAGE_TIME_BUCKETS = (5, 10, 20, 30, 60, 120, 300, 600, 1800)
+
+# Box propagation: templates are matched at most this many pixels on their
+# longer side, searched within this fraction of the box size around it, and
+# boxes whose best match scores below the threshold are carried over unmoved
+TRACK_TEMPLATE_SIZE = 32
+TRACK_SEARCH_MARGIN = 0.5
+TRACK_MIN_SCORE = 0.5
+
+# Record/replay harness: Tk sequences captured from the main window, and the
+# event fields needed to regenerate each one with event_generate
+RECORDED_SEQUENCES = ("<KeyPress>", "<ButtonPress>", "<ButtonRelease>", "<B1-Motion>", "<B3-Motion>", "<MouseWheel>")
+VIRTUAL_DISPLAY = ":99"
+
+# Review mode: minimum IoU for a prediction to match a saved box, and overlay colors
+REVIEW_IOU = 0.5
+REVIEW_COLORS = {"tp": "lime green", "fn": "orange", "fp": "magenta"}
+
+CATALOG_NAME = ".labeler-catalog.sqlite"
+CLASS_OPS_DIRECTORY = ".class-ops"
+VALIDATION_REPORT_NAME = "validation-report.txt"
+
+# Letterboxed training cache: default square size, padding gray (as Ultralytics), file names
+LETTERBOX_SIZE = 640
+LETTERBOX_FILL = 114
+LETTERBOX_MANIFEST = ".letterbox-manifest.json"
+LETTERBOX_ARRAY_NAME = "images.u8"
+LETTERBOX_INDEX_NAME = "index.json"
+
+# Work leases for several annotators sharing one destination directory: images
+# are claimed this many at a time, renewed every LEASE_HEARTBEAT seconds, and
+# reclaimable by others once not renewed for LEASE_TTL seconds
+LEASE_DIRECTORY = ".leases"
+LEASE_CHUNK = 20
+LEASE_HEARTBEAT = 30
+LEASE_TTL = 120
+
+# Per-user settings (recent models, class selection, preload), and warm-up input size
+SETTINGS_PATH = os.path.join(os.path.expanduser("~"), ".yolo_labeler.json")
+RECENT_MODELS = 5
+WARMUP_SIZE = 640
+
+# Edit journal: fsync after this many appended records or this many seconds
+JOURNAL_SYNC_EVERY = 16
+JOURNAL_SYNC_INTERVAL = 1.0
+
+
+def atomic_write_text(path, text):
+    """Write text to path through a temporary file so readers never see a partial file."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+ZIP_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+
+
+def read_archive_member(handle, is_zip, offset, size, compress_type):
+    """Read the raw bytes of one archive member from an open archive file."""
+    handle.seek(offset)
+    if is_zip:
+        header = ZIP_LOCAL_HEADER.unpack(handle.read(ZIP_LOCAL_HEADER.size))
+        handle.seek(header[-2] + header[-1], os.SEEK_CUR)
+    data = handle.read(size)
+    if compress_type == zipfile.ZIP_DEFLATED:
+        data = zlib.decompress(data, -15)
+    return data
+
+
+def open_located_image(locator):
+    """Open an image from a picklable locator, as produced by an image source's locate()."""
+    if locator[0] == "archive":
+        _, archive_path, is_zip, offset, size, compress_type = locator
+        with open(archive_path, "rb") as handle:
+            data = read_archive_member(handle, is_zip, offset, size, compress_type)
+        return Image.open(io.BytesIO(data))
+    return Image.open(locator[1])
+
+
+def image_nbytes(image):
+    """Return the decoded size of an image in bytes (one byte per band)."""
+    return image.width * image.height * len(image.getbands())
+
+
+def working_copy(image, budget):
+    """Decode an image, downsampled if needed so it fits in budget bytes.
+
+    Returns (working image, scale) where scale is working pixels per original pixel.
+    JPEGs are decoded directly at reduced size, so the full bitmap is never held.
+    """
+    width = image.width
+    if image_nbytes(image) <= budget:
+        image.load()
+        return image, 1.0
+    factor = math.sqrt(budget / image_nbytes(image))
+    image.thumbnail(
+        (max(1, int(image.width * factor)), max(1, int(image.height * factor))),
+        Image.Resampling.LANCZOS,
+        reducing_gap=2.0
+    )
+    return image, image.width / width
+
+
+def apply_lut(pixels, lut):
+    """Map uint8 pixels through a 256-entry lookup table, one column per channel."""
+    if pixels.ndim == 2:
+        return lut[:, 0][pixels]
+    if cv2 is not None:
+        return cv2.LUT(np.ascontiguousarray(pixels), np.ascontiguousarray(lut.reshape(256, 1, 3)))
+    return np.stack([lut[:, c][pixels[:, :, c]] for c in range(3)], axis=2)
+
+
+def apply_display_filters(pixels, settings):
+    """
+    Apply display-only enhancements to an RGB uint8 viewport array.
+
+    Contrast stretch and gamma are folded into per-channel lookup tables, and
+    a single selected channel is processed as one grayscale plane, so a
+    full-screen viewport takes a few milliseconds.
+
+    Args:
+        pixels: (H, W, 3) uint8 array
+        settings: (gamma, contrast stretch, CLAHE, channel) as in DEFAULT_DISPLAY_FILTERS
+
+    Returns:
+        np.ndarray: the enhanced (H, W, 3) uint8 array
+    """
+    gamma, stretch, clahe, channel = settings
+    if channel in DISPLAY_CHANNELS:
+        pixels = np.ascontiguousarray(pixels[:, :, DISPLAY_CHANNELS[channel]])
+    planes = 1 if pixels.ndim == 2 else 3
+    identity = np.repeat(np.arange(256, dtype=np.float64)[:, None], planes, axis=1)
+    lut = identity
+    if stretch:
+        # Percentiles from a subsampled histogram are plenty for a display stretch
+        sample = pixels[::4, ::4].reshape(-1, planes)
+        columns = []
+        for c in range(planes):
+            cdf = np.cumsum(np.bincount(sample[:, c], minlength=256)) / len(sample)
+            low, high = np.searchsorted(cdf, np.array(STRETCH_PERCENTILES) / 100.0)
+            columns.append((np.arange(256) - low) * 255.0 / max(high - low, 1))
+        lut = np.clip(np.stack(columns, axis=1), 0, 255)
+    if clahe and cv2 is not None:
+        if lut is not identity:
+            pixels = apply_lut(pixels, np.round(lut).astype(np.uint8))
+            lut = identity
+        equalizer = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        if planes == 1:
+            pixels = equalizer.apply(pixels)
+        else:
+            # Equalize luma only so colors are preserved
+            ycrcb = cv2.cvtColor(pixels, cv2.COLOR_RGB2YCrCb)
+            ycrcb[:, :, 0] = equalizer.apply(ycrcb[:, :, 0])
+            pixels = cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2RGB)
+    if gamma != 1.0:
+        lut = 255.0 * (lut / 255.0) ** (1.0 / gamma)
+    if lut is not identity:
+        pixels = apply_lut(pixels, np.round(lut).astype(np.uint8))
+    if planes == 1:
+        pixels = np.repeat(pixels[:, :, None], 3, axis=2)
+    return pixels
+
+
+def dct_matrix(n):
+    """Return the orthonormal DCT-II basis as an n x n matrix."""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    basis = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    basis[0] /= np.sqrt(2.0)
+    return basis.astype(np.float32)
+
+
+PHASH_DCT = dct_matrix(32)
+POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def perceptual_hash(image):
+    """Return the 64-bit DCT perceptual hash of a PIL image."""
+    # JPEG decoders can skip most of the work at reduced scale
+    image.draft("L", (64, 64))
+    pixels = np.asarray(image.convert("L").resize((32, 32), Image.Resampling.BILINEAR), dtype=np.float32)
+    low = (PHASH_DCT @ pixels @ PHASH_DCT.T)[:8, :8].ravel()
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def compute_phash(locator, open_image=None):
+    """Process pool worker: hash one image, or return None if it cannot be read."""
+    try:
+        with (open_image() if open_image else open_located_image(locator)) as image:
+            return perceptual_hash(image)
+    except Exception:
+        return None
+
+
+def hamming_clusters(hashes, max_distance=PHASH_MAX_DISTANCE):
+    """
+    Group hashes whose Hamming distance is within max_distance.
+
+    Uses multi-index hashing: the 64 bits are split into max_distance + 1
+    bands, and by pigeonhole two hashes within max_distance agree exactly on
+    at least one band, so only hashes sharing a band value are compared.
+
+    Args:
+        hashes (list): 64-bit integer hashes
+        max_distance (int): Largest Hamming distance treated as a duplicate
+
+    Returns:
+        list: Clusters (lists of input indices, in input order) with more than one member
+    """
+    unique, inverse = np.unique(np.asarray(hashes, dtype=np.uint64), return_inverse=True)
+    parent = np.arange(len(unique))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    edges = np.linspace(0, 64, max_distance + 2).astype(int)
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        keys = (unique >> np.uint64(lo)) & np.uint64((1 << int(hi - lo)) - 1)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        ends = np.r_[starts[1:], len(order)]
+        for start, end in zip(starts, ends):
+            if end - start < 2:
+                continue
+            members = order[start:end]
+            values = unique[members]
+            count = len(values)
+            # Upper-triangle tiles only: each pair is compared once
+            for row in range(0, count, HAMMING_BLOCK):
+                rows = values[row:row + HAMMING_BLOCK]
+                for column in range(row, count, HAMMING_BLOCK):
+                    columns = values[column:column + HAMMING_BLOCK]
+                    xor = (rows[:, None] ^ columns[None, :]).view(np.uint8).reshape(len(rows), len(columns), 8)
+                    close = POPCOUNT8[xor].sum(axis=2, dtype=np.uint8) <= max_distance
+                    if column == row:
+                        close = np.triu(close, 1)
+                    for a, b in zip(*np.nonzero(close)):
+                        root_a, root_b = find(members[row + a]), find(members[column + b])
+                        if root_a != root_b:
+                            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    groups = {}
+    for index, unique_index in enumerate(inverse.ravel()):
+        groups.setdefault(find(unique_index), []).append(index)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def uncertainty_score(confidences, threshold, band=UNCERTAINTY_BAND):
+    """
+    Score how informative an image is to label from its detection confidences.
+
+    Args:
+        confidences (array): Confidence of every detection, including those below threshold
+        threshold (float): Confidence threshold used for accepting detections
+        band (float): Distance from the threshold within which a detection is uncertain
+
+    Returns:
+        float: Number of near-threshold detections plus how close the closest one is
+    """
+    conf = np.asarray(confidences, dtype=np.float32)
+    if conf.size == 0:
+        return 0.0
+    margin = np.abs(conf - threshold)
+    near = np.count_nonzero(margin < band)
+    return float(near + 1.0 - margin.min() / max(threshold, 1.0 - threshold))
+
+
+def raw_predictions(results):
+    """Return (xyxy boxes, class ids, confidences) arrays from ultralytics results."""
+    boxes = [result.boxes.xyxy.cpu().numpy() for result in results]
+    classes = [result.boxes.cls.cpu().numpy().astype(int) for result in results]
+    confidences = [result.boxes.conf.cpu().numpy() for result in results]
+    if not boxes:
+        return np.zeros((0, 4)), np.zeros(0, dtype=int), np.zeros(0)
+    return np.concatenate(boxes), np.concatenate(classes), np.concatenate(confidences)
+
+
+def box_iou(boxes_a, boxes_b):
+    """Return the (N, M) IoU matrix between two sets of xyxy boxes."""
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return intersection / np.maximum(union, 1e-12)
+
+
+def match_boxes(pred_boxes, pred_classes, gt_boxes, gt_classes, iou_threshold=REVIEW_IOU):
+    """
+    Match predictions to ground-truth boxes of the same class.
+
+    Uses optimal (Hungarian) assignment when scipy is available and greedy
+    highest-IoU-first assignment otherwise.
+
+    Returns:
+        tuple: (matches, unmatched_predictions, unmatched_ground_truth) where
+        matches is a list of (prediction_index, ground_truth_index)
+    """
+    pred_classes = np.asarray(pred_classes).reshape(-1)
+    gt_classes = np.asarray(gt_classes).reshape(-1)
+    iou = box_iou(pred_boxes, gt_boxes)
+    iou[pred_classes[:, None] != gt_classes[None, :]] = 0.0
+
+    if iou.size == 0:
+        pairs = []
+    elif linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(-iou)
+        pairs = [(int(p), int(g)) for p, g in zip(rows, cols) if iou[p, g] >= iou_threshold]
+    else:
+        pairs = []
+        used_pred, used_gt = set(), set()
+        candidates = np.argwhere(iou >= iou_threshold)
+        for p, g in candidates[np.argsort(-iou[candidates[:, 0], candidates[:, 1]], kind="stable")]:
+            if p not in used_pred and g not in used_gt:
+                used_pred.add(p)
+                used_gt.add(g)
+                pairs.append((int(p), int(g)))
+
+    matched_pred = {p for p, _ in pairs}
+    matched_gt = {g for _, g in pairs}
+    unmatched_pred = [i for i in range(len(pred_classes)) if i not in matched_pred]
+    unmatched_gt = [i for i in range(len(gt_classes)) if i not in matched_gt]
+    return pairs, unmatched_pred, unmatched_gt
+
+
+def track_boxes(previous, current, boxes, template_size=TRACK_TEMPLATE_SIZE,
+                margin=TRACK_SEARCH_MARGIN, min_score=TRACK_MIN_SCORE):
+    """
+    Estimate each box's motion between two frames by template matching.
+
+    Only each box's neighbourhood is searched, and large boxes are matched at
+    reduced size, so the cost per box is small and independent of frame size.
+
+    Args:
+        previous, current: Grayscale uint8 frames of the same shape
+        boxes: (N, 4) xyxy boxes in previous-frame pixels
+
+    Returns:
+        tuple: (moved boxes (N, 4) clipped to the frame, match scores (N,))
+    """
+    height, width = current.shape
+    moved = np.asarray(boxes, dtype=np.float64).reshape(-1, 4).copy()
+    scores = np.zeros(len(moved))
+    for i, (x1, y1, x2, y2) in enumerate(moved.copy()):
+        bx1, by1 = max(0, int(x1)), max(0, int(y1))
+        bx2, by2 = min(width, int(math.ceil(x2))), min(height, int(math.ceil(y2)))
+        if bx2 - bx1 < 4 or by2 - by1 < 4:
+            continue
+        scale = min(1.0, template_size / max(bx2 - bx1, by2 - by1))
+        mx = int((bx2 - bx1) * margin) + 4
+        my = int((by2 - by1) * margin) + 4
+        sx1, sy1 = max(0, bx1 - mx), max(0, by1 - my)
+        sx2, sy2 = min(width, bx2 + mx), min(height, by2 + my)
+        template = previous[by1:by2, bx1:bx2]
+        search = current[sy1:sy2, sx1:sx2]
+        if scale < 1.0:
+            template = cv2.resize(template, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            search = cv2.resize(search, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        if template.shape[0] > search.shape[0] or template.shape[1] > search.shape[1]:
+            continue
+        result = cv2.matchTemplate(search, template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (lx, ly) = cv2.minMaxLoc(result)
+        if not np.isfinite(score):
+            # Flat (textureless) patches have no defined correlation
+            continue
+        scores[i] = score
+        if score >= min_score:
+            dx = sx1 + lx / scale - bx1
+            dy = sy1 + ly / scale - by1
+            moved[i] += (dx, dy, dx, dy)
+    moved[:, 0::2] = np.clip(moved[:, 0::2], 0, width)
+    moved[:, 1::2] = np.clip(moved[:, 1::2], 0, height)
+    return moved, scores
+
+
+def merge_detections(det_boxes, det_classes, det_confidences, boxes, classes, confidences,
+                     iou_threshold=MERGE_IOU, policy="keep"):
+    """
+    Decide how new detections merge into existing boxes of the same class.
+
+    Args:
+        det_boxes, det_classes, det_confidences: New detections (xyxy)
+        boxes, classes, confidences: Existing annotations; manual boxes count as confidence 1.0
+        iou_threshold (float): IoU at which a detection duplicates an existing box
+        policy (str): "keep" drops duplicating detections, "replace" swaps the
+            overlapped boxes for the detection, "confidence" keeps whichever side
+            is more confident
+
+    Returns:
+        tuple: (indices of detections to add, indices of existing boxes to remove)
+    """
+    det_classes = np.asarray(det_classes).reshape(-1)
+    classes = np.asarray(classes).reshape(-1)
+    overlap = box_iou(det_boxes, boxes) >= iou_threshold
+    overlap &= det_classes[:, None] == classes[None, :]
+    duplicate = overlap.any(axis=1)
+
+    if policy == "replace":
+        add = np.ones(len(det_classes), dtype=bool)
+    elif policy == "confidence":
+        existing_best = np.where(overlap, np.asarray(confidences, dtype=np.float64)[None, :], -np.inf).max(
+            axis=1, initial=-np.inf
+        )
+        add = ~duplicate | (np.asarray(det_confidences, dtype=np.float64) > existing_best)
+    else:
+        add = ~duplicate
+    remove = (overlap & add[:, None]).any(axis=0)
+    return np.flatnonzero(add).tolist(), np.flatnonzero(remove).tolist()
+
+
+def read_label_boxes(path):
+    """Return (classes, normalized xyxy boxes) from a YOLO label file; missing files are empty."""
+    classes, boxes = [], []
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        lines = []
+    for line in lines:
+        parts = line.split()
+        if len(parts) != 5:
+            continue
+        try:
+            label_id = int(parts[0])
+            x_center, y_center, w, h = (float(p) for p in parts[1:])
+        except ValueError:
+            continue
+        classes.append(label_id)
+        boxes.append((x_center - w / 2, y_center - h / 2, x_center + w / 2, y_center + h / 2))
+    return np.asarray(classes, dtype=np.int64), np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def read_label_counts(path):
+    """Return a Counter of class ids in a YOLO label file, skipping malformed lines."""
+    counts = Counter()
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 5:
+                try:
+                    counts[int(parts[0])] += 1
+                except ValueError:
+                    continue
+    return counts
+
+
+def list_label_files(directory):
+    """Return every YOLO label file under directory, skipping hidden files and folders."""
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        paths.extend(
+            os.path.join(root, f) for f in files
+            if f.endswith(".txt") and not f.startswith(".") and f not in ("classes.txt", VALIDATION_REPORT_NAME)
+        )
+    return paths
+
+
+def validate_label_lines(lines, class_ids=None):
+    """
+    Check YOLO label lines and build a repaired version.
+
+    Args:
+        lines (list): Lines of a label file
+        class_ids (set): Known class ids, or None to skip the check
+
+    Returns:
+        tuple: (problems, repaired_lines) where problems is a list of
+        (line_number, kind, detail) and repaired_lines drops malformed,
+        zero-area and duplicate boxes and clamps boxes into the image
+    """
+    problems = []
+    repaired = []
+    seen = set()
+    for number, line in enumerate(lines, 1):
+        parts = line.split()
+        if not parts:
+            continue
+        if len(parts) != 5:
+            problems.append((number, "field count", f"expected 5 fields, found {len(parts)}"))
+            continue
+        try:
+            label_id = int(parts[0])
+            x_center, y_center, w, h = (float(p) for p in parts[1:])
+        except ValueError:
+            problems.append((number, "parse error", line.strip()))
+            continue
+        if label_id < 0:
+            problems.append((number, "parse error", f"negative class id {label_id}"))
+            continue
+        if class_ids is not None and label_id not in class_ids:
+            problems.append((number, "unknown class", f"class {label_id} is not in the model names"))
+
+        x1, x2 = x_center - w / 2, x_center + w / 2
+        y1, y2 = y_center - h / 2, y_center + h / 2
+        clamped = [min(1.0, max(0.0, v)) for v in (x1, y1, x2, y2)]
+        if clamped != [x1, y1, x2, y2]:
+            problems.append((number, "out of range", "box extends outside the image"))
+            x1, y1, x2, y2 = clamped
+            x_center, y_center, w, h = (x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1
+        if w <= 0 or h <= 0:
+            problems.append((number, "zero area", "box has no area"))
+            continue
+
+        key = (label_id, round(x_center, 6), round(y_center, 6), round(w, 6), round(h, 6))
+        if key in seen:
+            problems.append((number, "duplicate", "same class and box as an earlier line"))
+            continue
+        seen.add(key)
+        repaired.append(f"{label_id} {x_center} {y_center} {w} {h}")
+    return problems, repaired
+
+
+VALIDATION_CLASS_IDS = None
+
+
+def init_label_validation(class_ids):
+    """Process pool initializer: share the known class ids with each worker once."""
+    global VALIDATION_CLASS_IDS
+    VALIDATION_CLASS_IDS = class_ids
+
+
+def validate_label_file(task):
+    """Process pool worker: validate one label file and optionally rewrite it repaired."""
+    path, fix = task
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    except (OSError, UnicodeDecodeError) as e:
+        return path, [(0, "unreadable", str(e))], False
+    problems, repaired = validate_label_lines(lines, VALIDATION_CLASS_IDS)
+    # Unknown classes are reported but kept, so they alone never trigger a rewrite
+    fixable = any(kind != "unknown class" for _, kind, _ in problems)
+    if fix and fixable:
+        atomic_write_text(path, "\n".join(repaired))
+    return path, problems, fix and fixable
+
+
+def parse_class_mapping(text):
+    """
+    Parse a class remap table such as "3:1, 5:1, 7:drop".
+
+    Returns:
+        dict: old class id -> new class id, or None to drop the boxes
+    """
+    mapping = {}
+    for item in re.split(r"[,\s]+", text.strip()):
+        if not item:
+            continue
+        old, separator, new = item.partition(":")
+        if not separator:
+            raise ValueError(f"expected old:new, got '{item}'")
+        mapping[int(old)] = None if new.strip().lower() in ("drop", "delete", "-") else int(new)
+    return {old: new for old, new in mapping.items() if old != new}
+
+
+CLASS_MAPPING = {}
+
+
+def init_class_mapping(mapping):
+    """Process pool initializer: share the class mapping with each worker once."""
+    global CLASS_MAPPING
+    CLASS_MAPPING = mapping
+
+
+def remap_label_file(task):
+    """
+    Process pool worker: apply CLASS_MAPPING to one label file.
+
+    Returns:
+        tuple: (path, original_text, updated_text, Counter of (old, new) box
+        changes); the texts are None when the file does not change
+    """
+    path, apply = task
+    try:
+        with open(path) as f:
+            original = f.read()
+    except OSError:
+        return path, None, None, Counter()
+
+    changes = Counter()
+    lines = []
+    for line in original.splitlines():
+        parts = line.split()
+        label_id = int(parts[0]) if parts and parts[0].lstrip("-").isdigit() else None
+        if label_id in CLASS_MAPPING:
+            new_id = CLASS_MAPPING[label_id]
+            changes[(label_id, new_id)] += 1
+            if new_id is None:
+                continue
+            line = " ".join([str(new_id)] + parts[1:])
+        lines.append(line)
+
+    if not changes:
+        return path, None, None, changes
+    updated = "\n".join(lines)
+    if apply:
+        atomic_write_text(path, updated)
+    return path, original, updated, changes
+
+
+def restore_label_file(entry):
+    """Undo one class operation entry; returns False if the file changed since."""
+    path, original, updated = entry
+    try:
+        with open(path) as f:
+            if f.read() != updated:
+                return False
+    except OSError:
+        return False
+    atomic_write_text(path, original)
+    return True
+
+
+def stratified_split(image_counts, val_fraction, seed=0):
+    """
+    Split images into train and val so each class keeps roughly val_fraction of its boxes in val.
+
+    Images are assigned rarest-class first to whichever split is further
+    below its per-class box target, which keeps rare classes represented in
+    both splits; images without boxes are split by image count.
+
+    Args:
+        image_counts (dict): image name -> Counter of class id box counts
+        val_fraction (float): Fraction of boxes (and background images) for val
+        seed (int): Seed for tie-breaking order
+
+    Returns:
+        tuple: (train names, val names)
+    """
+    totals = Counter()
+    for counts in image_counts.values():
+        totals.update(counts)
+    split_counts = {"train": Counter(), "val": Counter()}
+    fractions = {"train": 1.0 - val_fraction, "val": val_fraction}
+    splits = {"train": [], "val": []}
+
+    # Sorted first: set/dict order of strings varies between processes
+    names = sorted(image_counts)
+    random.Random(seed).shuffle(names)
+    names.sort(key=lambda n: min((totals[c] for c in image_counts[n]), default=float("inf")))
+
+    background = 0
+    for name in names:
+        counts = image_counts[name]
+        if not counts:
+            # Background images: every 1 / val_fraction-th one goes to val
+            background += 1
+            if int(background * val_fraction) > int((background - 1) * val_fraction):
+                split = "val"
+            else:
+                split = "train"
+        else:
+            # Relative shortfall against each split's target, rare classes weighted up
+            deficit = {
+                split: sum(
+                    (1.0 - split_counts[split][c] / (fractions[split] * totals[c] or 1.0)) / totals[c]
+                    for c in counts
+                )
+                for split in splits
+            }
+            split = "val" if deficit["val"] > deficit["train"] else "train"
+            split_counts[split].update(counts)
+        splits[split].append(name)
+    return splits["train"], splits["val"]
+
+
+def yolo_to_pixel_boxes(boxes, width, height):
+    """Convert normalized xyxy boxes to pixel xyxy boxes clamped to the image."""
+    scale = np.array([width, height, width, height], dtype=np.float64)
+    return np.clip(np.asarray(boxes, dtype=np.float64).reshape(-1, 4) * scale, 0, scale)
+
+
+def pixel_to_yolo_line(class_id, x1, y1, x2, y2, width, height):
+    """Format a pixel xyxy box as a YOLO label line."""
+    x_center = (x1 + x2) / 2 / width
+    y_center = (y1 + y2) / 2 / height
+    return f"{class_id} {x_center} {y_center} {(x2 - x1) / width} {(y2 - y1) / height}"
+
+
+def voc_annotation_xml(filename, width, height, objects):
+    """Return a Pascal VOC annotation document for (name, x1, y1, x2, y2) objects."""
+    root = ElementTree.Element("annotation")
+    ElementTree.SubElement(root, "filename").text = filename
+    size = ElementTree.SubElement(root, "size")
+    ElementTree.SubElement(size, "width").text = str(width)
+    ElementTree.SubElement(size, "height").text = str(height)
+    ElementTree.SubElement(size, "depth").text = "3"
+    for name, x1, y1, x2, y2 in objects:
+        obj = ElementTree.SubElement(root, "object")
+        ElementTree.SubElement(obj, "name").text = name
+        ElementTree.SubElement(obj, "difficult").text = "0"
+        box = ElementTree.SubElement(obj, "bndbox")
+        for tag, value in (("xmin", x1), ("ymin", y1), ("xmax", x2), ("ymax", y2)):
+            ElementTree.SubElement(box, tag).text = str(int(round(value)))
+    return ElementTree.tostring(root, encoding="unicode")
+
+
+def parse_voc_annotation(path):
+    """Return (filename, width, height, [(name, x1, y1, x2, y2)]) from a Pascal VOC file."""
+    root = ElementTree.parse(path).getroot()
+    size = root.find("size")
+    width = float(size.findtext("width"))
+    height = float(size.findtext("height"))
+    objects = []
+    for obj in root.iter("object"):
+        box = obj.find("bndbox")
+        objects.append((
+            obj.findtext("name", "").strip(),
+            *(float(box.findtext(tag)) for tag in ("xmin", "ymin", "xmax", "ymax"))
+        ))
+    return root.findtext("filename", ""), width, height, objects
+
+
+def link_or_copy(source, target, mode="hardlink"):
+    """
+    Create target as a hardlink or symlink to source, copying when linking fails.
+
+    Returns:
+        bool: True if the file had to be copied (e.g. across filesystems)
+    """
+    if os.path.lexists(target):
+        os.unlink(target)
+    try:
+        if mode == "symlink":
+            os.symlink(os.path.abspath(source), target)
+        else:
+            os.link(source, target)
+        return False
+    except OSError:
+        shutil.copy2(source, target)
+        return True
+
+
+def letterbox(image, size):
+    """
+    Resize an image to fit a size x size square, padding the rest with LETTERBOX_FILL.
+
+    Returns:
+        tuple: (square RGB image, scale, pad_x, pad_y)
+    """
+    width, height = image.size
+    scale = min(size / width, size / height)
+    new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    # JPEGs are decoded at reduced size when the target is much smaller
+    image.draft("RGB", new_size)
+    resized = image.convert("RGB").resize(new_size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+    pad_x, pad_y = (size - new_size[0]) // 2, (size - new_size[1]) // 2
+    square = Image.new("RGB", (size, size), (LETTERBOX_FILL,) * 3)
+    square.paste(resized, (pad_x, pad_y))
+    return square, scale, pad_x, pad_y
+
+
+def letterbox_label_lines(lines, width, height, size, scale, pad_x, pad_y):
+    """Map YOLO label lines of a width x height image into its letterboxed square."""
+    mapped = []
+    for line in lines:
+        parts = line.split()
+        if len(parts) != 5:
+            continue
+        try:
+            x, y, w, h = (float(p) for p in parts[1:])
+        except ValueError:
+            continue
+        mapped.append(
+            f"{parts[0]} {(x * width * scale + pad_x) / size:.6f} {(y * height * scale + pad_y) / size:.6f} "
+            f"{w * width * scale / size:.6f} {h * height * scale / size:.6f}"
+        )
+    return mapped
+
+
+LETTERBOX_TARGET = None
+
+
+def init_letterbox(size, array_path=None, capacity=0):
+    """Process pool initializer: open the shared memory-mapped output array once per worker."""
+    global LETTERBOX_TARGET
+    array = None
+    if array_path:
+        array = np.memmap(array_path, dtype=np.uint8, mode="r+", shape=(capacity, size, size, 3))
+    LETTERBOX_TARGET = (size, array)
+
+
+def letterbox_entry(task, open_image=None):
+    """
+    Process pool worker: letterbox one labeled image and its labels.
+
+    The image comes from open_image() if given (sources without locators),
+    else from the task's locator. It goes to its slot of the shared array when
+    one is open, otherwise to image_out. Returns (width, height, scale, pad_x,
+    pad_y), or None if the image or label file cannot be read.
+    """
+    locator, label_path, image_out, label_out, slot = task
+    size, array = LETTERBOX_TARGET
+    try:
+        with open(label_path) as f:
+            lines = f.read().splitlines()
+        image = open_image() if open_image else open_located_image(locator)
+        with image:
+            width, height = image.size
+            square, scale, pad_x, pad_y = letterbox(image, size)
+    except (OSError, UnicodeDecodeError, Image.DecompressionBombError):
+        return None
+    if array is not None:
+        array[slot] = np.asarray(square)
+    else:
+        os.makedirs(os.path.dirname(image_out), exist_ok=True)
+        square.save(image_out, quality=95)
+    os.makedirs(os.path.dirname(label_out), exist_ok=True)
+    atomic_write_text(label_out, "\n".join(letterbox_label_lines(lines, width, height, size, scale, pad_x, pad_y)))
+    return width, height, scale, pad_x, pad_y
+
+
+class DatasetCatalog:
+    """SQLite index of image metadata and per-class box counts, kept in the destination directory."""
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS images (
+                    name TEXT PRIMARY KEY,
+                    signature TEXT,
+                    width INTEGER,
+                    height INTEGER,
+                    label_mtime INTEGER,
+                    box_count INTEGER
+                );
+                CREATE TABLE IF NOT EXISTS class_counts (
+                    name TEXT,
+                    class_id INTEGER,
+                    count INTEGER,
+                    PRIMARY KEY (name, class_id)
+                );
+                CREATE INDEX IF NOT EXISTS class_counts_by_class ON class_counts (class_id);
+            """)
+
+    def refresh(self, source, label_file, progress=None, batch_size=2000):
+        """
+        Bring the catalog up to date with the source and label files, touching only changed entries.
+
+        Args:
+            source: Image source providing list_images(), signatures() and image_size()
+            label_file (callable): Maps an image name to its label file path
+            progress (callable): Optional progress(done, total) callback
+            batch_size (int): Rows written per transaction
+        """
+        with self.lock:
+            known = {
+                name: (signature, label_mtime)
+                for name, signature, label_mtime in self.connection.execute(
+                    "SELECT name, signature, label_mtime FROM images"
+                )
+            }
+        names = source.list_images()
+        signatures = source.signatures()
+
+        def scan(name):
+            signature, label_mtime = known.get(name, (None, None))
+            size = None
+            if signature != signatures.get(name):
+                try:
+                    size = source.image_size(name)
+                except (OSError, ValueError, Image.DecompressionBombError):
+                    # Unreadable (e.g. truncated) image: recorded without a size
+                    size = (None, None)
+            try:
+                new_label_mtime = os.stat(label_file(name)).st_mtime_ns
+            except OSError:
+                new_label_mtime = None
+            counts = None
+            if new_label_mtime is not None and new_label_mtime != label_mtime:
+                try:
+                    counts = read_label_counts(label_file(name))
+                except (OSError, UnicodeDecodeError):
+                    # Leave the stored label state alone; retried on the next refresh
+                    new_label_mtime = label_mtime
+            return name, size, new_label_mtime, counts
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for start in range(0, len(names), batch_size):
+                rows = list(executor.map(scan, names[start:start + batch_size]))
+                with self.lock, self.connection:
+                    for name, size, label_mtime, counts in rows:
+                        if size is not None:
+                            self.connection.execute(
+                                "INSERT INTO images (name, signature, width, height) VALUES (?, ?, ?, ?) "
+                                "ON CONFLICT(name) DO UPDATE SET signature = excluded.signature, "
+                                "width = excluded.width, height = excluded.height",
+                                (name, signatures.get(name), size[0], size[1])
+                            )
+                        if counts is not None or (label_mtime is None and known.get(name, (0, None))[1]):
+                            self.set_labels(name, label_mtime, counts or Counter())
+                if progress:
+                    progress(min(start + batch_size, len(names)), len(names))
+
+        stale = set(known) - set(names)
+        if stale:
+            with self.lock, self.connection:
+                self.connection.executemany("DELETE FROM images WHERE name = ?", [(n,) for n in stale])
+                self.connection.executemany("DELETE FROM class_counts WHERE name = ?", [(n,) for n in stale])
+
+    def set_labels(self, name, label_mtime, counts):
+        """Record the label file state of one image (caller holds the lock and transaction)."""
+        self.connection.execute(
+            "UPDATE images SET label_mtime = ?, box_count = ? WHERE name = ?",
+            (label_mtime, sum(counts.values()), name)
+        )
+        self.connection.execute("DELETE FROM class_counts WHERE name = ?", (name,))
+        self.connection.executemany(
+            "INSERT INTO class_counts (name, class_id, count) VALUES (?, ?, ?)",
+            [(name, class_id, count) for class_id, count in counts.items()]
+        )
+
+    def update_labels(self, name, label_mtime, counts, size=None):
+        """Record a freshly saved label file."""
+        with self.lock, self.connection:
+            if size is not None:
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO images (name, width, height) VALUES (?, ?, ?)",
+                    (name, size[0], size[1])
+                )
+            self.set_labels(name, label_mtime, counts)
+
+    def image_size(self, name):
+        """Return the cached (width, height) of an image, or None."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT width, height FROM images WHERE name = ?", (name,)
+            ).fetchone()
+        return tuple(row) if row and row[0] is not None else None
+
+    def query_names(self, sql, params=()):
+        """Return the set of image names selected by a query."""
+        with self.lock:
+            return {row[0] for row in self.connection.execute(sql, params)}
+
+    def unlabeled(self):
+        """Return names of images without a label file."""
+        return self.query_names("SELECT name FROM images WHERE label_mtime IS NULL")
+
+    def labeled(self):
+        """Return names of images with a label file."""
+        return self.query_names("SELECT name FROM images WHERE label_mtime IS NOT NULL")
+
+    def with_class(self, class_id):
+        """Return names of images containing at least one box of a class."""
+        return self.query_names(
+            "SELECT name FROM class_counts WHERE class_id = ? AND count > 0", (class_id,)
+        )
+
+    def label_counts(self):
+        """Return {image name: Counter of class id box counts} for every labeled image."""
+        counts = {name: Counter() for name in self.labeled()}
+        with self.lock:
+            for name, class_id, count in self.connection.execute(
+                "SELECT name, class_id, count FROM class_counts"
+            ):
+                if name in counts:
+                    counts[name][class_id] = count
+        return counts
+
+    def summary(self):
+        """Return (image count, labeled count, {class_id: box count})."""
+        with self.lock:
+            total, labeled = self.connection.execute(
+                "SELECT COUNT(*), COUNT(label_mtime) FROM images"
+            ).fetchone()
+            per_class = dict(self.connection.execute(
+                "SELECT class_id, SUM(count) FROM class_counts GROUP BY class_id ORDER BY class_id"
+            ))
+        return total, labeled, per_class
+
+    def close(self):
+        """Close the database connection."""
+        with self.lock:
+            self.connection.close()
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Record one observation."""
+        self.count += 1
+        self.sum += value
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.counts[index] += 1
+
+    def cumulative(self):
+        """Return [(upper bound, cumulative count)] including +Inf."""
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            pairs.append((bound, total))
+        pairs.append(("+Inf", self.count))
+        return pairs
+
+
+class SessionMetrics:
+    """Labeling throughput and latency counters for one session."""
+
+    COUNTERS = {
+        "images_saved": "Images saved",
+        "boxes_drawn": "Boxes drawn by hand",
+        "boxes_detected": "Boxes accepted from auto-detection",
+        "detected_boxes_deleted": "Auto-detected boxes deleted by the annotator",
+    }
+    HISTOGRAMS = {
+        "image_seconds": ("Time spent per saved image", IMAGE_TIME_BUCKETS),
+        "image_load_seconds": ("Image load and render latency", LATENCY_BUCKETS),
+        "inference_seconds": ("Model inference latency", LATENCY_BUCKETS),
+    }
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {name: 0 for name in self.COUNTERS}
+        self.histograms = {name: Histogram(buckets) for name, (_, buckets) in self.HISTOGRAMS.items()}
+
+    def increment(self, name, amount=1):
+        """Add to a counter."""
+        self.counters[name] += amount
+
+    def observe(self, name, value):
+        """Record a histogram observation."""
+        self.histograms[name].observe(value)
+
+    def images_per_hour(self):
+        """Return the saved-image rate over the session so far."""
+        hours = max(time.time() - self.started, 1.0) / 3600
+        return self.counters["images_saved"] / hours
+
+    def prometheus_text(self, host):
+        """Render all metrics in the Prometheus text exposition format."""
+        labels = f'host="{host}"'
+        lines = []
+        for name, help_text in self.COUNTERS.items():
+            lines += [
+                f"# HELP yolo_labeler_{name}_total {help_text}.",
+                f"# TYPE yolo_labeler_{name}_total counter",
+                f"yolo_labeler_{name}_total{{{labels}}} {self.counters[name]}",
+            ]
+        lines += [
+            "# HELP yolo_labeler_images_per_hour Saved images per hour this session.",
+            "# TYPE yolo_labeler_images_per_hour gauge",
+            f"yolo_labeler_images_per_hour{{{labels}}} {self.images_per_hour():.3f}",
+            "# HELP yolo_labeler_session_start_seconds Unix time the session started.",
+            "# TYPE yolo_labeler_session_start_seconds gauge",
+            f"yolo_labeler_session_start_seconds{{{labels}}} {self.started:.0f}",
+        ]
+        for name, (help_text, _) in self.HISTOGRAMS.items():
+            histogram = self.histograms[name]
+            metric = f"yolo_labeler_{name}"
+            lines += [f"# HELP {metric} {help_text}.", f"# TYPE {metric} histogram"]
+            lines += [
+                f'{metric}_bucket{{{labels},le="{bound}"}} {count}'
+                for bound, count in histogram.cumulative()
+            ]
+            lines += [
+                f"{metric}_sum{{{labels}}} {histogram.sum:.6f}",
+                f"{metric}_count{{{labels}}} {histogram.count}",
+            ]
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self, host):
+        """Return all metrics as one JSON-serializable record."""
+        return {
+            "time": time.time(),
+            "host": host,
+            "session_start": self.started,
+            "images_per_hour": round(self.images_per_hour(), 3),
+            "counters": dict(self.counters),
+            "histograms": {
+                name: {"sum": h.sum, "count": h.count, "buckets": h.cumulative()}
+                for name, h in self.histograms.items()
+            },
+        }
+
+    def write(self, path, host):
+        """Write a Prometheus textfile (replaced atomically) or append a JSONL snapshot."""
+        if path.endswith(".jsonl"):
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(self.snapshot(host)) + "\n")
+        else:
+            atomic_write_text(path, self.prometheus_text(host))
+
+
+def load_settings():
+    """Read the per-user settings file, returning {} if it is missing or unreadable."""
+    try:
+        with open(SETTINGS_PATH, encoding="utf-8") as f:
+            settings = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return settings if isinstance(settings, dict) else {}
+
+
+def save_settings(settings):
+    """Write the per-user settings file atomically."""
+    try:
+        atomic_write_text(SETTINGS_PATH, json.dumps(settings, indent=2))
+    except OSError as e:
+        print(f"Warning: could not save settings: {e}")
+
+
+class InferenceWorker:
+    """
+    The single thread that runs background model inference.
+
+    ultralytics predictors are not thread-safe, so background passes queue
+    jobs here instead of each loading a model of their own. The worker keeps
+    one model instance and reloads it only when a job names other weights.
+    Urgent jobs (pre-detection of new images) run ahead of queued batches.
+    """
+
+    URGENT, BULK = 0, 1
+
+    def __init__(self, deliver, idle_timeout=30):
+        self.deliver = deliver
+        self.idle_timeout = idle_timeout
+        self.jobs = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.model = None
+        self.model_path = None
+
+    def submit(self, model_path, work, on_done, on_error, priority=BULK):
+        """Queue work(model); on_done(result) or on_error(exception) is delivered afterwards."""
+        self.jobs.put((priority, next(self.sequence), model_path, work, on_done, on_error))
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def run(self):
+        """Work through queued jobs; the thread exits (keeping the model) once idle."""
+        while True:
+            try:
+                _, _, model_path, work, on_done, on_error = self.jobs.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                with self.lock:
+                    # Checked under the lock so a job submitted meanwhile starts a new thread
+                    if self.jobs.empty():
+                        self.thread = None
+                        return
+                continue
+            try:
+                if model_path != self.model_path:
+                    # Drop the old weights before loading the new ones
+                    self.model, self.model_path = None, None
+                    self.model = YOLO(model_path)
+                    self.model_path = model_path
+                result = work(self.model)
+            except Exception as e:
+                self.deliver(on_error, e)
+                continue
+            self.deliver(on_done, result)
+
+
+class LeaseManager:
+    """
+    Per-image work leases stored as lock files in a shared destination directory.
+
+    A lease is created with O_EXCL, which is atomic on local disks and NFSv3+,
+    and renewed by touching it. Ages are measured against the file server's
+    clock (via a probe file), so clock skew between annotators does not matter.
+    """
+
+    def __init__(self, destination, ttl=LEASE_TTL):
+        self.directory = os.path.join(destination, LEASE_DIRECTORY)
+        os.makedirs(self.directory, exist_ok=True)
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{random.getrandbits(32):08x}"
+        self.clock_path = os.path.join(self.directory, f".clock-{self.owner.replace(':', '-')}")
+        self.held = set()
+
+    def path(self, name):
+        """Return the lease file for an image name."""
+        return os.path.join(self.directory, hashlib.sha1(name.encode("utf-8")).hexdigest() + ".lease")
+
+    def server_now(self):
+        """Return the current time as seen by the file server."""
+        with open(self.clock_path, "w"):
+            pass
+        return os.stat(self.clock_path).st_mtime
+
+    def holder(self, name):
+        """Return the owner string of an image's lease, or None if it is not leased."""
+        try:
+            with open(self.path(name), encoding="utf-8") as f:
+                return json.load(f).get("owner")
+        except (OSError, ValueError):
+            return None
+
+    def claim(self, name):
+        """Lease an image if it is free or its lease went stale; return True if we hold it."""
+        if name in self.held:
+            return True
+        path = self.path(name)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self.reclaim_stale(path):
+                    return False
+                continue
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"owner": self.owner, "name": name}, f)
+            self.held.add(name)
+            return True
+        return False
+
+    def reclaim_stale(self, path):
+        """Remove a lease that has not been renewed within the TTL; return True if removed."""
+        try:
+            if self.server_now() - os.stat(path).st_mtime < self.ttl:
+                return False
+            # Rename first so only one of several reclaimers succeeds
+            stale = f"{path}.stale-{self.owner.replace(':', '-')}"
+            os.rename(path, stale)
+        except OSError:
+            return False
+        try:
+            if self.server_now() - os.stat(stale).st_mtime < self.ttl:
+                # Another annotator re-leased it between our checks: put it back
+                os.link(stale, path)
+                return False
+            return True
+        except OSError:
+            return False
+        finally:
+            try:
+                os.unlink(stale)
+            except OSError:
+                pass
+
+    def release(self, name):
+        """Give up our lease on an image."""
+        if name not in self.held:
+            return
+        self.held.discard(name)
+        if self.holder(name) == self.owner:
+            try:
+                os.unlink(self.path(name))
+            except OSError:
+                pass
+
+    def heartbeat(self, names):
+        """Renew our leases on names; return the ones another annotator has taken over."""
+        lost = []
+        for name in names:
+            try:
+                if self.holder(name) != self.owner:
+                    lost.append(name)
+                    continue
+                os.utime(self.path(name))
+            except OSError:
+                lost.append(name)
+        return lost
+
+    def close(self):
+        """Release every lease held by this instance."""
+        for name in list(self.held):
+            self.release(name)
+        try:
+            os.unlink(self.clock_path)
+        except OSError:
+            pass
+
+
+def pid_alive(pid):
+    """Return True if a process with this id is running on this host."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, but belongs to another user
+        return True
+    except OSError:
+        return False
+    return True
+
+
+class EditJournal:
+    """Append-only log of the annotation edits made to the open image since its last save."""
+
+    def __init__(self, path, sync_every=JOURNAL_SYNC_EVERY, sync_interval=JOURNAL_SYNC_INTERVAL):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.pending = 0
+        self.last_sync = time.monotonic()
+        self.file = open(path, "a", encoding="utf-8")
+
+    def append(self, op, image, **fields):
+        """Append one edit record; fsync is batched by count and age."""
+        record = {"op": op, "image": image}
+        record.update(fields)
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        self.pending += 1
+        if self.pending >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        """Flush pending records to stable storage."""
+        if self.pending:
+            os.fsync(self.file.fileno())
+            self.pending = 0
+        self.last_sync = time.monotonic()
+
+    def reset(self, image=None):
+        """Drop all records, optionally starting a section for a newly opened image."""
+        self.file.seek(0)
+        self.file.truncate()
+        self.pending = 0
+        if image is not None:
+            self.append("open", image)
+        self.sync()
+
+    def close(self):
+        """Sync and close the journal file, keeping it on disk for recovery."""
+        self.sync()
+        self.file.close()
+
+    @staticmethod
+    def stale(directory, host):
+        """Return the journals in directory left by sessions on host that are no longer running."""
+        prefix = f".labeler-journal-{host}"
+        paths = []
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            return paths
+        for entry in entries:
+            if not (entry.name.startswith(prefix) and entry.name.endswith(".jsonl")):
+                continue
+            session = entry.name[len(prefix):-len(".jsonl")]
+            # An empty session is a per-host journal from before journals were per session
+            if session == "" or (session.startswith("-") and session[1:].isdigit()
+                                 and not pid_alive(int(session[1:]))):
+                try:
+                    paths.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    # Recovered and removed by another session meanwhile
+                    pass
+        return [path for _, path in sorted(paths, reverse=True)]
+
+    @staticmethod
+    def read(path):
+        """Return (image, ops) for the unsaved edits recorded in a journal file."""
+        image, ops = None, []
+        try:
+            f = open(path, encoding="utf-8")
+        except FileNotFoundError:
+            return image, ops
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn final record from a crash mid-write
+                    break
+                if record.get("op") == "open":
+                    image, ops = record.get("image"), []
+                elif record.get("image") == image:
+                    ops.append(record)
+        return image, ops
+
+
+def filesystem_type(path):
+    """Return the type of the filesystem path is on (Linux), or None if unknown."""
+    path = os.path.realpath(path)
+    best, fstype = "", None
+    try:
+        with open("/proc/self/mounts", encoding="utf-8") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                # Mount points escape spaces as \040
+                mount_point = fields[1].replace("\\040", " ")
+                inside = path == mount_point or path.startswith(mount_point.rstrip("/") + "/")
+                if inside and len(mount_point) > len(best):
+                    best, fstype = mount_point, fields[2]
+    except OSError:
+        return None
+    return fstype
+
+
+class InotifyWatch:
+    """
+    Non-blocking inotify watch on one directory (Linux only, via libc).
+
+    Only complete files are reported: arrivals are taken from close-after-write
+    and move-in events, so images still being copied are not picked up early.
+    """
+
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_Q_OVERFLOW = 0x4000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_MOVED_FROM | self.IN_DELETE | self.IN_DELETE_SELF
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch failed", directory)
+
+    @classmethod
+    def open(cls, directory):
+        """Return a watch on directory, or None where inotify cannot see every change."""
+        if not sys.platform.startswith("linux") or filesystem_type(directory) in NETWORK_FILESYSTEMS:
+            return None
+        try:
+            return cls(directory)
+        except (OSError, AttributeError):
+            # No inotify in this libc, or the per-user watch limit is reached
+            return None
+
+    def read(self):
+        """
+        Return (arrived, departed, lost) for the events queued since the last read.
+
+        lost is True when the kernel queue overflowed or the directory went
+        away; the caller must then rescan the directory instead.
+        """
+        arrived, departed, lost = [], [], False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = self.EVENT.unpack_from(data, offset)
+                offset += self.EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                if mask & (self.IN_Q_OVERFLOW | self.IN_DELETE_SELF):
+                    lost = True
+                elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+                    arrived.append(name)
+                elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                    departed.append(name)
+        return arrived, departed, lost
+
+    def close(self):
+        """Stop watching."""
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class DirectorySource:
+    """Images stored as plain files in a directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.name = os.path.basename(directory)
+        self.polled_mtime = None
+        # Watch mode state: image names seen so far and the inotify watch, if any
+        self.known = None
+        self.watch = None
+
+    def describe(self):
+        """Return a JSON-serializable description that reopens this source."""
+        return {"kind": "directory", "path": self.directory}
+
+    def list_images(self):
+        """Return the image file names in the directory."""
+        return [f for f in os.listdir(self.directory) if f.lower().endswith(IMAGE_EXTENSIONS)]
+
+    def open_image(self, name):
+        """Open an image lazily (header only until pixels are needed)."""
+        return Image.open(os.path.join(self.directory, name))
+
+    def predict_input(self, name):
+        """Return what the YOLO model should be given for an image."""
+        return os.path.join(self.directory, name)
+
+    def locate(self, name):
+        """Return a picklable locator that worker processes can open."""
+        return ("file", os.path.join(self.directory, name))
+
+    def start_watching(self, names):
+        """Begin reporting changes relative to names, via inotify where it is reliable."""
+        self.known = set(names)
+        self.polled_mtime = None
+        self.watch = InotifyWatch.open(self.directory)
+
+    def stop_watching(self):
+        """Stop reporting changes and release the inotify watch."""
+        if self.watch:
+            self.watch.close()
+        self.watch = None
+        self.known = None
+
+    def poll_changes(self):
+        """
+        Return (added, removed) image names since the last poll.
+
+        With inotify only the queued events are read. Otherwise (other
+        platforms, network filesystems) the directory is listed only when its
+        modification time changed, so an idle poll costs a single stat call.
+        """
+        if self.known is None:
+            # Watching stopped while this poll was queued
+            return [], []
+        if self.watch:
+            arrived, departed, lost = self.watch.read()
+            if not lost:
+                added = [n for n in dict.fromkeys(arrived)
+                         if n.lower().endswith(IMAGE_EXTENSIONS) and n not in self.known
+                         and os.path.exists(os.path.join(self.directory, n))]
+                removed = [n for n in dict.fromkeys(departed)
+                           if n in self.known and not os.path.exists(os.path.join(self.directory, n))]
+                self.known.update(added)
+                self.known.difference_update(removed)
+                return sorted(added), sorted(removed)
+            # Events were dropped: rescan once, then keep polling
+            self.watch.close()
+            self.watch = None
+            self.polled_mtime = None
+        mtime = os.stat(self.directory).st_mtime_ns
+        if mtime == self.polled_mtime:
+            return [], []
+        self.polled_mtime = mtime
+        current = set(self.list_images())
+        added, removed = sorted(current - self.known), sorted(self.known - current)
+        self.known = current
+        return added, removed
+
+    def image_size(self, name):
+        """Return (width, height) read from the file header only."""
+        with self.open_image(name) as image:
+            return image.size
+
+    def signatures(self):
+        """Return a change signature (mtime and size) for every image."""
+        return {
+            entry.name: f"{entry.stat().st_mtime_ns}:{entry.stat().st_size}"
+            for entry in os.scandir(self.directory)
+            if entry.name.lower().endswith(IMAGE_EXTENSIONS)
+        }
+
+    def label_name(self, name):
+        """Return the label file name (relative to the destination) for an image."""
+        return os.path.splitext(name)[0] + ".txt"
+
+
+class ArchiveSource:
+    """Images decoded on demand from a zip or uncompressed tar archive via a member index."""
+
+    def __init__(self, archive_path, cache_directory):
+        self.archive_path = archive_path
+        self.name = os.path.basename(archive_path)
+        self.is_zip = zipfile.is_zipfile(archive_path)
+        self.index = self.load_index(cache_directory)
+        self.handle = open(archive_path, "rb")
+        self.lock = threading.Lock()
+
+    def describe(self):
+        """Return a JSON-serializable description that reopens this source."""
+        return {"kind": "archive", "path": self.archive_path}
+
+    def load_index(self, cache_directory):
+        """Load the cached member index, rebuilding it if the archive changed."""
+        stat = os.stat(self.archive_path)
+        cache_path = os.path.join(cache_directory, f".archive-index-{self.name}.json")
+        try:
+            with open(cache_path, encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached["size"] == stat.st_size and cached["mtime"] == stat.st_mtime_ns:
+                return cached["members"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        members = self.build_index()
+        try:
+            atomic_write_text(cache_path, json.dumps({
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "members": members
+            }))
+        except OSError:
+            pass
+        return members
+
+    def build_index(self):
+        """Scan the archive once and record where each image member lives."""
+        members = {}
+        if self.is_zip:
+            with zipfile.ZipFile(self.archive_path) as zf:
+                for info in zf.infolist():
+                    if info.filename.lower().endswith(IMAGE_EXTENSIONS) and not info.is_dir():
+                        if info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                            continue
+                        members[info.filename] = [
+                            info.header_offset, info.compress_size, info.compress_type
+                        ]
+        else:
+            # "r:" refuses compressed tars, which cannot be read at random offsets
+            with tarfile.open(self.archive_path, "r:") as tf:
+                for info in tf:
+                    if info.isfile() and info.name.lower().endswith(IMAGE_EXTENSIONS):
+                        members[info.name] = [info.offset_data, info.size, 0]
+        return members
+
+    def read_member(self, name):
+        """Read the raw bytes of one member with a single seek."""
+        with self.lock:
+            return read_archive_member(self.handle, self.is_zip, *self.index[name])
+
+    def list_images(self):
+        """Return the image member names in archive order."""
+        return list(self.index)
+
+    def open_image(self, name):
+        """Decode an image member without extracting it."""
+        return Image.open(io.BytesIO(self.read_member(name)))
+
+    def predict_input(self, name):
+        """Return what the YOLO model should be given for an image."""
+        return self.open_image(name).convert("RGB")
+
+    def locate(self, name):
+        """Return a picklable locator that worker processes can open."""
+        return ("archive", self.archive_path, self.is_zip, *self.index[name])
+
+    def image_size(self, name):
+        """Return (width, height) read from the member header only."""
+        with self.open_image(name) as image:
+            return image.size
+
+    def signatures(self):
+        """Return a change signature for every member (archive mtime plus member offset)."""
+        mtime = os.stat(self.archive_path).st_mtime_ns
+        return {name: f"{mtime}:{entry[0]}" for name, entry in self.index.items()}
+
+    def label_name(self, name):
+        """Return the label file name (relative to the destination) for an image."""
+        return os.path.splitext(name)[0] + ".txt"
+
+
+class VideoSource:
+    """Video frames decoded on demand through a seek index and an LRU frame cache."""
+
+    def __init__(self, video_path, frame_step=1, cache_bytes=VIDEO_CACHE_BYTES):
+        if cv2 is None:
+            raise OSError("OpenCV is not installed")
+        self.video_path = video_path
+        self.name = os.path.basename(video_path)
+        self.stem = os.path.splitext(self.name)[0]
+        self.capture = cv2.VideoCapture(video_path)
+        if not self.capture.isOpened():
+            raise OSError(f"cannot open video {video_path}")
+
+        self.frame_count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = self.capture.get(cv2.CAP_PROP_FPS) or 30
+        self.frame_step = max(1, frame_step)
+        # OpenCV does not expose keyframe positions, so seek points sit one
+        # second apart (a typical GOP); short forward jumps decode sequentially
+        self.seek_interval = max(1, int(round(fps)))
+        self.seek_points = list(range(0, self.frame_count, self.seek_interval))
+
+        self.position = 0  # Frame number the next read() returns
+        self.cache = OrderedDict()
+        self.cache_bytes = cache_bytes
+        self.cached_bytes = 0
+        self.lock = threading.Lock()
+
+    def describe(self):
+        """Return a JSON-serializable description that reopens this source."""
+        return {"kind": "video", "path": self.video_path, "frame_step": self.frame_step}
+
+    def frame_number(self, name):
+        """Return the frame number encoded in a frame entry name."""
+        return int(name.rsplit("_", 1)[1])
+
+    def cache_frame(self, number, image):
+        """Insert a decoded frame, evicting the least recently used ones over budget."""
+        if number in self.cache:
+            return
+        self.cache[number] = image
+        self.cached_bytes += image.width * image.height * 3
+        while self.cached_bytes > self.cache_bytes and len(self.cache) > 1:
+            _, old = self.cache.popitem(last=False)
+            self.cached_bytes -= old.width * old.height * 3
+
+    def read_frame(self, number):
+        """Decode one frame, reusing the decoder position when possible."""
+        with self.lock:
+            if number in self.cache:
+                self.cache.move_to_end(number)
+                return self.cache[number]
+
+            if not self.position <= number < self.position + self.seek_interval:
+                seek_point = self.seek_points[bisect.bisect_right(self.seek_points, number) - 1]
+                self.capture.set(cv2.CAP_PROP_POS_FRAMES, seek_point)
+                self.position = seek_point
+
+            # Decode forward to the target, keeping the frames on the way
+            image = None
+            while self.position <= number:
+                ok, frame = self.capture.read()
+                if not ok:
+                    # CAP_PROP_FRAME_COUNT is only an estimate for many containers:
+                    # the stream really ends here, so later listings stop at this frame
+                    self.frame_count = min(self.frame_count, self.position)
+                    raise OSError(f"cannot decode frame {number} of {self.name}")
+                image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+                self.cache_frame(self.position, image)
+                self.position += 1
+            return image
+
+    def list_images(self):
+        """Return one entry per labeled frame, named <video>_<frame>."""
+        return [
+            f"{self.stem}_{number:06d}"
+            for number in range(0, self.frame_count, self.frame_step)
+        ]
+
+    def open_image(self, name):
+        """Decode the frame behind an entry."""
+        return self.read_frame(self.frame_number(name))
+
+    def predict_input(self, name):
+        """Return what the YOLO model should be given for a frame."""
+        return self.open_image(name)
+
+    def locate(self, name):
+        """Frames are decoded sequentially in-process; reopening the video per frame is too slow."""
+        return None
+
+    def image_size(self, name):
+        """Return the (width, height) shared by every frame."""
+        return (
+            int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        )
+
+    def signatures(self):
+        """Return a change signature for every frame entry (video mtime)."""
+        mtime = os.stat(self.video_path).st_mtime_ns
+        return {name: str(mtime) for name in self.list_images()}
+
+    def label_name(self, name):
+        """Return the label file name (relative to the destination) for a frame."""
+        return name + ".txt"
+
+
+def open_described_source(description, destination):
+    """Reopen an image source from the dict returned by its describe()."""
+    if description["kind"] == "archive":
+        return ArchiveSource(description["path"], destination)
+    if description["kind"] == "video":
+        return VideoSource(description["path"], description.get("frame_step", 1))
+    return DirectorySource(description["path"])
+
+
+class SessionRecorder:
+    """Record the main window's input events, dataset and model loads as JSONL.
+
+    Buttons and comboboxes are not recorded: they open dialogs or popups that
+    cannot be replayed, so dataset and model loads are recorded as steps instead.
+    """
+
+    SKIPPED_WIDGETS = (tk.Button, ttk.Button, tk.Menubutton, ttk.Combobox)
+
+    def __init__(self, app, path):
+        self.app = app
+        self.file = open(path, "w", encoding="utf-8")
+        self.started = time.perf_counter()
+        app.update_idletasks()
+        self.note("session", version=1, geometry=app.geometry(), host=socket.gethostname())
+        for sequence in RECORDED_SEQUENCES:
+            app.bind_all(sequence, self.record, add="+")
+
+    def note(self, step, **fields):
+        """Append one record, stamped with seconds since recording started."""
+        if self.file is None:
+            return
+        fields.update(step=step, t=round(time.perf_counter() - self.started, 4))
+        self.file.write(json.dumps(fields) + "\n")
+        self.file.flush()
+
+    def record(self, event):
+        """Record a Tk event delivered to a widget in the main window."""
+        widget = event.widget
+        if not isinstance(widget, tk.Misc) or isinstance(widget, self.SKIPPED_WIDGETS):
+            return
+        if widget.winfo_toplevel() is not self.app:
+            return
+        fields = {"type": event.type.name, "widget": str(widget), "x": event.x, "y": event.y, "state": event.state}
+        if fields["type"] == "KeyPress":
+            fields["keysym"] = event.keysym
+        elif fields["type"] in ("ButtonPress", "ButtonRelease"):
+            fields["button"] = event.num
+        elif fields["type"] == "MouseWheel":
+            fields["delta"] = event.delta
+        self.note("event", **fields)
+
+    def close(self):
+        """Stop recording."""
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+class ImageDrawer(tk.Tk):
+    """Main application class for YOLO Image Labeler."""
+    
+    def __init__(self):
+        super().__init__()
+        self.title("Advanced Image Drawer with YOLO")
+        self.geometry("1200x850")
+
+        # Set by the record/replay harness when recording a session
+        self.recorder = None
+
+        # Results from background threads are handed to the Tk thread through this queue
+        self.ui_queue = queue.Queue()
+        self.after(50, self.process_ui_queue)
+
+        # Menu bar for dataset-wide tools
+        self.menubar = tk.Menu(self)
+        self.dataset_menu = tk.Menu(self.menubar, tearoff=0)
+        self.dataset_menu.add_command(label="Find Near-Duplicates...", command=self.find_duplicates)
+        self.hide_duplicates_var = tk.BooleanVar(value=False)
+        self.dataset_menu.add_checkbutton(
+            label="Hide Duplicates",
+            variable=self.hide_duplicates_var,
+            command=self.refresh_image_list
+        )
+        self.dataset_menu.add_command(
+            label="Copy Annotations to Duplicates",
+            accelerator="Ctrl+D",
+            command=self.copy_annotations_to_duplicates
+        )
+        self.dataset_menu.add_separator()
+        self.watch_var = tk.BooleanVar(value=False)
+        self.dataset_menu.add_checkbutton(
+            label="Watch Source Directory",
+            variable=self.watch_var,
+            command=self.toggle_watch
+        )
+        self.predetect_var = tk.BooleanVar(value=False)
+        self.dataset_menu.add_checkbutton(label="Pre-detect New Images", variable=self.predetect_var)
+        self.lease_var = tk.BooleanVar(value=False)
+        self.dataset_menu.add_checkbutton(
+            label="Share Work via Leases",
+            variable=self.lease_var,
+            command=self.toggle_leases
+        )
+        self.dataset_menu.add_separator()
+        self.dataset_menu.add_command(label="Dataset Summary", command=self.show_dataset_summary)
+        self.dataset_menu.add_command(label="Validate Labels...", command=self.validate_labels)
+        self.dataset_menu.add_separator()
+        self.dataset_menu.add_command(label="Remap Classes...", command=self.remap_classes)
+        self.dataset_menu.add_command(label="Undo Last Class Operation", command=self.undo_class_operation)
+        self.dataset_menu.add_separator()
+        self.dataset_menu.add_command(label="Export Train/Val Split...", command=self.export_split)
+        self.dataset_menu.add_command(label="Export COCO JSON...", command=self.export_coco)
+        self.dataset_menu.add_command(label="Export Pascal VOC...", command=self.export_voc)
+        self.dataset_menu.add_command(label="Export Letterboxed Cache...", command=self.export_letterbox)
+        self.dataset_menu.add_command(label="Import COCO JSON...", command=self.import_coco)
+        self.dataset_menu.add_command(label="Import Pascal VOC...", command=self.import_voc)
+        self.dataset_menu.add_separator()
+        self.dataset_menu.add_command(label="Rank by Model Disagreement", command=self.rank_by_disagreement)
+        self.sort_disagreement_var = tk.BooleanVar(value=False)
+        self.dataset_menu.add_checkbutton(
+            label="Sort by Disagreement",
+            variable=self.sort_disagreement_var,
+            command=self.refresh_image_list
+        )
+        self.menubar.add_cascade(label="Dataset", menu=self.dataset_menu)
+
+        # Model menu: recently used models and background preload at startup
+        self.settings = load_settings()
+        self.model_menu = tk.Menu(self.menubar, tearoff=0)
+        self.model_menu.add_command(label="Load YOLO Model...", command=self.load_yolo_model)
+        self.recent_models_menu = tk.Menu(self.model_menu, tearoff=0)
+        self.model_menu.add_cascade(label="Recent Models", menu=self.recent_models_menu)
+        self.preload_model_var = tk.BooleanVar(value=self.settings.get("preload_model", False))
+        self.model_menu.add_checkbutton(
+            label="Preload Last Model at Startup",
+            variable=self.preload_model_var,
+            command=self.on_preload_toggled
+        )
+        self.menubar.add_cascade(label="Model", menu=self.model_menu)
+
+        # View menu: display-only enhancements that never change saved labels
+        self.view_menu = tk.Menu(self.menubar, tearoff=0)
+        self.gamma_var = tk.DoubleVar(value=1.0)
+        self.view_menu.add_command(label="Gamma...", command=self.ask_gamma)
+        self.stretch_var = tk.BooleanVar(value=False)
+        self.view_menu.add_checkbutton(
+            label="Contrast Stretch", variable=self.stretch_var, command=self.on_display_filter_changed
+        )
+        self.clahe_var = tk.BooleanVar(value=False)
+        self.view_menu.add_checkbutton(
+            label="Local Contrast (CLAHE)", variable=self.clahe_var, command=self.on_display_filter_changed
+        )
+        self.view_menu.add_separator()
+        self.channel_var = tk.StringVar(value="all")
+        for label, value in (("All Channels", "all"), ("Red Only", "red"), ("Green Only", "green"), ("Blue Only", "blue")):
+            self.view_menu.add_radiobutton(
+                label=label, variable=self.channel_var, value=value, command=self.on_display_filter_changed
+            )
+        self.view_menu.add_separator()
+        self.view_menu.add_command(label="Reset Display Filters", command=self.reset_display_filters)
+        self.menubar.add_cascade(label="View", menu=self.view_menu)
+        self.config(menu=self.menubar)
+        self.update_recent_models_menu()
+        if self.preload_model_var.get():
+            self.after_idle(self.preload_model)
+
+        # Store original image dimensions
+        self.original_width = 0
+        self.original_height = 0
+        
+        # YOLO initialization variables
+        self.model = None
+        self.model_path = None
+        self.model_loading = False
+        self.class_names = []
+        self.selected_classes = set()
+        self.class_checkboxes = {}  # Store checkbox variables
+        
+        # YOLO control frame
+        self.yolo_control_frame = tk.Frame(self, bg="lightgray", width=280)
+        self.yolo_control_frame.pack(side=tk.RIGHT, fill=tk.Y)
+        self.yolo_control_frame.pack_propagate(False)
+        
+        # YOLO section label
+        yolo_title = tk.Label(
+            self.yolo_control_frame, 
+            text="YOLO Detection", 
+            font=("Arial", 12, "bold"),
+            bg="lightgray"
+        )
+        yolo_title.pack(pady=(10, 5))
+        
+        # Load YOLO model button
+        self.load_model_btn = tk.Button(
+            self.yolo_control_frame, 
+            text="Load YOLO Model", 
+            command=self.load_yolo_model,
+            bg="#4CAF50",
+            fg="white",
+            font=("Arial", 10, "bold"),
+            cursor="hand2"
+        )
+        self.load_model_btn.pack(pady=5, padx=10, fill=tk.X)
+
+        # Classes section
+        classes_label = tk.Label(
+            self.yolo_control_frame, 
+            text="Detection Classes:", 
+            font=("Arial", 10, "bold"),
+            bg="lightgray"
+        )
+        classes_label.pack(pady=(15, 5))
+
+        # Select All/None buttons frame
+        select_buttons_frame = tk.Frame(self.yolo_control_frame, bg="lightgray")
+        select_buttons_frame.pack(pady=5, fill=tk.X, padx=10)
+        
+        self.select_all_btn = tk.Button(
+            select_buttons_frame,
+            text="Select All",
+            command=self.select_all_classes,
+            state=tk.DISABLED
+        )
+        self.select_all_btn.pack(side=tk.LEFT, expand=True, fill=tk.X, padx=(0, 5))
+        
+        self.select_none_btn = tk.Button(
+            select_buttons_frame,
+            text="Select None",
+            command=self.select_no_classes,
+            state=tk.DISABLED
+        )
+        self.select_none_btn.pack(side=tk.LEFT, expand=True, fill=tk.X)
+
+        # Scrollable frame for class checkboxes
+        self.class_canvas_frame = tk.Frame(self.yolo_control_frame, bg="white", relief=tk.SUNKEN, borderwidth=1)
+        self.class_canvas_frame.pack(pady=5, padx=10, fill=tk.BOTH, expand=True)
+        
+        self.class_canvas = tk.Canvas(self.class_canvas_frame, bg="white", highlightthickness=0)
+        self.class_scrollbar = tk.Scrollbar(self.class_canvas_frame, orient=tk.VERTICAL, command=self.class_canvas.yview)
+        self.class_inner_frame = tk.Frame(self.class_canvas, bg="white")
+        
+        self.class_inner_frame.bind(
+            "<Configure>",
+            lambda e: self.class_canvas.configure(scrollregion=self.class_canvas.bbox("all"))
+        )
+        
+        self.class_canvas.create_window((0, 0), window=self.class_inner_frame, anchor="nw")
+        self.class_canvas.configure(yscrollcommand=self.class_scrollbar.set)
+        
+        self.class_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.class_canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        
+        # Bind mousewheel to canvas
+        self.class_canvas.bind_all("<MouseWheel>", self._on_class_mousewheel)
+        
+        # Confidence threshold setting
+        self.conf_threshold = 0.5
+
+        conf_frame = tk.Frame(self.yolo_control_frame, bg="lightgray")
+        conf_frame.pack(pady=10, padx=10, fill=tk.X)
+        
+        self.conf_label = tk.Label(
+            conf_frame, 
+            text="Confidence: 0.50", 
+            font=("Arial", 9),
+            bg="lightgray"
+        )
+        self.conf_label.pack()
+
+        self.conf_slider = tk.Scale(
+            conf_frame,
+            from_=0, 
+            to=1, 
+            resolution=0.05,
+            orient=tk.HORIZONTAL,
+            command=self.update_confidence_label,
+            showvalue=False
+        )
+        self.conf_slider.set(0.5)
+        self.conf_slider.pack(fill=tk.X)
+
+        # Merge settings for detections that overlap existing annotations
+        self.merge_iou = MERGE_IOU
+        self.merge_label = tk.Label(
+            conf_frame, 
+            text=f"Duplicate IoU: {MERGE_IOU:.2f}", 
+            font=("Arial", 9),
+            bg="lightgray"
+        )
+        self.merge_label.pack()
+
+        self.merge_slider = tk.Scale(
+            conf_frame,
+            from_=0.05, 
+            to=1, 
+            resolution=0.05,
+            orient=tk.HORIZONTAL,
+            command=self.update_merge_label,
+            showvalue=False
+        )
+        self.merge_slider.set(MERGE_IOU)
+        self.merge_slider.pack(fill=tk.X)
+
+        self.merge_policy_var = tk.StringVar(value="Keep existing")
+        self.merge_policy = ttk.Combobox(
+            conf_frame,
+            textvariable=self.merge_policy_var,
+            values=list(MERGE_POLICIES),
+            state="readonly"
+        )
+        self.merge_policy.pack(fill=tk.X, pady=(5, 0))
+
+        # Auto detect button
+        self.auto_detect_btn = tk.Button(
+            self.yolo_control_frame, 
+            text="Run Auto Detect (A)", 
+            command=self.run_yolo_detection,
+            bg="#2196F3",
+            fg="white",
+            font=("Arial", 10, "bold"),
+            cursor="hand2",
+            state=tk.DISABLED
+        )
+        self.auto_detect_btn.pack(pady=10, padx=10, fill=tk.X)
+
+        # Review predictions against saved labels
+        self.review_btn = tk.Button(
+            self.yolo_control_frame, 
+            text="Review vs Labels (R)", 
+            command=self.toggle_review,
+            cursor="hand2",
+            state=tk.DISABLED
+        )
+        self.review_btn.pack(pady=(0, 10), padx=10, fill=tk.X)
+        
+        # Auto detect on load checkbox
+        self.auto_detect_var = tk.BooleanVar()
+        self.auto_detect_toggle = tk.Checkbutton(
+            self.yolo_control_frame, 
+            text="Auto Detect on Load", 
+            variable=self.auto_detect_var,
+            bg="lightgray"
+        )
+        self.auto_detect_toggle.pack(pady=5)
+        
+        # Reset zoom checkbox
+        self.reset_zoom_var = tk.BooleanVar(value=True)
+        self.reset_zoom_toggle = tk.Checkbutton(
+            self.yolo_control_frame,
+            text="Reset Zoom on Image Change",
+            variable=self.reset_zoom_var,
+            bg="lightgray"
+        )
+        self.reset_zoom_toggle.pack(pady=5)
+
+        # Uncertainty ordering checkbox
+        self.uncertainty_order_var = tk.BooleanVar(value=False)
+        self.uncertainty_order_toggle = tk.Checkbutton(
+            self.yolo_control_frame,
+            text="Most Uncertain First",
+            variable=self.uncertainty_order_var,
+            command=self.toggle_uncertainty_order,
+            bg="lightgray"
+        )
+        self.uncertainty_order_toggle.pack(pady=5)
+        
+        # Image list section
+        images_label = tk.Label(
+            self.yolo_control_frame, 
+            text="Images:", 
+            font=("Arial", 10, "bold"),
+            bg="lightgray"
+        )
+        images_label.pack(pady=(15, 5))
+
+        # Image list filter answered from the dataset catalog
+        self.image_filter_var = tk.StringVar(value="All images")
+        self.image_filter = ttk.Combobox(
+            self.yolo_control_frame,
+            textvariable=self.image_filter_var,
+            values=["All images", "Unlabeled only", "Labeled only", "Contains class..."],
+            state="readonly"
+        )
+        self.image_filter.pack(fill=tk.X, padx=10, pady=(0, 5))
+        self.image_filter.bind("<<ComboboxSelected>>", self.on_image_filter)
+        
+        self.image_list_frame = tk.Frame(self.yolo_control_frame)
+        self.image_list_frame.pack(fill=tk.BOTH, expand=True, pady=(0,10), padx=10)
+        
+        self.image_vsb = tk.Scrollbar(self.image_list_frame, orient=tk.VERTICAL)
+        self.image_hsb = tk.Scrollbar(self.image_list_frame, orient=tk.HORIZONTAL)
+        self.image_listbox = tk.Listbox(
+            self.image_list_frame,
+            selectmode=tk.SINGLE,
+            yscrollcommand=self.image_vsb.set,
+            xscrollcommand=self.image_hsb.set
+        )
+        self.image_vsb.config(command=self.image_listbox.yview)
+        self.image_hsb.config(command=self.image_listbox.xview)
+        self.image_vsb.pack(side=tk.RIGHT, fill=tk.Y)
+        self.image_hsb.pack(side=tk.BOTTOM, fill=tk.X)
+        self.image_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.image_listbox.bind("<<ListboxSelect>>", self.on_image_select)
+        
+        # Label colors and initialization
+        self.label_colors = ["red", "blue", "green", "yellow", "purple", "orange", "cyan", "magenta"]
+        self.current_label_id = 0
+        self.current_color = self.label_colors[0]
+        self.labels = [{"id": 0, "name": "Label", "color": "red"}]
+        
+        # Main frames setup
+        self.sidebar = tk.Frame(self, width=220, bg="lightgray")
+        self.sidebar.pack(side=tk.LEFT, fill=tk.Y)
+        self.sidebar.pack_propagate(False)
+        
+        self.main_frame = tk.Frame(self)
+        self.main_frame.pack(side=tk.RIGHT, expand=True, fill=tk.BOTH)
 
-class ImageDrawer(tk.Tk):
-    """Main application class for YOLO Image Labeler."""
+        # Canvas and scrollbars
+        self.canvas = tk.Canvas(self.main_frame, bg="white")
+        self.v_scroll = tk.Scrollbar(self.main_frame, orient=tk.VERTICAL, command=self.scroll_view_y)
+        self.h_scroll = tk.Scrollbar(self.main_frame, orient=tk.HORIZONTAL, command=self.scroll_view_x)
+        self.canvas.configure(yscrollcommand=self.v_scroll.set, xscrollcommand=self.h_scroll.set)
+
+        # Grid layout for canvas
+        self.main_frame.grid_rowconfigure(0, weight=1)
+        self.main_frame.grid_columnconfigure(0, weight=1)
+        self.canvas.grid(row=0, column=0, sticky="nsew")
+        self.v_scroll.grid(row=0, column=1, sticky="ns")
+        self.h_scroll.grid(row=1, column=0, sticky="ew")
+
+        # Status bar at the bottom, with the current image's memory use on the right
+        self.status_frame = tk.Frame(self.main_frame)
+        self.status_frame.grid(row=2, column=0, columnspan=2, sticky="ew")
+        self.status_bar = tk.Label(
+            self.status_frame,
+            text="Ready",
+            bd=1,
+            relief=tk.SUNKEN,
+            anchor=tk.W,
+            font=("Arial", 9)
+        )
+        self.status_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.memory_label = tk.Label(
+            self.status_frame,
+            text="",
+            bd=1,
+            relief=tk.SUNKEN,
+            anchor=tk.E,
+            font=("Arial", 9)
+        )
+        self.memory_label.pack(side=tk.RIGHT)
+
+        # Scroll and zoom bindings
+        self.canvas.bind("<MouseWheel>", self.scroll_vertical)
+        self.canvas.bind("<Alt-MouseWheel>", self.scroll_horizontal)
+        self.canvas.bind("<Control-MouseWheel>", self.zoom)
+        self.canvas.bind("<Configure>", lambda e: self.schedule_render())
+
+        # Zoom level variable
+        self.zoom_level = 1.0
+
+        # Only the visible part of the image is rendered; working_image may be a
+        # downsampled copy (working_scale < 1) when the original exceeds the budget
+        self.image_budget = IMAGE_MEMORY_BUDGET_MB * 1024 * 1024
+        self.working_image = None
+        self.working_scale = 1.0
+        self.full_region = None
+        self.render_job = None
+        self.refine_job = None
+
+        # Viewport renders of the current image keyed by (zoom, viewport, filters);
+        # filters=None holds the unfiltered resample the filters start from
+        self.view_cache = OrderedDict()
+        self.view_cache_bytes = 0
+        
+        # Label management section
+        labels_title = tk.Label(
+            self.sidebar,
+            text="Labels",
+            font=("Arial", 12, "bold"),
+            bg="lightgray"
+        )
+        labels_title.pack(pady=(10, 5))
+        
+        self.label_management = tk.Frame(self.sidebar, bg="lightgray")
+        self.label_management.pack(pady=5)
+        
+        self.add_label_btn = tk.Button(
+            self.label_management, 
+            text="+ Add Label", 
+            command=self.add_label,
+            cursor="hand2"
+        )
+        self.add_label_btn.pack(pady=5)
+        
+        self.labels_frame = tk.Frame(self.sidebar, bg="lightgray")
+        self.labels_frame.pack(fill=tk.BOTH, expand=True, padx=5)
+        self.create_label_widget(0)        
+                      
+        # Control buttons
+        controls_title = tk.Label(
+            self.sidebar,
+            text="Controls",
+            font=("Arial", 12, "bold"),
+            bg="lightgray"
+        )
+        controls_title.pack(pady=(10, 5))
+        
+        self.button_frame = tk.Frame(self.sidebar, bg="lightgray")
+        self.button_frame.pack(side=tk.BOTTOM, fill=tk.X, pady=10)
+        
+        self.buttons_container = tk.Frame(self.button_frame, bg="lightgray")
+        self.buttons_container.pack(fill=tk.X, padx=10)
+        
+        # Control buttons
+        self.load_button = tk.Button(
+            self.buttons_container, 
+            text="Load Images", 
+            command=self.load_images,
+            cursor="hand2"
+        )
+        self.load_button.pack(side=tk.TOP, fill=tk.X, pady=2)
+
+        self.load_archive_button = tk.Button(
+            self.buttons_container, 
+            text="Load Archive", 
+            command=self.load_archive,
+            cursor="hand2"
+        )
+        self.load_archive_button.pack(side=tk.TOP, fill=tk.X, pady=2)
+
+        self.load_video_button = tk.Button(
+            self.buttons_container, 
+            text="Load Video", 
+            command=self.load_video,
+            cursor="hand2"
+        )
+        self.load_video_button.pack(side=tk.TOP, fill=tk.X, pady=2)
+        
+        self.clear_button = tk.Button(
+            self.buttons_container, 
+            text="Clear Rectangles (C)", 
+            command=self.clear_rectangles,
+            cursor="hand2"
+        )
+        self.clear_button.pack(side=tk.TOP, fill=tk.X, pady=2)
+
+        self.confirm_button = tk.Button(
+            self.buttons_container, 
+            text="Save & Next (S)", 
+            command=self.confirm_and_save,
+            bg="#4CAF50",
+            fg="white",
+            font=("Arial", 9, "bold"),
+            cursor="hand2"
+        )
+        self.confirm_button.pack(side=tk.TOP, fill=tk.X, pady=2)
+
+        self.propagate_button = tk.Button(
+            self.buttons_container,
+            text="Propagate Previous Boxes (P)",
+            command=self.propagate_boxes,
+            cursor="hand2"
+        )
+        self.propagate_button.pack(side=tk.TOP, fill=tk.X, pady=2)
+
+        # Grayscale working copy and boxes of the last image left, for propagation
+        self.previous_frame = None
+        # Name of the image currently on the canvas (None until one is shown)
+        self.shown_image = None
+
+        # Drawing variables
+        self.source_directory = ""
+        self.destination_directory = ""
+        self.image_source = None
+        self.all_image_files = []
+
+        # Near-duplicate clusters: image name -> names in its cluster
+        self.duplicate_clusters = {}
+
+        # Uncertainty scores from the background model pass and the (model path,
+        # threshold) they were computed with; bumping the generation stops a running pass
+        self.image_scores = {}
+        self.image_scores_key = None
+        self.scoring_generation = 0
+        self.rescore_job = None
+        self.last_ranking_refresh = 0.0
+
+        # Watch mode state and raw detections pre-computed for newly arrived images
+        self.watch_job = None
+        self.watch_polling = False
+        self.predetections = {}
+
+        # Background inference (ranking passes, pre-detection) shares one model instance
+        self.inference = InferenceWorker(self.call_in_ui)
+
+        # Work leases shared with other annotators on the same destination directory
+        self.leases = None
+        self.lease_job = None
+
+        # Review mode overlays (canvas id, original coords) and per-image disagreement
+        self.review_items = []
+        self.review_active = False
+        self.disagreement_scores = {}
+
+        # Dataset catalog and the set of names the current list filter allows (None = all)
+        self.catalog = None
+        self.catalog_ready = False
+        self.catalog_filter = None
+        self.image_files = []
+        self.current_index = 0
+        self.rectangles = []
+        self.rect_coords = []
+        self.start_x = None
+        self.start_y = None
+        self.rect_id = None
+
+        # Right-click selection variables
+        self.right_dragging = False
+        self.right_drag_start_x = None
+        self.right_drag_start_y = None
+        self.sel_rect_id = None
+
+        # Session throughput metrics, written periodically to a textfile/JSONL
+        self.metrics = SessionMetrics()
+        self.image_shown_at = None
+        self.after(METRICS_INTERVAL * 1000, self.write_metrics)
+
+        # Edit journal for crash recovery; dirty is set by any edit since load/save
+        self.journal = None
+        self.dirty = False
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.after(int(JOURNAL_SYNC_INTERVAL * 1000), self.sync_journal)
+
+        # Left-click drawing bindings
+        self.bind("<ButtonPress-1>", self.start_drawing)
+        self.bind("<B1-Motion>", self.drawing)
+        self.bind("<ButtonRelease-1>", self.finish_drawing)
+
+        # Undo/redo stacks
+        self.undo_stack = []
+        self.redo_stack = []
+        
+        # Undo/redo bindings
+        self.bind("<Control-z>", self.undo)
+        self.bind("<Control-y>", self.redo)
+        self.bind("<Control-Z>", self.undo)
+        self.bind("<Control-Y>", self.redo)
+        
+        # Right-click bindings for selection
+        self.canvas.bind("<ButtonPress-3>", self.start_right_drag)
+        self.canvas.bind("<B3-Motion>", self.right_drag)
+        self.canvas.bind("<ButtonRelease-3>", self.end_right_drag)
+        
+        # General keyboard shortcuts
+        self.bind("<KeyPress-s>", lambda event: self.confirm_and_save())
+        self.bind("<KeyPress-a>", lambda event: self.run_yolo_detection())
+        self.bind("<KeyPress-r>", lambda event: self.toggle_review())
+        self.bind("<KeyPress-p>", lambda event: self.propagate_boxes())
+        self.bind("<KeyPress-c>", lambda event: self.clear_rectangles())
+        self.bind("<Delete>", self.delete_selected_label)
+        self.bind("<Control-d>", lambda event: self.copy_annotations_to_duplicates())
+        
+        # Navigation shortcuts
+        self.bind("<Left>", self.previous_image)
+        self.bind("<Right>", self.next_image)
+        
+        # Label shortcuts (0-9)
+        for i in range(10):
+            self.bind(f"<KeyPress-{i}>", lambda event, d=i: self.select_label_by_number(d))
+            self.bind(f"<Alt-KeyPress-{i}>", lambda event, d=i: self.create_new_label_by_number(d))
+
+    def _on_class_mousewheel(self, event):
+        """Handle mousewheel scrolling for class list."""
+        if self.class_canvas.winfo_exists():
+            self.class_canvas.yview_scroll(int(-1*(event.delta/120)), "units")
+
+    def update_confidence_label(self, value):
+        """Update confidence threshold label."""
+        self.conf_threshold = float(value)
+        self.conf_label.config(text=f"Confidence: {float(value):.2f}")
+        self.schedule_rescoring()
+
+    def process_ui_queue(self):
+        """Run callbacks queued by background threads on the Tk thread."""
+        try:
+            while True:
+                callback, args = self.ui_queue.get_nowait()
+                try:
+                    callback(*args)
+                except Exception:
+                    # Report like any Tk callback error, but keep delivering results
+                    self.report_callback_exception(*sys.exc_info())
+        except queue.Empty:
+            pass
+        finally:
+            self.after(50, self.process_ui_queue)
+
+    def call_in_ui(self, callback, *args):
+        """Schedule callback(*args) on the Tk thread; safe to call from any thread."""
+        self.ui_queue.put((callback, args))
+
+    def run_in_background(self, work, on_done, description=None):
+        """Run work() on a worker thread and pass its result to on_done on the Tk thread."""
+        def runner():
+            try:
+                result = work()
+            except Exception as e:
+                if description:
+                    self.call_in_ui(messagebox.showerror, "Error", f"{description} failed: {e}")
+                    self.call_in_ui(self.update_status, f"{description} failed")
+                else:
+                    self.call_in_ui(self.update_status, f"Background task failed: {e}")
+                return
+            self.call_in_ui(on_done, result)
+
+        if description:
+            self.update_status(f"{description}...", duration=0)
+        threading.Thread(target=runner, daemon=True).start()
+
+    def run_inference(self, model_path, work, on_done, on_error=None, priority=InferenceWorker.BULK):
+        """Queue work(model) on the shared inference worker and pass its result to on_done on the Tk thread."""
+        if on_error is None:
+            on_error = lambda e: self.update_status(f"Background inference failed: {e}")
+        self.inference.submit(model_path, work, on_done, on_error, priority)
+
+    def sync_journal(self):
+        """Periodically flush batched journal records to disk."""
+        if self.journal:
+            self.journal.sync()
+        self.after(int(JOURNAL_SYNC_INTERVAL * 1000), self.sync_journal)
+
+    def record_edit(self, op, rect=None):
+        """Append an annotation edit on the current image to the session journal."""
+        if not self.image_files:
+            return
+        self.dirty = True
+        if self.journal is None:
+            return
+        fields = {}
+        if rect is not None:
+            fields = {"label_id": rect["label_id"], "coords": [float(c) for c in rect["coords"]]}
+        self.journal.append(op, self.image_files[self.current_index], **fields)
+
+    def apply_journal_ops(self, ops):
+        """Replay journaled edits on top of the annotations loaded for the current image."""
+        for record in ops:
+            if record["op"] == "add":
+                self.add_detected_rectangle(record["label_id"], tuple(record["coords"]))
+            elif record["op"] == "delete":
+                coords = tuple(record["coords"])
+                for i, rect in enumerate(self.rectangles):
+                    if rect["label_id"] == record["label_id"] and all(
+                        abs(a - b) < 1e-6 for a, b in zip(rect["coords"], coords)
+                    ):
+                        self.canvas.delete(self.rect_coords[i])
+                        del self.rect_coords[i]
+                        del self.rectangles[i]
+                        self.record_edit("delete", record)
+                        break
+            elif record["op"] == "clear":
+                self.clear_rectangles()
+
+    def metrics_path(self):
+        """Return where metrics go: $YOLO_LABELER_METRICS, else the destination directory."""
+        path = os.environ.get(METRICS_ENV)
+        if path:
+            return path
+        if self.destination_directory:
+            return os.path.join(self.destination_directory, f".labeler-metrics-{socket.gethostname()}.prom")
+        return None
+
+    def write_metrics(self, reschedule=True):
+        """Periodically export session metrics for a node exporter textfile collector."""
+        path = self.metrics_path()
+        if path:
+            try:
+                self.metrics.write(path, socket.gethostname())
+            except OSError:
+                pass
+        if reschedule:
+            self.after(METRICS_INTERVAL * 1000, self.write_metrics)
+
+    def on_close(self):
+        """Close the journal cleanly before exiting; unsaved edits stay recoverable."""
+        self.write_metrics(reschedule=False)
+        self.save_class_selection()
+        if self.recorder:
+            self.recorder.close()
+        if self.leases:
+            self.leases.close()
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+        self.destroy()
+
+    def update_merge_label(self, value):
+        """Update duplicate IoU threshold label."""
+        self.merge_iou = float(value)
+        self.merge_label.config(text=f"Duplicate IoU: {float(value):.2f}")
+
+    def update_status(self, message, duration=3000):
+        """Update status bar with a message."""
+        self.status_bar.config(text=message)
+        if duration > 0:
+            self.after(duration, lambda: self.status_bar.config(text="Ready"))
+
+    def select_all_classes(self):
+        """Select all YOLO classes."""
+        for var in self.class_checkboxes.values():
+            var.set(True)
+        self.update_selected_classes()
+        self.update_status("All classes selected")
+
+    def select_no_classes(self):
+        """Deselect all YOLO classes."""
+        for var in self.class_checkboxes.values():
+            var.set(False)
+        self.update_selected_classes()
+        self.update_status("All classes deselected")
+
+    def update_selected_classes(self):
+        """Update the set of selected classes based on checkboxes."""
+        self.selected_classes = set()
+        for class_id, var in self.class_checkboxes.items():
+            if var.get():
+                self.selected_classes.add(class_id)
+
+    def select_label_by_number(self, num):
+        """Select a label by its numeric index."""
+        if num < len(self.labels):
+            self.current_label_id = self.labels[num]["id"]
+            self.current_color = self.labels[num]["color"]
+            # Update visual selection
+            for label in self.labels:
+                if label["id"] == num:
+                    label["widget"].config(bg="lightblue")
+                else:
+                    label["widget"].config(bg="SystemButtonFace")
+            self.update_status(f"Selected label: {self.labels[num]['name']}")
     
-    def __init__(self):
-        super().__init__()
-        self.title("Advanced Image Drawer with YOLO")
-        self.geometry("1200x850")
+    def create_new_label_by_number(self, num):
+        """Create a new label with Alt+number shortcut."""
+        if num == len(self.labels):
+            label_name = simpledialog.askstring("New Label", f"Enter name for new label {num}:")
+            if label_name:
+                new_id = num
+                color = self.label_colors[new_id % len(self.label_colors)]
+                self.labels.append({
+                    "id": new_id,
+                    "name": label_name,
+                    "color": color
+                })
+                self.create_label_widget(new_id)
+                self.update_status(f"Created label: {label_name}")
 
-        # Store original image dimensions
-        self.original_width = 0
-        self.original_height = 0
+    def add_label(self):
+        """Add a new label through the UI button."""
+        label_name = simpledialog.askstring("New Label", "Enter label name:")
+        if label_name:
+            new_id = len(self.labels)
+            color = self.label_colors[new_id % len(self.label_colors)]
+            self.labels.append({
+                "id": new_id,
+                "name": label_name,
+                "color": color
+            })
+            self.create_label_widget(new_id)
+            self.update_status(f"Created label: {label_name}")
+
+    def create_label_widget(self, label_id):
+        """Create UI widget for a label."""
+        label = next((l for l in self.labels if l["id"] == label_id), None)
+        if not label:
+            return
+
+        frame = tk.Frame(self.labels_frame, relief=tk.RAISED, borderwidth=1, bg="white")
+        frame.pack(fill=tk.X, padx=2, pady=2)
         
-        # YOLO initialization variables
-        self.model = None
-        self.class_names = []
-        self.selected_classes = set()
-        self.class_checkboxes = {}  # Store checkbox variables
+        # Color indicator
+        color_canvas = tk.Canvas(frame, width=20, height=20, bg=label["color"], highlightthickness=0)
+        color_canvas.pack(side=tk.LEFT, padx=5, pady=2)
         
-        # YOLO control frame
-        self.yolo_control_frame = tk.Frame(self, bg="lightgray", width=280)
-        self.yolo_control_frame.pack(side=tk.RIGHT, fill=tk.Y)
-        self.yolo_control_frame.pack_propagate(False)
+        # Label name with ID
+        label_text = f"[{label['id']}] {label['name']}"
+        label_name = tk.Label(frame, text=label_text, bg="white")
+        label_name.pack(side=tk.LEFT, padx=5)
         
-        # YOLO section label
-        yolo_title = tk.Label(
-            self.yolo_control_frame, 
-            text="YOLO Detection", 
-            font=("Arial", 12, "bold"),
-            bg="lightgray"
-        )
-        yolo_title.pack(pady=(10, 5))
+        # Click handler to select label
+        def select_label(event):
+            self.current_label_id = label["id"]
+            self.current_color = label["color"]
+            for child in self.labels_frame.winfo_children():
+                child.config(bg="white")
+            frame.config(bg="lightblue")
+            self.update_status(f"Selected label: {label['name']}")
         
-        # Load YOLO model button
-        self.load_model_btn = tk.Button(
-            self.yolo_control_frame, 
-            text="Load YOLO Model", 
-            command=self.load_yolo_model,
-            bg="#4CAF50",
-            fg="white",
-            font=("Arial", 10, "bold"),
-            cursor="hand2"
-        )
-        self.load_model_btn.pack(pady=5, padx=10, fill=tk.X)
+        frame.bind("<Button-1>", select_label)
+        color_canvas.bind("<Button-1>", select_label)
+        label_name.bind("<Button-1>", select_label)
+        
+        label["widget"] = frame
 
-        # Classes section
-        classes_label = tk.Label(
-            self.yolo_control_frame, 
-            text="Detection Classes:", 
-            font=("Arial", 10, "bold"),
-            bg="lightgray"
+    def load_yolo_model(self):
+        """Load a YOLO model from file."""
+        if YOLO is None:
+            messagebox.showerror("Error", "Ultralytics not installed. Please install it to use YOLO features.")
+            return
+            
+        model_path = filedialog.askopenfilename(
+            title="Select YOLO Model", 
+            filetypes=[("PyTorch Model", "*.pt")]
         )
-        classes_label.pack(pady=(15, 5))
+        if model_path:
+            self.load_model_file(model_path)
 
-        # Select All/None buttons frame
-        select_buttons_frame = tk.Frame(self.yolo_control_frame, bg="lightgray")
-        select_buttons_frame.pack(pady=5, fill=tk.X, padx=10)
-        
-        self.select_all_btn = tk.Button(
-            select_buttons_frame,
-            text="Select All",
-            command=self.select_all_classes,
-            state=tk.DISABLED
-        )
-        self.select_all_btn.pack(side=tk.LEFT, expand=True, fill=tk.X, padx=(0, 5))
+    def load_model_file(self, model_path, preload=False):
+        """
+        Load the YOLO model at model_path off the Tk thread and set up its class list.
+
+        The model runs one warm-up inference on a blank image before it is
+        handed over, so lazy predictor setup does not slow the first auto-detect.
+        A failed startup preload only reports in the status bar.
+        """
+        if self.model_loading:
+            self.update_status("A model is already loading")
+            return
+        if self.recorder:
+            self.recorder.note("model", path=model_path)
+        self.model_loading = True
+        self.load_model_btn.config(state=tk.DISABLED)
+
+        def work():
+            model = YOLO(model_path)
+            model.predict(np.zeros((WARMUP_SIZE, WARMUP_SIZE, 3), dtype=np.uint8), verbose=False)
+            return model
+
+        def on_done(model):
+            self.model_loading = False
+            self.load_model_btn.config(state=tk.NORMAL)
+            self.model = model
+            self.model_path = model_path
+            self.predetections = {}
+            self.schedule_rescoring()
+            self.class_names = self.model.names
+            self.create_class_checkboxes()
+            
+            # Enable buttons
+            self.select_all_btn.config(state=tk.NORMAL)
+            self.select_none_btn.config(state=tk.NORMAL)
+            self.auto_detect_btn.config(state=tk.NORMAL)
+            self.review_btn.config(state=tk.NORMAL)
+            
+            # Restore the class selection last used with this model, else select all
+            saved = self.settings.get("selected_classes", {}).get(os.path.abspath(model_path))
+            if saved is None:
+                self.select_all_classes()
+            else:
+                for class_id, var in self.class_checkboxes.items():
+                    var.set(class_id in saved)
+                self.update_selected_classes()
+
+            recent = [p for p in self.settings.get("recent_models", []) if p != os.path.abspath(model_path)]
+            self.settings["recent_models"] = [os.path.abspath(model_path)] + recent[:RECENT_MODELS - 1]
+            save_settings(self.settings)
+            self.update_recent_models_menu()
+            
+            model_name = os.path.basename(model_path)
+            self.update_status(f"Model loaded: {model_name} ({len(self.class_names)} classes)")
+
+        def runner():
+            try:
+                result = work()
+            except Exception as e:
+                self.call_in_ui(self.on_model_load_failed, e, preload)
+                return
+            self.call_in_ui(on_done, result)
+
+        self.update_status(f"Loading YOLO model {os.path.basename(model_path)}...", duration=0)
+        threading.Thread(target=runner, daemon=True).start()
+
+    def on_model_load_failed(self, error, preload):
+        """Report a model that could not be loaded or warmed up."""
+        self.model_loading = False
+        self.load_model_btn.config(state=tk.NORMAL)
+        if preload:
+            self.update_status(f"Could not preload model: {error}")
+        else:
+            messagebox.showerror("Error", f"Error loading model: {error}")
+            self.update_status("Error loading model")
+
+    def update_recent_models_menu(self):
+        """List recently loaded models in the Model menu."""
+        self.recent_models_menu.delete(0, tk.END)
+        recent = self.settings.get("recent_models", [])
+        for path in recent:
+            self.recent_models_menu.add_command(label=path, command=lambda p=path: self.load_recent_model(p))
+        if not recent:
+            self.recent_models_menu.add_command(label="(none)", state=tk.DISABLED)
+
+    def load_recent_model(self, model_path):
+        """Load a model picked from the Recent Models menu."""
+        if YOLO is None:
+            messagebox.showerror("Error", "Ultralytics not installed. Please install it to use YOLO features.")
+            return
+        if not os.path.exists(model_path):
+            messagebox.showerror("Error", f"Model file not found:\n{model_path}")
+            return
+        self.load_model_file(model_path)
+
+    def on_preload_toggled(self):
+        """Remember whether the last model should be preloaded at startup."""
+        self.settings["preload_model"] = self.preload_model_var.get()
+        save_settings(self.settings)
+
+    def preload_model(self):
+        """Load the most recent model in the background so detection is ready at once."""
+        recent = self.settings.get("recent_models", [])
+        if YOLO is None or not recent or self.model is not None:
+            return
+        if os.path.exists(recent[0]):
+            self.load_model_file(recent[0], preload=True)
+
+    def save_class_selection(self):
+        """Remember the selected classes for the current model."""
+        if self.model_path:
+            selections = self.settings.setdefault("selected_classes", {})
+            selections[os.path.abspath(self.model_path)] = sorted(self.selected_classes)
+            save_settings(self.settings)
+
+    def create_class_checkboxes(self):
+        """Create checkboxes for each YOLO class."""
+        # Clear existing checkboxes
+        for widget in self.class_inner_frame.winfo_children():
+            widget.destroy()
+        self.class_checkboxes.clear()
         
-        self.select_none_btn = tk.Button(
-            select_buttons_frame,
-            text="Select None",
-            command=self.select_no_classes,
-            state=tk.DISABLED
+        # Create new checkboxes
+        for i, name in self.class_names.items():
+            var = tk.BooleanVar(value=False)
+            self.class_checkboxes[i] = var
+            
+            frame = tk.Frame(self.class_inner_frame, bg="white")
+            frame.pack(fill=tk.X, padx=5, pady=2)
+            
+            # Color indicator
+            color = self.label_colors[i % len(self.label_colors)]
+            color_box = tk.Canvas(frame, width=15, height=15, bg=color, highlightthickness=0)
+            color_box.pack(side=tk.LEFT, padx=(0, 5))
+            
+            # Checkbox with class name
+            cb = tk.Checkbutton(
+                frame,
+                text=f"[{i}] {name}",
+                variable=var,
+                command=self.update_selected_classes,
+                bg="white",
+                anchor="w"
+            )
+            cb.pack(side=tk.LEFT, fill=tk.X, expand=True)
+
+    def run_yolo_detection(self):
+        """Run YOLO detection on the current image."""
+        if not self.model or not self.image_files:
+            self.update_status("No model or images loaded")
+            return
+
+        if not self.selected_classes:
+            messagebox.showwarning("No Classes Selected", "Please select at least one class for detection.")
+            return
+
+        self.update_status("Running detection...")
+        try:
+            boxes, classes, confidences = self.predict_current_image()
+        except OSError as e:
+            self.update_status(f"Detection failed: {e}")
+            return
+
+        # Merge against what is already on the image instead of stacking duplicates
+        add, remove = merge_detections(
+            boxes, classes, confidences,
+            [rect["coords"] for rect in self.rectangles],
+            [rect["label_id"] for rect in self.rectangles],
+            [rect.get("conf", 1.0) for rect in self.rectangles],
+            self.merge_iou,
+            MERGE_POLICIES[self.merge_policy_var.get()]
         )
-        self.select_none_btn.pack(side=tk.LEFT, expand=True, fill=tk.X)
+        # Replacements and additions undo together, so one Ctrl+Z never leaves a duplicate
+        batch = []
+        for rect_id in [self.rect_coords[i] for i in remove]:
+            self.delete_rectangle(rect_id, by_user=False)
+            batch.append(self.undo_stack.pop())
 
-        # Scrollable frame for class checkboxes
-        self.class_canvas_frame = tk.Frame(self.yolo_control_frame, bg="white", relief=tk.SUNKEN, borderwidth=1)
-        self.class_canvas_frame.pack(pady=5, padx=10, fill=tk.BOTH, expand=True)
-        
-        self.class_canvas = tk.Canvas(self.class_canvas_frame, bg="white", highlightthickness=0)
-        self.class_scrollbar = tk.Scrollbar(self.class_canvas_frame, orient=tk.VERTICAL, command=self.class_canvas.yview)
-        self.class_inner_frame = tk.Frame(self.class_canvas, bg="white")
+        for i in add:
+            x1, y1, x2, y2 = boxes[i]
+            self.add_detected_rectangle(int(classes[i]), (x1, y1, x2, y2), float(confidences[i]))
+            batch.append({'type': 'add', 'data': self.rectangles[-1].copy()})
+        if batch:
+            self.undo_stack.append({'type': 'batch', 'actions': batch})
+            self.redo_stack.clear()
+        self.metrics.increment("boxes_detected", len(add))
         
-        self.class_inner_frame.bind(
-            "<Configure>",
-            lambda e: self.class_canvas.configure(scrollregion=self.class_canvas.bbox("all"))
+        status_msg = f"Detection complete: {len(add)} objects added"
+        if len(add) < len(boxes):
+            status_msg += f", {len(boxes) - len(add)} duplicates skipped"
+        if remove:
+            status_msg += f", {len(remove)} existing replaced"
+        self.update_status(status_msg)
+
+    def predict_current_image(self):
+        """Return (boxes, classes, confidences) for the current image, filtered by threshold and class."""
+        name = self.image_files[self.current_index]
+        raw = self.predetections.get(name) if self.conf_threshold >= PREDETECT_CONF else None
+        if raw is None:
+            inference_started = time.perf_counter()
+            results = self.model.predict(self.image_source.predict_input(name), verbose=False)
+            self.metrics.observe("inference_seconds", time.perf_counter() - inference_started)
+            raw = raw_predictions(results)
+
+        boxes, classes, confidences = raw
+        keep = (confidences >= self.conf_threshold) & np.isin(classes, list(self.selected_classes))
+        return boxes[keep], classes[keep], confidences[keep]
+
+    def toggle_review(self):
+        """Color boxes by agreement between the model and the loaded annotations."""
+        if self.review_active:
+            self.clear_review()
+            self.update_status("Review mode off")
+            return
+        if not self.model or not self.image_files:
+            self.update_status("No model or images loaded")
+            return
+        if not self.selected_classes:
+            messagebox.showwarning("No Classes Selected", "Please select at least one class for detection.")
+            return
+
+        self.update_status("Reviewing predictions...")
+        try:
+            boxes, classes, _ = self.predict_current_image()
+        except OSError as e:
+            self.update_status(f"Review failed: {e}")
+            return
+        # Boxes of unselected classes are left out, as they are left out of the predictions
+        reviewed = [i for i, rect in enumerate(self.rectangles) if rect["label_id"] in self.selected_classes]
+        gt_boxes = [self.rectangles[i]["coords"] for i in reviewed]
+        gt_classes = [self.rectangles[i]["label_id"] for i in reviewed]
+        matches, false_positives, false_negatives = match_boxes(boxes, classes, gt_boxes, gt_classes)
+
+        for _, g in matches:
+            self.canvas.itemconfig(self.rect_coords[reviewed[g]], outline=REVIEW_COLORS["tp"])
+        for g in false_negatives:
+            self.canvas.itemconfig(self.rect_coords[reviewed[g]], outline=REVIEW_COLORS["fn"])
+        for p in false_positives:
+            coords = tuple(float(c) for c in boxes[p])
+            item = self.canvas.create_rectangle(
+                *(c * self.zoom_level for c in coords),
+                outline=REVIEW_COLORS["fp"],
+                dash=(6, 3),
+                width=2
+            )
+            self.review_items.append((item, coords))
+        self.review_active = True
+        self.update_status(
+            f"Review: {len(matches)} matched (green), {len(false_positives)} false positives (magenta), "
+            f"{len(false_negatives)} missed (orange)",
+            duration=0
         )
-        
-        self.class_canvas.create_window((0, 0), window=self.class_inner_frame, anchor="nw")
-        self.class_canvas.configure(yscrollcommand=self.class_scrollbar.set)
-        
-        self.class_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.class_canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        
-        # Bind mousewheel to canvas
-        self.class_canvas.bind_all("<MouseWheel>", self._on_class_mousewheel)
-        
-        # Confidence threshold setting
-        self.conf_threshold = 0.5
 
-        conf_frame = tk.Frame(self.yolo_control_frame, bg="lightgray")
-        conf_frame.pack(pady=10, padx=10, fill=tk.X)
-        
-        self.conf_label = tk.Label(
-            conf_frame, 
-            text="Confidence: 0.50", 
-            font=("Arial", 9),
-            bg="lightgray"
+    def clear_review(self):
+        """Remove review overlays and restore label colors."""
+        if not self.review_active:
+            return
+        for item, _ in self.review_items:
+            self.canvas.delete(item)
+        self.review_items = []
+        for rect, rect_id in zip(self.rectangles, self.rect_coords):
+            self.canvas.itemconfig(rect_id, outline=self.get_label_color(rect["label_id"]))
+        self.review_active = False
+
+    def rank_by_disagreement(self):
+        """Score every image by model-vs-label disagreement in the background and sort worst first."""
+        if not self.model_path or not self.image_files:
+            self.update_status("Load a model and images to rank by disagreement")
+            return
+        if not self.selected_classes:
+            messagebox.showwarning("No Classes Selected", "Please select at least one class for detection.")
+            return
+
+        source = self.image_source
+        model_path = self.model_path
+        threshold = self.conf_threshold
+        selected = list(self.selected_classes)
+        names = list(self.all_image_files)
+        destination = self.destination_directory
+
+        def disagreement(name, result):
+            keep = np.isin(result.boxes.cls.cpu().numpy().astype(int), selected)
+            pred_boxes = result.boxes.xyxyn.cpu().numpy()[keep]
+            pred_classes = result.boxes.cls.cpu().numpy().astype(int)[keep]
+            gt_classes, gt_boxes = read_label_boxes(os.path.join(destination, source.label_name(name)))
+            gt_keep = np.isin(gt_classes, selected)
+            gt_classes, gt_boxes = gt_classes[gt_keep], gt_boxes[gt_keep]
+            _, false_positives, false_negatives = match_boxes(pred_boxes, pred_classes, gt_boxes, gt_classes)
+            return name, float(len(false_positives) + len(false_negatives))
+
+        def read_input(name):
+            # An unreadable image (or a frame past the real end of a video) is left unscored
+            try:
+                return source.predict_input(name)
+            except OSError:
+                return None
+
+        scores = {}
+        failed = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=4)
+
+        def score(batch):
+            def work(model):
+                if failed.is_set():
+                    return 0
+                # Decode the batch in parallel, then match labels in parallel
+                inputs = dict(zip(batch, executor.map(read_input, batch)))
+                readable = [n for n in batch if inputs[n] is not None]
+                if readable:
+                    results = model.predict([inputs[n] for n in readable], conf=threshold, verbose=False)
+                    scores.update(executor.map(disagreement, readable, results))
+                return len(batch)
+            return work
+
+        reviewed = 0
+
+        def on_batch(count):
+            nonlocal reviewed
+            if failed.is_set():
+                return
+            reviewed += count
+            self.update_status(f"Reviewed {reviewed}/{len(names)} images", duration=0)
+            if reviewed == len(names):
+                executor.shutdown(wait=False)
+                self.on_disagreement_ranked(scores)
+
+        def on_error(e):
+            # Later batches see the flag and skip their inference
+            if not failed.is_set():
+                failed.set()
+                executor.shutdown(wait=False)
+                messagebox.showerror("Error", f"Ranking images by disagreement failed: {e}")
+                self.update_status("Ranking images by disagreement failed")
+
+        self.update_status("Ranking images by disagreement...", duration=0)
+        for start in range(0, len(names), UNCERTAINTY_BATCH):
+            self.run_inference(model_path, score(names[start:start + UNCERTAINTY_BATCH]), on_batch, on_error)
+
+    def on_disagreement_ranked(self, scores):
+        """Sort the queue by disagreement and jump to the worst image."""
+        self.disagreement_scores = scores
+        self.uncertainty_order_var.set(False)
+        self.sort_disagreement_var.set(True)
+        self.refresh_image_list()
+        disagreeing = sum(1 for score in scores.values() if score > 0)
+        self.update_status(f"{disagreeing} of {len(scores)} images disagree with the model")
+        if self.image_files:
+            self.current_index = 0
+            self.show_image(0)
+            self.image_listbox.selection_clear(0, tk.END)
+            self.image_listbox.selection_set(0)
+            self.image_listbox.see(0)
+
+    def add_detected_rectangle(self, class_id, coords, conf=None):
+        """Add a rectangle detected by YOLO."""
+        # Create label if it doesn't exist
+        if not any(label["id"] == class_id for label in self.labels):
+            self.create_new_label_from_id(class_id)
+    
+        # Calculate scaled coordinates based on current zoom
+        scaled_coords = (
+            coords[0] * self.zoom_level,
+            coords[1] * self.zoom_level,
+            coords[2] * self.zoom_level,
+            coords[3] * self.zoom_level
         )
-        self.conf_label.pack()
-
-        self.conf_slider = tk.Scale(
-            conf_frame,
-            from_=0, 
-            to=1, 
-            resolution=0.05,
-            orient=tk.HORIZONTAL,
-            command=self.update_confidence_label,
-            showvalue=False
+    
+        # Draw rectangle with scaled coordinates
+        rect_id = self.canvas.create_rectangle(
+            scaled_coords[0], scaled_coords[1],
+            scaled_coords[2], scaled_coords[3],
+            outline=self.get_label_color(class_id),
+            width=2
         )
-        self.conf_slider.set(0.5)
-        self.conf_slider.pack(fill=tk.X)
+    
+        # Save original (unscaled) coordinates for later zoom updates
+        self.rect_coords.append(rect_id)
+        self.rectangles.append({
+            "coords": coords,
+            "label_id": class_id,
+            "rect_id": rect_id
+        })
+        if conf is not None:
+            self.rectangles[-1]["conf"] = conf
+        self.record_edit("add", self.rectangles[-1])
 
-        # Auto detect button
-        self.auto_detect_btn = tk.Button(
-            self.yolo_control_frame, 
-            text="Run Auto Detect (A)", 
-            command=self.run_yolo_detection,
-            bg="#2196F3",
-            fg="white",
-            font=("Arial", 10, "bold"),
-            cursor="hand2",
-            state=tk.DISABLED
-        )
-        self.auto_detect_btn.pack(pady=10, padx=10, fill=tk.X)
-        
-        # Auto detect on load checkbox
-        self.auto_detect_var = tk.BooleanVar()
-        self.auto_detect_toggle = tk.Checkbutton(
-            self.yolo_control_frame, 
-            text="Auto Detect on Load", 
-            variable=self.auto_detect_var,
-            bg="lightgray"
+    def load_images(self):
+        """Load images from source directory."""
+        self.source_directory = filedialog.askdirectory(title="Select Source Directory")
+        if not self.source_directory:
+            return
+            
+        self.destination_directory = filedialog.askdirectory(title="Select Destination Directory")
+        if not self.destination_directory:
+            return
+            
+        self.open_source(DirectorySource(self.source_directory))
+
+    def load_archive(self):
+        """Load images from a zip or tar archive without extracting it."""
+        archive_path = filedialog.askopenfilename(
+            title="Select Image Archive",
+            filetypes=[("Archives", "*.zip *.tar"), ("All Files", "*.*")]
         )
-        self.auto_detect_toggle.pack(pady=5)
-        
-        # Reset zoom checkbox
-        self.reset_zoom_var = tk.BooleanVar(value=True)
-        self.reset_zoom_toggle = tk.Checkbutton(
-            self.yolo_control_frame,
-            text="Reset Zoom on Image Change",
-            variable=self.reset_zoom_var,
-            bg="lightgray"
+        if not archive_path:
+            return
+
+        self.destination_directory = filedialog.askdirectory(title="Select Destination Directory")
+        if not self.destination_directory:
+            return
+
+        self.update_status("Indexing archive...", duration=0)
+        self.update_idletasks()
+        try:
+            source = ArchiveSource(archive_path, self.destination_directory)
+        except (OSError, tarfile.TarError, zipfile.BadZipFile) as e:
+            messagebox.showerror("Error", f"Cannot read archive: {e}")
+            self.update_status("Error reading archive")
+            return
+        self.source_directory = archive_path
+        self.open_source(source)
+
+    def load_video(self):
+        """Label frames straight from a video file."""
+        if cv2 is None:
+            messagebox.showerror("Error", "OpenCV not installed. Please install it to label videos.")
+            return
+
+        video_path = filedialog.askopenfilename(
+            title="Select Video",
+            filetypes=[("Videos", " ".join(f"*{ext}" for ext in VIDEO_EXTENSIONS)), ("All Files", "*.*")]
         )
-        self.reset_zoom_toggle.pack(pady=5)
-        
-        # Image list section
-        images_label = tk.Label(
-            self.yolo_control_frame, 
-            text="Images:", 
-            font=("Arial", 10, "bold"),
-            bg="lightgray"
+        if not video_path:
+            return
+
+        self.destination_directory = filedialog.askdirectory(title="Select Destination Directory")
+        if not self.destination_directory:
+            return
+
+        frame_step = simpledialog.askinteger(
+            "Frame Step", "Label every Nth frame:", initialvalue=1, minvalue=1
         )
-        images_label.pack(pady=(15, 5))
-        
-        self.image_list_frame = tk.Frame(self.yolo_control_frame)
-        self.image_list_frame.pack(fill=tk.BOTH, expand=True, pady=(0,10), padx=10)
+        if not frame_step:
+            return
+
+        try:
+            source = VideoSource(video_path, frame_step)
+        except OSError as e:
+            messagebox.showerror("Error", f"Cannot read video: {e}")
+            self.update_status("Error reading video")
+            return
+        self.source_directory = video_path
+        self.open_source(source)
+
+    def open_source(self, source):
+        """Make source the current image source and show its first image."""
+        if self.recorder:
+            self.recorder.note("source", source=source.describe(), destination=self.destination_directory)
+        if isinstance(self.image_source, DirectorySource):
+            self.image_source.stop_watching()
+        self.image_source = source
+        self.image_files = source.list_images()
+        self.all_image_files = list(self.image_files)
+        self.duplicate_clusters = {}
+        self.image_scores = {}
+        self.disagreement_scores = {}
+        self.predetections = {}
+        self.scoring_generation += 1
+        # Boxes from another source must never be propagated into this one
+        self.previous_frame = None
+        self.shown_image = None
+        self.catalog_filter = None
+        self.image_filter_var.set("All images")
         
-        self.image_vsb = tk.Scrollbar(self.image_list_frame, orient=tk.VERTICAL)
-        self.image_hsb = tk.Scrollbar(self.image_list_frame, orient=tk.HORIZONTAL)
-        self.image_listbox = tk.Listbox(
-            self.image_list_frame,
-            selectmode=tk.SINGLE,
-            yscrollcommand=self.image_vsb.set,
-            xscrollcommand=self.image_hsb.set
+        if not self.image_files:
+            messagebox.showwarning("No Images", "No valid images found in the selected directory.")
+            self.update_status("No images found")
+            return
+            
+        self.update_image_listbox()
+        self.open_journal()
+        self.open_catalog()
+        if self.image_files:
+            self.current_index = 0
+            if self.lease_var.get():
+                # Lease files live in the new destination directory
+                self.toggle_leases()
+                self.current_index = self.free_index(0, 1) or 0
+            if not self.recover_journal():
+                self.show_image(self.current_index)
+            self.update_status(f"Loaded {len(self.image_files)} images")
+
+    def open_journal(self):
+        """Open this session's edit journal and collect journals left by finished sessions."""
+        if self.journal:
+            self.journal.close()
+        host = socket.gethostname()
+        # Per session, so two labelers on one host never share (and truncate) a journal
+        journal_name = f".labeler-journal-{host}-{os.getpid()}.jsonl"
+        self.journal_path = os.path.join(self.destination_directory, journal_name)
+        self.recovered_edits = []
+        for path in EditJournal.stale(self.destination_directory, host):
+            if path == self.journal_path:
+                continue
+            image, ops = EditJournal.read(path)
+            if ops:
+                self.recovered_edits.append((path, image, ops))
+                continue
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        self.journal = EditJournal(self.journal_path)
+
+    def open_catalog(self):
+        """Open the dataset catalog and refresh it incrementally in the background."""
+        if self.catalog:
+            self.catalog.close()
+        self.catalog = DatasetCatalog(os.path.join(self.destination_directory, CATALOG_NAME))
+        self.catalog_ready = False
+        catalog = self.catalog
+        source = self.image_source
+        destination = self.destination_directory
+
+        def label_file(name):
+            return os.path.join(destination, source.label_name(name))
+
+        def work():
+            catalog.refresh(
+                source,
+                label_file,
+                progress=lambda done, total: self.call_in_ui(
+                    self.update_status, f"Cataloging images: {done}/{total}", 0
+                )
+            )
+            return catalog
+
+        self.run_in_background(work, self.on_catalog_ready, "Updating dataset catalog")
+
+    def on_catalog_ready(self, catalog):
+        """Enable catalog queries once the background refresh finishes."""
+        if catalog is not self.catalog:
+            return
+        self.catalog_ready = True
+        total, labeled, _ = catalog.summary()
+        self.update_status(f"Catalog ready: {total} images, {total - labeled} unlabeled")
+
+    def on_image_filter(self, event=None):
+        """Filter the image list with a catalog query."""
+        choice = self.image_filter_var.get()
+        if choice == "All images":
+            self.catalog_filter = None
+        elif not self.catalog_ready:
+            self.image_filter_var.set("All images")
+            self.update_status("Dataset catalog is still being built")
+            return
+        elif choice == "Unlabeled only":
+            self.catalog_filter = self.catalog.unlabeled()
+        elif choice == "Labeled only":
+            self.catalog_filter = self.catalog.labeled()
+        else:
+            class_id = simpledialog.askinteger("Filter Images", "Show images containing class id:", minvalue=0)
+            if class_id is None:
+                self.image_filter_var.set("All images")
+                self.catalog_filter = None
+            else:
+                self.catalog_filter = self.catalog.with_class(class_id)
+                self.image_filter_var.set(f"Contains class {class_id}")
+        self.refresh_image_list()
+        self.update_status(f"{len(self.image_files)} images shown")
+
+    def show_dataset_summary(self):
+        """Show image and per-class box counts from the catalog."""
+        if not self.catalog_ready:
+            self.update_status("Dataset catalog is not ready")
+            return
+        total, labeled, per_class = self.catalog.summary()
+        lines = [f"Images: {total}", f"Labeled: {labeled}", f"Unlabeled: {total - labeled}", ""]
+        for class_id, count in per_class.items():
+            name = self.class_names.get(class_id, f"label_{class_id}") if self.class_names else f"label_{class_id}"
+            lines.append(f"[{class_id}] {name}: {count} boxes")
+        messagebox.showinfo("Dataset Summary", "\n".join(lines))
+
+    def validate_labels(self):
+        """Check every label file in the destination directory in a process pool."""
+        if not self.destination_directory:
+            self.update_status("No destination directory selected")
+            return
+        fix = messagebox.askyesnocancel(
+            "Validate Labels",
+            "Check every label file in the destination directory.\n\n"
+            "Also rewrite files with repairable problems (malformed lines, "
+            "out-of-range, zero-area and duplicate boxes)?"
         )
-        self.image_vsb.config(command=self.image_listbox.yview)
-        self.image_hsb.config(command=self.image_listbox.xview)
-        self.image_vsb.pack(side=tk.RIGHT, fill=tk.Y)
-        self.image_hsb.pack(side=tk.BOTTOM, fill=tk.X)
-        self.image_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        self.image_listbox.bind("<<ListboxSelect>>", self.on_image_select)
-        
-        # Label colors and initialization
-        self.label_colors = ["red", "blue", "green", "yellow", "purple", "orange", "cyan", "magenta"]
-        self.current_label_id = 0
-        self.current_color = self.label_colors[0]
-        self.labels = [{"id": 0, "name": "Label", "color": "red"}]
-        
-        # Main frames setup
-        self.sidebar = tk.Frame(self, width=220, bg="lightgray")
-        self.sidebar.pack(side=tk.LEFT, fill=tk.Y)
-        self.sidebar.pack_propagate(False)
-        
-        self.main_frame = tk.Frame(self)
-        self.main_frame.pack(side=tk.RIGHT, expand=True, fill=tk.BOTH)
+        if fix is None:
+            return
 
-        # Canvas and scrollbars
-        self.canvas = tk.Canvas(self.main_frame, bg="white")
-        self.v_scroll = tk.Scrollbar(self.main_frame, orient=tk.VERTICAL, command=self.canvas.yview)
-        self.h_scroll = tk.Scrollbar(self.main_frame, orient=tk.HORIZONTAL, command=self.canvas.xview)
-        self.canvas.configure(yscrollcommand=self.v_scroll.set, xscrollcommand=self.h_scroll.set)
+        directory = self.destination_directory
+        class_ids = set(self.class_names) if self.class_names else None
 
-        # Grid layout for canvas
-        self.main_frame.grid_rowconfigure(0, weight=1)
-        self.main_frame.grid_columnconfigure(0, weight=1)
-        self.canvas.grid(row=0, column=0, sticky="nsew")
-        self.v_scroll.grid(row=0, column=1, sticky="ns")
-        self.h_scroll.grid(row=1, column=0, sticky="ew")
+        def work():
+            paths = list_label_files(directory)
+            report = []
+            kinds = Counter()
+            fixed = 0
+            with ProcessPoolExecutor(initializer=init_label_validation, initargs=(class_ids,)) as executor:
+                results = executor.map(validate_label_file, [(p, fix) for p in paths], chunksize=512)
+                for done, (path, problems, rewritten) in enumerate(results, 1):
+                    fixed += rewritten
+                    for number, kind, detail in problems:
+                        kinds[kind] += 1
+                        report.append(f"{os.path.relpath(path, directory)}:{number}: {kind}: {detail}")
+                    if done % 10000 == 0:
+                        self.call_in_ui(self.update_status, f"Validated {done}/{len(paths)} label files", 0)
+            atomic_write_text(os.path.join(directory, VALIDATION_REPORT_NAME), "\n".join(report))
+            return len(paths), kinds, fixed
 
-        # Status bar at the bottom
-        self.status_bar = tk.Label(
-            self.main_frame,
-            text="Ready",
-            bd=1,
-            relief=tk.SUNKEN,
-            anchor=tk.W,
-            font=("Arial", 9)
+        self.run_in_background(work, self.on_labels_validated, "Validating labels")
+
+    def on_labels_validated(self, result):
+        """Summarize a validation pass."""
+        file_count, kinds, fixed = result
+        lines = [f"Checked {file_count} label files."]
+        if kinds:
+            lines.append("")
+            lines.extend(f"{kind}: {count}" for kind, count in kinds.most_common())
+            lines.append("")
+            lines.append(f"Details written to {VALIDATION_REPORT_NAME}.")
+        else:
+            lines.append("No problems found.")
+        if fixed:
+            lines.append(f"Repaired {fixed} files.")
+        self.update_status(f"Validation complete: {sum(kinds.values())} problems in {file_count} files")
+        messagebox.showinfo("Validate Labels", "\n".join(lines))
+
+    def remap_classes(self):
+        """Ask for a class remap table and apply it to every label file."""
+        if not self.destination_directory:
+            self.update_status("No destination directory selected")
+            return
+        text = simpledialog.askstring(
+            "Remap Classes",
+            "Enter old:new pairs separated by commas.\n"
+            "Map several ids to one id to merge them; use old:drop to delete a class.\n\n"
+            "Example: 3:1, 5:1, 7:drop"
         )
-        self.status_bar.grid(row=2, column=0, columnspan=2, sticky="ew")
+        if not text:
+            return
+        try:
+            mapping = parse_class_mapping(text)
+        except ValueError as e:
+            messagebox.showerror("Error", f"Invalid remap table: {e}")
+            return
+        if mapping:
+            self.run_class_operation(mapping)
 
-        # Scroll and zoom bindings
-        self.canvas.bind("<MouseWheel>", self.scroll_vertical)
-        self.canvas.bind("<Alt-MouseWheel>", self.scroll_horizontal)
-        self.canvas.bind("<Control-MouseWheel>", self.zoom)
+    def run_class_operation(self, mapping):
+        """Dry-run a class mapping over the destination directory, then apply it if confirmed."""
+        directory = self.destination_directory
 
-        # Zoom level variable
-        self.zoom_level = 1.0
-        
-        # Label management section
-        labels_title = tk.Label(
-            self.sidebar,
-            text="Labels",
-            font=("Arial", 12, "bold"),
-            bg="lightgray"
+        def scan(apply, manifest_path=None):
+            paths = list_label_files(directory)
+            totals = Counter()
+            changed = 0
+            manifest = open(manifest_path, "w", encoding="utf-8") if manifest_path else None
+            try:
+                if manifest:
+                    manifest.write(json.dumps({"mapping": {str(k): v for k, v in mapping.items()}}) + "\n")
+                with ProcessPoolExecutor(initializer=init_class_mapping, initargs=(mapping,)) as executor:
+                    results = executor.map(remap_label_file, [(p, apply) for p in paths], chunksize=512)
+                    for path, original, updated, changes in results:
+                        if not changes:
+                            continue
+                        changed += 1
+                        totals.update(changes)
+                        if manifest:
+                            manifest.write(json.dumps({
+                                "path": os.path.relpath(path, directory),
+                                "original": original,
+                                "updated": updated
+                            }) + "\n")
+            finally:
+                if manifest:
+                    manifest.flush()
+                    os.fsync(manifest.fileno())
+                    manifest.close()
+            return len(paths), changed, totals
+
+        def describe(totals):
+            lines = []
+            for (old, new), count in sorted(totals.items(), key=lambda item: item[0][0]):
+                target = "dropped" if new is None else f"class {new}"
+                lines.append(f"class {old} -> {target}: {count} boxes")
+            return lines
+
+        def on_dry_run(result):
+            file_count, changed, totals = result
+            self.update_status(f"Class operation would change {changed} of {file_count} label files")
+            if not changed:
+                messagebox.showinfo("Remap Classes", "No label files contain the selected classes.")
+                return
+            summary = "\n".join([f"{changed} of {file_count} label files will change:", ""] + describe(totals))
+            if not messagebox.askyesno("Remap Classes", summary + "\n\nApply these changes?"):
+                return
+            ops_directory = os.path.join(directory, CLASS_OPS_DIRECTORY)
+            os.makedirs(ops_directory, exist_ok=True)
+            manifest_path = os.path.join(ops_directory, time.strftime("undo-%Y%m%d-%H%M%S.jsonl"))
+            self.run_in_background(lambda: scan(True, manifest_path), on_applied, "Rewriting label files")
+
+        def on_applied(result):
+            _, changed, _ = result
+            self.apply_class_mapping_in_memory(mapping)
+            self.open_catalog()
+            self.update_status(f"Class operation applied to {changed} label files")
+
+        self.run_in_background(lambda: scan(False), on_dry_run, "Checking label files")
+
+    def apply_class_mapping_in_memory(self, mapping):
+        """
+        Apply a class mapping to the annotations on the open image.
+
+        The label file on disk was already rewritten, so this is not an edit:
+        it is neither journaled nor marks the image dirty, and undoing the
+        class operation reloads the image from the restored file.
+        """
+        for rect in list(self.rectangles):
+            if rect["label_id"] not in mapping:
+                continue
+            new_id = mapping[rect["label_id"]]
+            index = self.rectangles.index(rect)
+            if new_id is None:
+                self.canvas.delete(self.rect_coords[index])
+                del self.rect_coords[index]
+                del self.rectangles[index]
+                continue
+            rect["label_id"] = new_id
+            if not any(label["id"] == new_id for label in self.labels):
+                self.create_new_label_from_id(new_id)
+            self.canvas.itemconfig(self.rect_coords[index], outline=self.get_label_color(new_id))
+
+    def undo_class_operation(self):
+        """Restore the label files changed by the most recent class operation."""
+        ops_directory = os.path.join(self.destination_directory, CLASS_OPS_DIRECTORY)
+        try:
+            manifests = sorted(f for f in os.listdir(ops_directory) if f.startswith("undo-") and f.endswith(".jsonl"))
+        except OSError:
+            manifests = []
+        if not manifests:
+            self.update_status("No class operation to undo")
+            return
+        manifest_path = os.path.join(ops_directory, manifests[-1])
+        if not messagebox.askyesno("Undo Class Operation", f"Restore label files from {manifests[-1]}?"):
+            return
+        directory = self.destination_directory
+
+        def work():
+            with open(manifest_path, encoding="utf-8") as f:
+                header = json.loads(f.readline())
+                entries = [
+                    (os.path.join(directory, record["path"]), record["original"], record["updated"])
+                    for record in map(json.loads, f)
+                ]
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                restored_paths = {
+                    entry[0] for entry, ok in zip(entries, executor.map(restore_label_file, entries)) if ok
+                }
+            os.replace(manifest_path, manifest_path[:-len(".jsonl")] + ".undone.jsonl")
+            return header, restored_paths, len(entries)
+
+        def on_done(result):
+            _, restored_paths, total = result
+            restored = len(restored_paths)
+            if self.image_files:
+                # The open image shows the remapped classes; unsaved edits would write them back
+                reload = not self.dirty or (
+                    self.label_path(self.current_index) in restored_paths and messagebox.askyesno(
+                        "Undo Class Operation",
+                        "The open image's labels were restored. Reload them and discard your unsaved edits?"
+                    )
+                )
+                if reload:
+                    self.show_image(self.current_index)
+            self.open_catalog()
+            skipped = total - restored
+            message = f"Restored {restored} label files"
+            if skipped:
+                message += f"; {skipped} were modified since and left unchanged"
+            self.update_status(message)
+
+        self.run_in_background(work, on_done, "Undoing class operation")
+
+    def class_name_map(self):
+        """Return {class id: name} from the loaded model, falling back to the sidebar labels."""
+        if self.class_names:
+            return dict(self.class_names)
+        return {label["id"]: label["name"] for label in self.labels}
+
+    def export_split(self):
+        """Export labeled images as an Ultralytics train/val layout built from links."""
+        if not isinstance(self.image_source, DirectorySource):
+            messagebox.showerror("Error", "Split export needs images loaded from a directory.")
+            return
+        output_directory = filedialog.askdirectory(title="Select Output Directory for the Dataset")
+        if not output_directory:
+            return
+        val_fraction = simpledialog.askfloat(
+            "Train/Val Split", "Fraction of boxes for validation:",
+            initialvalue=0.2, minvalue=0.01, maxvalue=0.99
         )
-        labels_title.pack(pady=(10, 5))
-        
-        self.label_management = tk.Frame(self.sidebar, bg="lightgray")
-        self.label_management.pack(pady=5)
-        
-        self.add_label_btn = tk.Button(
-            self.label_management, 
-            text="+ Add Label", 
-            command=self.add_label,
-            cursor="hand2"
+        if val_fraction is None:
+            return
+        use_hardlinks = messagebox.askyesnocancel(
+            "Train/Val Split",
+            "Use hardlinks for the exported files?\n\n"
+            "Yes: hardlinks (same filesystem)\nNo: symlinks\n\n"
+            "Files are copied where linking is not possible."
         )
-        self.add_label_btn.pack(pady=5)
-        
-        self.labels_frame = tk.Frame(self.sidebar, bg="lightgray")
-        self.labels_frame.pack(fill=tk.BOTH, expand=True, padx=5)
-        self.create_label_widget(0)        
-                      
-        # Control buttons
-        controls_title = tk.Label(
-            self.sidebar,
-            text="Controls",
-            font=("Arial", 12, "bold"),
-            bg="lightgray"
+        if use_hardlinks is None:
+            return
+
+        mode = "hardlink" if use_hardlinks else "symlink"
+        source = self.image_source
+        destination = self.destination_directory
+        catalog = self.catalog if self.catalog_ready else None
+        names = set(self.all_image_files)
+        class_names = self.class_name_map()
+
+        def work():
+            if catalog:
+                image_counts = {n: c for n, c in catalog.label_counts().items() if n in names}
+            else:
+                labeled = [n for n in names if os.path.exists(os.path.join(destination, source.label_name(n)))]
+                with ThreadPoolExecutor(max_workers=16) as executor:
+                    counts = executor.map(
+                        lambda n: read_label_counts(os.path.join(destination, source.label_name(n))), labeled
+                    )
+                    image_counts = dict(zip(labeled, counts))
+            train, val = stratified_split(image_counts, val_fraction)
+
+            jobs = []
+            for split, split_names in (("train", train), ("val", val)):
+                image_directory = os.path.join(output_directory, "images", split)
+                label_directory = os.path.join(output_directory, "labels", split)
+                os.makedirs(image_directory, exist_ok=True)
+                os.makedirs(label_directory, exist_ok=True)
+                # Remove files left by an earlier export that now belong to the other split
+                expected = {image_directory: set(split_names),
+                            label_directory: {source.label_name(n) for n in split_names}}
+                for directory, keep in expected.items():
+                    for entry in os.scandir(directory):
+                        if entry.name not in keep and not entry.is_dir(follow_symlinks=False):
+                            os.unlink(entry.path)
+                for name in split_names:
+                    label_name = source.label_name(name)
+                    jobs.append((os.path.join(source.directory, name), os.path.join(image_directory, name)))
+                    jobs.append((os.path.join(destination, label_name), os.path.join(label_directory, label_name)))
+            with ThreadPoolExecutor(max_workers=16) as executor:
+                copied = sum(executor.map(lambda job: link_or_copy(job[0], job[1], mode), jobs))
+
+            yaml_lines = [
+                f"path: {json.dumps(os.path.abspath(output_directory))}",
+                "train: images/train",
+                "val: images/val",
+                "names:",
+            ]
+            yaml_lines.extend(f"  {class_id}: {json.dumps(str(name))}" for class_id, name in sorted(class_names.items()))
+            atomic_write_text(os.path.join(output_directory, "data.yaml"), "\n".join(yaml_lines) + "\n")
+            return len(train), len(val), copied
+
+        def on_done(result):
+            train_count, val_count, copied = result
+            message = f"Exported {train_count} train and {val_count} val images"
+            if copied:
+                message += f" ({copied} files copied instead of linked)"
+            self.update_status(message)
+
+        self.run_in_background(work, on_done, "Exporting train/val split")
+
+    def export_letterbox(self):
+        """Export labeled images letterboxed to a training size, incrementally, in a process pool."""
+        if not self.image_source:
+            self.update_status("No images loaded")
+            return
+        output_directory = filedialog.askdirectory(title="Select Output Directory for the Cache")
+        if not output_directory:
+            return
+        size = simpledialog.askinteger(
+            "Letterboxed Cache", "Training image size (pixels):",
+            initialvalue=LETTERBOX_SIZE, minvalue=32, maxvalue=8192
         )
-        controls_title.pack(pady=(10, 5))
-        
-        self.button_frame = tk.Frame(self.sidebar, bg="lightgray")
-        self.button_frame.pack(side=tk.BOTTOM, fill=tk.X, pady=10)
-        
-        self.buttons_container = tk.Frame(self.button_frame, bg="lightgray")
-        self.buttons_container.pack(fill=tk.X, padx=10)
-        
-        # Control buttons
-        self.load_button = tk.Button(
-            self.buttons_container, 
-            text="Load Images", 
-            command=self.load_images,
-            cursor="hand2"
+        if not size:
+            return
+        use_array = messagebox.askyesnocancel(
+            "Letterboxed Cache",
+            "Write one memory-mapped uint8 array with an offsets index?\n\n"
+            "Yes: single array file (images.u8 + index.json)\nNo: resized image files"
         )
-        self.load_button.pack(side=tk.TOP, fill=tk.X, pady=2)
-        
-        self.clear_button = tk.Button(
-            self.buttons_container, 
-            text="Clear Rectangles (C)", 
-            command=self.clear_rectangles,
-            cursor="hand2"
+        if use_array is None:
+            return
+
+        output_format = "array" if use_array else "images"
+        source = self.image_source
+        destination = self.destination_directory
+        names = list(self.all_image_files)
+        manifest_path = os.path.join(output_directory, LETTERBOX_MANIFEST)
+        array_path = os.path.join(output_directory, LETTERBOX_ARRAY_NAME)
+
+        def image_out(name):
+            return os.path.join(output_directory, "images", name)
+
+        def label_out(name):
+            return os.path.join(output_directory, "labels", source.label_name(name))
+
+        def work():
+            try:
+                with open(manifest_path, encoding="utf-8") as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                manifest = {}
+            if manifest.get("size") != size or manifest.get("format") != output_format:
+                # Different layout: start over rather than mixing slot sizes
+                manifest = {"size": size, "format": output_format, "entries": {}}
+                if os.path.exists(array_path):
+                    os.unlink(array_path)
+            entries = manifest["entries"]
+
+            # Current labeled images and their change signatures
+            signatures = source.signatures()
+            current = {}
+            for name in names:
+                try:
+                    label_mtime = os.stat(os.path.join(destination, source.label_name(name))).st_mtime_ns
+                except OSError:
+                    continue
+                current[name] = f"{signatures.get(name)}:{label_mtime}"
+
+            removed = [name for name in entries if name not in current]
+            for name in removed:
+                entries.pop(name)
+                paths = [label_out(name)] + ([image_out(name)] if output_format == "images" else [])
+                for path in paths:
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+            todo = [n for n in current if entries.get(n, {}).get("signature") != current[n]]
+
+            # Array slots are stable; freed slots are reused before the array grows
+            capacity = 0
+            if output_format == "array":
+                used = {entry["slot"] for entry in entries.values()}
+                free = (slot for slot in range(len(used) + len(todo)) if slot not in used)
+                for name in todo:
+                    if name not in entries:
+                        entries[name] = {"slot": next(free)}
+                capacity = max((entry["slot"] + 1 for entry in entries.values()), default=0)
+                slot_bytes = size * size * 3
+                with open(array_path, "ab") as f:
+                    if f.tell() < capacity * slot_bytes:
+                        f.truncate(capacity * slot_bytes)
+
+            tasks = [
+                (source.locate(n), os.path.join(destination, source.label_name(n)),
+                 image_out(n), label_out(n), entries.get(n, {}).get("slot"))
+                for n in todo
+            ]
+            init_args = (size, array_path if capacity else None, capacity)
+            if None in (task[0] for task in tasks):
+                init_letterbox(*init_args)
+                # Decoded inside letterbox_entry, so an unreadable frame fails only its entry
+                results = (
+                    letterbox_entry(task, lambda n=n: source.open_image(n)) for n, task in zip(todo, tasks)
+                )
+                executor = None
+            else:
+                executor = ProcessPoolExecutor(initializer=init_letterbox, initargs=init_args)
+                results = executor.map(letterbox_entry, tasks, chunksize=16)
+            failed = 0
+            try:
+                for done, (name, result) in enumerate(zip(todo, results), 1):
+                    if result is None:
+                        failed += 1
+                        entries.pop(name, None)
+                        continue
+                    width, height, scale, pad_x, pad_y = result
+                    entries.setdefault(name, {}).update(
+                        signature=current[name], size=[width, height], scale=scale, pad=[pad_x, pad_y]
+                    )
+                    if done % 500 == 0:
+                        self.call_in_ui(self.update_status, f"Letterboxing: {done}/{len(todo)}", 0)
+            finally:
+                if executor:
+                    executor.shutdown()
+
+            if output_format == "array":
+                with open(array_path, "rb+") as f:
+                    os.fsync(f.fileno())
+                index = {
+                    "file": LETTERBOX_ARRAY_NAME,
+                    "dtype": "uint8",
+                    "shape": [size, size, 3],
+                    "images": [
+                        {
+                            "name": name,
+                            "offset": entry["slot"] * size * size * 3,
+                            "label": os.path.relpath(label_out(name), output_directory),
+                            "size": entry["size"],
+                            "scale": entry["scale"],
+                            "pad": entry["pad"]
+                        }
+                        for name, entry in sorted(entries.items())
+                    ]
+                }
+                atomic_write_text(os.path.join(output_directory, LETTERBOX_INDEX_NAME), json.dumps(index))
+            atomic_write_text(manifest_path, json.dumps(manifest))
+            return len(todo) - failed, len(current) - len(todo), len(removed), failed
+
+        def on_done(result):
+            written, unchanged, removed, failed = result
+            message = f"Letterboxed {written} images ({unchanged} unchanged, {removed} removed)"
+            if failed:
+                message += f", {failed} unreadable"
+            self.update_status(message)
+
+        self.run_in_background(work, on_done, "Building letterboxed cache")
+
+    def labeled_image_sizes(self, names, chunk_size=4096):
+        """
+        Yield (name, (width, height), label_path) for labeled images, reading sizes from headers.
+
+        Sizes come from the catalog when it is ready; otherwise headers are
+        read on a thread pool one chunk at a time, so memory stays flat.
+        """
+        source = self.image_source
+        destination = self.destination_directory
+        catalog = self.catalog if self.catalog_ready else None
+
+        def lookup(name):
+            label_path = os.path.join(destination, source.label_name(name))
+            if not os.path.exists(label_path):
+                return None
+            size = catalog.image_size(name) if catalog else None
+            return name, size or source.image_size(name), label_path
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            for start in range(0, len(names), chunk_size):
+                for item in executor.map(lookup, names[start:start + chunk_size]):
+                    if item:
+                        yield item
+
+    def export_coco(self):
+        """Stream the labeled images to a COCO JSON file without decoding images."""
+        if not self.image_files:
+            self.update_status("No images loaded")
+            return
+        output_path = filedialog.asksaveasfilename(
+            title="Export COCO JSON", defaultextension=".json", filetypes=[("JSON", "*.json")]
         )
-        self.clear_button.pack(side=tk.TOP, fill=tk.X, pady=2)
+        if not output_path:
+            return
+        names = list(self.all_image_files)
+        class_names = self.class_name_map()
 
-        self.confirm_button = tk.Button(
-            self.buttons_container, 
-            text="Save & Next (S)", 
-            command=self.confirm_and_save,
-            bg="#4CAF50",
-            fg="white",
-            font=("Arial", 9, "bold"),
-            cursor="hand2"
+        def work():
+            # Annotations are spooled to a temporary file while images stream out,
+            # then appended, so neither list is held in memory
+            image_count = annotation_count = 0
+            used_classes = set()
+            with open(output_path, "w", encoding="utf-8") as out, \
+                    tempfile.TemporaryFile("w+", encoding="utf-8") as spool:
+                out.write('{"info": {"description": "Exported by YOLO Image Labeler"},\n"images": [\n')
+                for name, (width, height), label_path in self.labeled_image_sizes(names):
+                    image_count += 1
+                    out.write(("," if image_count > 1 else "") + json.dumps({
+                        "id": image_count, "file_name": name, "width": width, "height": height
+                    }) + "\n")
+                    classes, boxes = read_label_boxes(label_path)
+                    for class_id, (x1, y1, x2, y2) in zip(classes, yolo_to_pixel_boxes(boxes, width, height)):
+                        annotation_count += 1
+                        used_classes.add(int(class_id))
+                        spool.write(("," if annotation_count > 1 else "") + json.dumps({
+                            "id": annotation_count,
+                            "image_id": image_count,
+                            # COCO reserves category 0, so YOLO class ids are shifted by one
+                            "category_id": int(class_id) + 1,
+                            "bbox": [x1, y1, x2 - x1, y2 - y1],
+                            "area": (x2 - x1) * (y2 - y1),
+                            "iscrowd": 0
+                        }) + "\n")
+                    if image_count % 10000 == 0:
+                        self.call_in_ui(self.update_status, f"Exported {image_count} images", 0)
+
+                out.write('],\n"annotations": [\n')
+                spool.seek(0)
+                shutil.copyfileobj(spool, out)
+                categories = [
+                    {"id": class_id + 1, "name": class_names.get(class_id, f"label_{class_id}")}
+                    for class_id in sorted(used_classes | set(class_names))
+                ]
+                out.write('],\n"categories": ' + json.dumps(categories) + "}\n")
+            return image_count, annotation_count
+
+        def on_done(result):
+            self.update_status(f"Exported {result[0]} images and {result[1]} annotations to COCO JSON")
+
+        self.run_in_background(work, on_done, "Exporting COCO JSON")
+
+    def export_voc(self):
+        """Write one Pascal VOC XML file per labeled image."""
+        if not self.image_files:
+            self.update_status("No images loaded")
+            return
+        output_directory = filedialog.askdirectory(title="Select Output Directory for VOC Annotations")
+        if not output_directory:
+            return
+        names = list(self.all_image_files)
+        class_names = self.class_name_map()
+
+        def work():
+            count = 0
+            for name, (width, height), label_path in self.labeled_image_sizes(names):
+                classes, boxes = read_label_boxes(label_path)
+                objects = [
+                    (class_names.get(int(class_id), f"label_{class_id}"), *box)
+                    for class_id, box in zip(classes, yolo_to_pixel_boxes(boxes, width, height))
+                ]
+                xml_path = os.path.join(output_directory, os.path.splitext(name)[0] + ".xml")
+                os.makedirs(os.path.dirname(xml_path), exist_ok=True)
+                atomic_write_text(xml_path, voc_annotation_xml(os.path.basename(name), width, height, objects))
+                count += 1
+            return count
+
+        self.run_in_background(
+            work, lambda count: self.update_status(f"Exported {count} Pascal VOC files"), "Exporting Pascal VOC"
         )
-        self.confirm_button.pack(side=tk.TOP, fill=tk.X, pady=2)
 
-        # Drawing variables
-        self.source_directory = ""
-        self.destination_directory = ""
-        self.image_files = []
-        self.current_index = 0
-        self.rectangles = []
-        self.rect_coords = []
-        self.start_x = None
-        self.start_y = None
-        self.rect_id = None
+    def import_coco(self):
+        """Convert a COCO JSON file into YOLO label files in the destination directory."""
+        if not self.image_source:
+            self.update_status("Load images first to choose a destination directory")
+            return
+        input_path = filedialog.askopenfilename(title="Import COCO JSON", filetypes=[("JSON", "*.json")])
+        if not input_path:
+            return
+        overwrite = self.ask_import_overwrite()
+        if overwrite is None:
+            return
+        source = self.image_source
+        destination = self.destination_directory
+        class_ids = {name: class_id for class_id, name in self.class_name_map().items()}
 
-        # Right-click selection variables
-        self.right_dragging = False
-        self.right_drag_start_x = None
-        self.right_drag_start_y = None
-        self.sel_rect_id = None
+        def work():
+            # The standard library has no streaming JSON parser, so the file is loaded whole
+            with open(input_path, encoding="utf-8") as f:
+                coco = json.load(f)
+            categories = sorted(coco.get("categories", []), key=lambda category: category["id"])
+            if not any(category.get("name") in class_ids for category in categories):
+                # No name matches (e.g. our own export, no model loaded): category id = class id + 1
+                offset = 1 if categories and categories[0]["id"] >= 1 else 0
+                category_classes = {category["id"]: category["id"] - offset for category in categories}
+            else:
+                # Categories map by name; unknown names get new ids after the known classes
+                category_classes = {}
+                for category in categories:
+                    name = category.get("name")
+                    if name not in class_ids:
+                        class_ids[name] = max(class_ids.values(), default=-1) + 1
+                    category_classes[category["id"]] = class_ids[name]
+            images = {image["id"]: image for image in coco.get("images", [])}
+            lines = {}
+            for annotation in coco.get("annotations", []):
+                image = images.get(annotation["image_id"])
+                class_id = category_classes.get(annotation["category_id"])
+                if image is None or class_id is None:
+                    continue
+                x, y, w, h = annotation["bbox"]
+                lines.setdefault(image["id"], []).append(pixel_to_yolo_line(
+                    class_id, x, y, x + w, y + h, image["width"], image["height"]
+                ))
+            written = skipped = 0
+            for image_id, image_lines in lines.items():
+                label_path = os.path.join(destination, source.label_name(images[image_id]["file_name"]))
+                if not overwrite and os.path.exists(label_path):
+                    skipped += 1
+                    continue
+                os.makedirs(os.path.dirname(label_path), exist_ok=True)
+                atomic_write_text(label_path, "\n".join(image_lines))
+                written += 1
+            return written, skipped
 
-        # Left-click drawing bindings
-        self.bind("<ButtonPress-1>", self.start_drawing)
-        self.bind("<B1-Motion>", self.drawing)
-        self.bind("<ButtonRelease-1>", self.finish_drawing)
+        self.run_in_background(work, self.on_labels_imported, "Importing COCO JSON")
 
-        # Undo/redo stacks
-        self.undo_stack = []
-        self.redo_stack = []
-        
-        # Undo/redo bindings
-        self.bind("<Control-z>", self.undo)
-        self.bind("<Control-y>", self.redo)
-        self.bind("<Control-Z>", self.undo)
-        self.bind("<Control-Y>", self.redo)
-        
-        # Right-click bindings for selection
-        self.canvas.bind("<ButtonPress-3>", self.start_right_drag)
-        self.canvas.bind("<B3-Motion>", self.right_drag)
-        self.canvas.bind("<ButtonRelease-3>", self.end_right_drag)
-        
-        # General keyboard shortcuts
-        self.bind("<KeyPress-s>", lambda event: self.confirm_and_save())
-        self.bind("<KeyPress-a>", lambda event: self.run_yolo_detection())
-        self.bind("<KeyPress-c>", lambda event: self.clear_rectangles())
-        self.bind("<Delete>", self.delete_selected_label)
-        
-        # Navigation shortcuts
-        self.bind("<Left>", self.previous_image)
-        self.bind("<Right>", self.next_image)
-        
-        # Label shortcuts (0-9)
-        for i in range(10):
-            self.bind(f"<KeyPress-{i}>", lambda event, d=i: self.select_label_by_number(d))
-            self.bind(f"<Alt-KeyPress-{i}>", lambda event, d=i: self.create_new_label_by_number(d))
+    def import_voc(self):
+        """Convert a folder of Pascal VOC XML files into YOLO label files."""
+        if not self.image_source:
+            self.update_status("Load images first to choose a destination directory")
+            return
+        input_directory = filedialog.askdirectory(title="Select Folder with VOC Annotations")
+        if not input_directory:
+            return
+        overwrite = self.ask_import_overwrite()
+        if overwrite is None:
+            return
+        source = self.image_source
+        destination = self.destination_directory
+        class_ids = {name: class_id for class_id, name in self.class_name_map().items()}
 
-    def _on_class_mousewheel(self, event):
-        """Handle mousewheel scrolling for class list."""
-        if self.class_canvas.winfo_exists():
-            self.class_canvas.yview_scroll(int(-1*(event.delta/120)), "units")
+        def work():
+            written = skipped = 0
+            for root, _, files in os.walk(input_directory):
+                for f in files:
+                    if not f.endswith(".xml"):
+                        continue
+                    filename, width, height, objects = parse_voc_annotation(os.path.join(root, f))
+                    if not objects:
+                        continue
+                    relative = os.path.relpath(os.path.join(root, filename or os.path.splitext(f)[0]), input_directory)
+                    label_path = os.path.join(destination, source.label_name(relative))
+                    if not overwrite and os.path.exists(label_path):
+                        skipped += 1
+                        continue
+                    image_lines = []
+                    for name, x1, y1, x2, y2 in objects:
+                        if name not in class_ids:
+                            class_ids[name] = max(class_ids.values(), default=-1) + 1
+                        image_lines.append(pixel_to_yolo_line(class_ids[name], x1, y1, x2, y2, width, height))
+                    os.makedirs(os.path.dirname(label_path), exist_ok=True)
+                    atomic_write_text(label_path, "\n".join(image_lines))
+                    written += 1
+            return written, skipped
 
-    def update_confidence_label(self, value):
-        """Update confidence threshold label."""
-        self.conf_threshold = float(value)
-        self.conf_label.config(text=f"Confidence: {float(value):.2f}")
+        self.run_in_background(work, self.on_labels_imported, "Importing Pascal VOC")
 
-    def update_status(self, message, duration=3000):
-        """Update status bar with a message."""
-        self.status_bar.config(text=message)
-        if duration > 0:
-            self.after(duration, lambda: self.status_bar.config(text="Ready"))
+    def ask_import_overwrite(self):
+        """Ask whether an import may replace existing label files; None cancels."""
+        return messagebox.askyesnocancel(
+            "Import Labels",
+            "Overwrite label files that already exist in the destination directory?\n\n"
+            "Yes: replace them with the imported labels\n"
+            "No: only import labels for images that have none"
+        )
 
-    def select_all_classes(self):
-        """Select all YOLO classes."""
-        for var in self.class_checkboxes.values():
-            var.set(True)
-        self.update_selected_classes()
-        self.update_status("All classes selected")
+    def on_labels_imported(self, result):
+        """Reload the open image and catalog after importing label files."""
+        written, skipped = result
+        if self.image_files and not self.dirty:
+            self.show_image(self.current_index)
+        self.open_catalog()
+        message = f"Imported labels for {written} images"
+        if skipped:
+            message += f" ({skipped} already labeled, kept)"
+        self.update_status(message)
 
-    def select_no_classes(self):
-        """Deselect all YOLO classes."""
-        for var in self.class_checkboxes.values():
-            var.set(False)
-        self.update_selected_classes()
-        self.update_status("All classes deselected")
+    def recover_journal(self):
+        """Offer to replay unsaved edits left by a crashed or closed session."""
+        candidates = [c for c in self.recovered_edits if c[1] in self.image_files]
+        self.recovered_edits = []
+        if not candidates:
+            return False
+        # Newest journal first; it is removed whether or not its edits are taken
+        path, image, ops = candidates[0]
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        if not messagebox.askyesno(
+            "Recover Unsaved Work",
+            f"Found {len(ops)} unsaved edits on '{image}' from a previous session.\nRecover them?"
+        ):
+            return False
+        self.current_index = self.image_files.index(image)
+        self.show_image(self.current_index)
+        self.apply_journal_ops(ops)
+        self.image_listbox.selection_clear(0, tk.END)
+        self.image_listbox.selection_set(self.current_index)
+        self.image_listbox.see(self.current_index)
+        self.update_status(f"Recovered {len(ops)} unsaved edits on {image}", duration=0)
+        return True
 
-    def update_selected_classes(self):
-        """Update the set of selected classes based on checkboxes."""
-        self.selected_classes = set()
-        for class_id, var in self.class_checkboxes.items():
-            if var.get():
-                self.selected_classes.add(class_id)
+    def label_path(self, index):
+        """Return the YOLO label file path for the image at index."""
+        return self.label_file(self.image_files[index])
 
-    def select_label_by_number(self, num):
-        """Select a label by its numeric index."""
-        if num < len(self.labels):
-            self.current_label_id = self.labels[num]["id"]
-            self.current_color = self.labels[num]["color"]
-            # Update visual selection
-            for label in self.labels:
-                if label["id"] == num:
-                    label["widget"].config(bg="lightblue")
+    def label_file(self, name):
+        """Return the YOLO label file path for an image name."""
+        return os.path.join(self.destination_directory, self.image_source.label_name(name))
+
+    def refresh_image_list(self):
+        """Rebuild the navigation queue from all images, keeping the current image selected."""
+        current = self.image_files[self.current_index] if self.image_files else None
+        files = list(self.all_image_files)
+        if self.catalog_filter is not None:
+            files = [f for f in files if f in self.catalog_filter or f == current]
+        if self.hide_duplicates_var.get():
+            files = [
+                f for f in files
+                if self.duplicate_clusters.get(f, [f])[0] == f or f == current
+            ]
+        if self.sort_disagreement_var.get():
+            scores = self.disagreement_scores
+            files = sorted(files, key=lambda f: (f not in scores, -scores.get(f, 0.0)))
+        elif self.uncertainty_order_var.get():
+            # Stable sort: scored images by descending score, the rest in directory order
+            scores = self.image_scores
+            files = sorted(files, key=lambda f: (f not in scores, -scores.get(f, 0.0)))
+        if files != self.image_files:
+            self.image_files = files
+            self.update_image_listbox()
+
+        if not self.image_files:
+            return
+        if current in self.image_files:
+            self.current_index = self.image_files.index(current)
+        else:
+            self.current_index = min(self.current_index, len(self.image_files) - 1)
+            self.show_image(self.current_index)
+        self.image_listbox.selection_set(self.current_index)
+        self.image_listbox.see(self.current_index)
+
+    def find_duplicates(self):
+        """Hash every image in a process pool and cluster near-duplicates."""
+        if not self.image_files:
+            self.update_status("No images loaded")
+            return
+        max_distance = simpledialog.askinteger(
+            "Near-Duplicates",
+            "Maximum differing hash bits (0-10):",
+            initialvalue=PHASH_MAX_DISTANCE, minvalue=0, maxvalue=10
+        )
+        if max_distance is None:
+            return
+
+        source = self.image_source
+        names = list(self.all_image_files)
+        cache_path = os.path.join(self.destination_directory, PHASH_CACHE_NAME)
+
+        def work():
+            try:
+                with open(cache_path, encoding="utf-8") as f:
+                    cache = json.load(f)
+            except (OSError, ValueError):
+                cache = {}
+            signatures = source.signatures()
+            todo = [n for n in names if cache.get(n, [None])[0] != signatures.get(n)]
+
+            if todo:
+                locators = [source.locate(n) for n in todo]
+                if None in locators:
+                    hashes = (compute_phash(None, lambda n=n: source.open_image(n)) for n in todo)
+                    executor = None
                 else:
-                    label["widget"].config(bg="SystemButtonFace")
-            self.update_status(f"Selected label: {self.labels[num]['name']}")
-    
-    def create_new_label_by_number(self, num):
-        """Create a new label with Alt+number shortcut."""
-        if num == len(self.labels):
-            label_name = simpledialog.askstring("New Label", f"Enter name for new label {num}:")
-            if label_name:
-                new_id = num
-                color = self.label_colors[new_id % len(self.label_colors)]
-                self.labels.append({
-                    "id": new_id,
-                    "name": label_name,
-                    "color": color
-                })
-                self.create_label_widget(new_id)
-                self.update_status(f"Created label: {label_name}")
+                    executor = ProcessPoolExecutor()
+                    hashes = executor.map(compute_phash, locators, chunksize=64)
+                try:
+                    for done, (name, value) in enumerate(zip(todo, hashes), 1):
+                        if value is not None:
+                            cache[name] = [signatures.get(name), f"{value:016x}"]
+                        if done % 500 == 0:
+                            self.call_in_ui(self.update_status, f"Hashing images: {done}/{len(todo)}", 0)
+                finally:
+                    if executor:
+                        executor.shutdown()
+                atomic_write_text(cache_path, json.dumps(cache))
 
-    def add_label(self):
-        """Add a new label through the UI button."""
-        label_name = simpledialog.askstring("New Label", "Enter label name:")
-        if label_name:
-            new_id = len(self.labels)
-            color = self.label_colors[new_id % len(self.label_colors)]
-            self.labels.append({
-                "id": new_id,
-                "name": label_name,
-                "color": color
-            })
-            self.create_label_widget(new_id)
-            self.update_status(f"Created label: {label_name}")
+            hashed = [n for n in names if n in cache]
+            clusters = hamming_clusters([int(cache[n][1], 16) for n in hashed], max_distance)
+            return [[hashed[i] for i in cluster] for cluster in clusters]
 
-    def create_label_widget(self, label_id):
-        """Create UI widget for a label."""
-        label = next((l for l in self.labels if l["id"] == label_id), None)
-        if not label:
+        self.run_in_background(work, self.on_duplicates_found, "Finding near-duplicates")
+
+    def on_duplicates_found(self, clusters):
+        """Store duplicate clusters and offer to hide the redundant images."""
+        self.duplicate_clusters = {name: cluster for cluster in clusters for name in cluster}
+        redundant = sum(len(cluster) - 1 for cluster in clusters)
+        self.update_status(f"Found {len(clusters)} duplicate groups ({redundant} redundant images)")
+        if redundant and messagebox.askyesno(
+            "Near-Duplicates",
+            f"Found {len(clusters)} groups of near-duplicate images.\n"
+            f"Hide the {redundant} redundant images from the image list?"
+        ):
+            self.hide_duplicates_var.set(True)
+        self.refresh_image_list()
+
+    def toggle_leases(self):
+        """Start or stop leasing images so several annotators can share a dataset."""
+        if self.lease_job:
+            self.after_cancel(self.lease_job)
+            self.lease_job = None
+        if self.leases:
+            self.leases.close()
+            self.leases = None
+        if not self.lease_var.get():
+            self.update_status("Stopped sharing work; all leases released")
+            return
+        if not self.destination_directory:
+            self.lease_var.set(False)
+            self.update_status("No destination directory selected")
             return
+        try:
+            self.leases = LeaseManager(self.destination_directory)
+        except OSError as e:
+            self.lease_var.set(False)
+            messagebox.showerror("Error", f"Cannot create leases: {e}")
+            return
+        self.lease_job = self.after(LEASE_HEARTBEAT * 1000, self.renew_leases)
+        if self.image_files:
+            self.claim_lease_window(self.current_index)
+            if self.image_files[self.current_index] not in self.leases.held:
+                self.update_status("This image is being labeled by someone else; navigate to get a free one")
+                return
+        self.update_status(f"Sharing work: images are leased {LEASE_CHUNK} at a time")
 
-        frame = tk.Frame(self.labels_frame, relief=tk.RAISED, borderwidth=1, bg="white")
-        frame.pack(fill=tk.X, padx=2, pady=2)
-        
-        # Color indicator
-        color_canvas = tk.Canvas(frame, width=20, height=20, bg=label["color"], highlightthickness=0)
-        color_canvas.pack(side=tk.LEFT, padx=5, pady=2)
-        
-        # Label name with ID
-        label_text = f"[{label['id']}] {label['name']}"
-        label_name = tk.Label(frame, text=label_text, bg="white")
-        label_name.pack(side=tk.LEFT, padx=5)
-        
-        # Click handler to select label
-        def select_label(event):
-            self.current_label_id = label["id"]
-            self.current_color = label["color"]
-            for child in self.labels_frame.winfo_children():
-                child.config(bg="white")
-            frame.config(bg="lightblue")
-            self.update_status(f"Selected label: {label['name']}")
-        
-        frame.bind("<Button-1>", select_label)
-        color_canvas.bind("<Button-1>", select_label)
-        label_name.bind("<Button-1>", select_label)
-        
-        label["widget"] = frame
+    def claim_lease_window(self, index):
+        """Lease the next chunk of images from index on and release leases outside it."""
+        window = set()
+        for name in self.image_files[index:index + LEASE_CHUNK]:
+            if self.leases.claim(name):
+                window.add(name)
+        for name in self.leases.held - window:
+            self.leases.release(name)
+
+    def free_index(self, index, step):
+        """Return the first index from index on (moving by step) not leased by someone else."""
+        while 0 <= index < len(self.image_files):
+            if not self.leases or self.leases.claim(self.image_files[index]):
+                return index
+            index += step
+        return None
+
+    def renew_leases(self):
+        """Periodically renew our leases off the Tk thread."""
+        self.lease_job = self.after(LEASE_HEARTBEAT * 1000, self.renew_leases)
+        leases = self.leases
+        names = list(leases.held)
+
+        def on_done(lost):
+            if leases is not self.leases or not lost:
+                return
+            leases.held.difference_update(lost)
+            current = self.image_files[self.current_index] if self.image_files else None
+            if current in lost:
+                self.update_status(f"Lost the lease on {current}: another annotator took it over", duration=0)
+
+        self.run_in_background(lambda: leases.heartbeat(names), on_done)
 
-    def load_yolo_model(self):
-        """Load a YOLO model from file."""
-        if YOLO is None:
-            messagebox.showerror("Error", "Ultralytics not installed. Please install it to use YOLO features.")
+    def toggle_watch(self):
+        """Start or stop polling the source directory for new and removed images."""
+        if self.watch_job:
+            self.after_cancel(self.watch_job)
+            self.watch_job = None
+        if isinstance(self.image_source, DirectorySource):
+            self.image_source.stop_watching()
+        if not self.watch_var.get():
+            self.update_status("Stopped watching source directory")
             return
-            
-        model_path = filedialog.askopenfilename(
-            title="Select YOLO Model", 
-            filetypes=[("PyTorch Model", "*.pt")]
-        )
-        if model_path:
+        if not isinstance(self.image_source, DirectorySource):
+            self.watch_var.set(False)
+            self.update_status("Watch mode needs images loaded from a directory")
+            return
+        self.image_source.start_watching(self.all_image_files)
+        how = "inotify" if self.image_source.watch else "polling"
+        self.update_status(f"Watching {self.image_source.directory} for new images ({how})")
+        self.watch_job = self.after(int(WATCH_INTERVAL * 1000), self.poll_source)
+
+    def poll_source(self):
+        """Check the source directory off the Tk thread; results arrive in on_source_changed."""
+        self.watch_job = self.after(int(WATCH_INTERVAL * 1000), self.poll_source)
+        source = self.image_source
+        if self.watch_polling or not isinstance(source, DirectorySource):
+            return
+        if source.known is None:
+            # A new directory was opened while watching
+            source.start_watching(self.all_image_files)
+        self.watch_polling = True
+
+        def work():
             try:
-                self.update_status("Loading YOLO model...")
-                self.model = YOLO(model_path)
-                self.class_names = self.model.names
-                self.create_class_checkboxes()
-                
-                # Enable buttons
-                self.select_all_btn.config(state=tk.NORMAL)
-                self.select_none_btn.config(state=tk.NORMAL)
-                self.auto_detect_btn.config(state=tk.NORMAL)
-                
-                # Auto-select all classes
-                self.select_all_classes()
-                
-                model_name = os.path.basename(model_path)
-                self.update_status(f"Model loaded: {model_name} ({len(self.class_names)} classes)")
-                messagebox.showinfo("Success", f"Model loaded successfully!\n{len(self.class_names)} classes detected.")
-            except Exception as e:
-                messagebox.showerror("Error", f"Error loading model: {e}")
-                self.update_status("Error loading model")
+                return (source, *source.poll_changes())
+            except OSError:
+                # Directory briefly unavailable (e.g. NFS hiccup); try again next poll
+                return source, [], []
 
-    def create_class_checkboxes(self):
-        """Create checkboxes for each YOLO class."""
-        # Clear existing checkboxes
-        for widget in self.class_inner_frame.winfo_children():
-            widget.destroy()
-        self.class_checkboxes.clear()
-        
-        # Create new checkboxes
-        for i, name in self.class_names.items():
-            var = tk.BooleanVar(value=False)
-            self.class_checkboxes[i] = var
-            
-            frame = tk.Frame(self.class_inner_frame, bg="white")
-            frame.pack(fill=tk.X, padx=5, pady=2)
-            
-            # Color indicator
-            color = self.label_colors[i % len(self.label_colors)]
-            color_box = tk.Canvas(frame, width=15, height=15, bg=color, highlightthickness=0)
-            color_box.pack(side=tk.LEFT, padx=(0, 5))
-            
-            # Checkbox with class name
-            cb = tk.Checkbutton(
-                frame,
-                text=f"[{i}] {name}",
-                variable=var,
-                command=self.update_selected_classes,
-                bg="white",
-                anchor="w"
-            )
-            cb.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.run_in_background(work, self.on_source_changed)
 
-    def run_yolo_detection(self):
-        """Run YOLO detection on the current image."""
-        if not self.model or not self.image_files:
-            self.update_status("No model or images loaded")
+    def on_source_changed(self, result):
+        """Merge new and removed images into the queue without moving the current image."""
+        self.watch_polling = False
+        source, added, removed = result
+        if source is not self.image_source or not (added or removed):
             return
 
-        if not self.selected_classes:
-            messagebox.showwarning("No Classes Selected", "Please select at least one class for detection.")
-            return
+        removed_set = set(removed)
+        self.all_image_files = [f for f in self.all_image_files if f not in removed_set] + added
+        current = self.image_files[self.current_index] if self.image_files else None
+        filtered = (
+            self.catalog_filter is not None or self.hide_duplicates_var.get()
+            or self.sort_disagreement_var.get() or self.uncertainty_order_var.get()
+        )
+        if filtered or current in removed_set or not self.image_files:
+            self.refresh_image_list()
+        else:
+            # Plain directory order: patch the listbox in place instead of rebuilding it
+            for name in removed:
+                index = self.image_files.index(name)
+                del self.image_files[index]
+                self.image_listbox.delete(index)
+                if index < self.current_index:
+                    self.current_index -= 1
+            self.image_files.extend(added)
+            self.image_listbox.insert(tk.END, *added)
 
-        self.update_status("Running detection...")
-        current_image = os.path.join(self.source_directory, self.image_files[self.current_index])
-        results = self.model.predict(current_image, verbose=False)
-
-        detection_count = 0
-        # Process prediction results
-        for result in results:
-            boxes = result.boxes.xyxy.cpu().numpy()
-            classes = result.boxes.cls.cpu().numpy()
-            confidences = result.boxes.conf.cpu().numpy()
-
-            for box, cls, conf in zip(boxes, classes, confidences):
-                if conf >= self.conf_threshold:
-                    if int(cls) in self.selected_classes:
-                        x1, y1, x2, y2 = box
-                        self.add_detected_rectangle(int(cls), (x1, y1, x2, y2))
-                        detection_count += 1
-        
-        self.update_status(f"Detection complete: {detection_count} objects found")
+        if added and self.predetect_var.get() and self.model_path:
+            for name in added:
+                self.predetect(source, self.model_path, name)
+        self.update_status(f"Source changed: {len(added)} new, {len(removed)} removed images")
 
-    def add_detected_rectangle(self, class_id, coords):
-        """Add a rectangle detected by YOLO."""
-        # Create label if it doesn't exist
-        if not any(label["id"] == class_id for label in self.labels):
-            self.create_new_label_from_id(class_id)
-    
-        # Calculate scaled coordinates based on current zoom
-        scaled_coords = (
-            coords[0] * self.zoom_level,
-            coords[1] * self.zoom_level,
-            coords[2] * self.zoom_level,
-            coords[3] * self.zoom_level
-        )
-    
-        # Draw rectangle with scaled coordinates
-        rect_id = self.canvas.create_rectangle(
-            scaled_coords[0], scaled_coords[1],
-            scaled_coords[2], scaled_coords[3],
-            outline=self.get_label_color(class_id),
-            width=2
+    def predetect(self, source, model_path, name):
+        """Run detection on a newly arrived image ahead of any queued ranking batches."""
+        def work(model):
+            return raw_predictions(model.predict(source.predict_input(name), conf=PREDETECT_CONF, verbose=False))
+
+        self.run_inference(
+            model_path, work,
+            lambda raw: self.store_predetection(source, model_path, name, raw),
+            # An unreadable (e.g. half-copied) image is simply detected when shown
+            lambda e: None,
+            InferenceWorker.URGENT
         )
-    
-        # Save original (unscaled) coordinates for later zoom updates
-        self.rect_coords.append(rect_id)
-        self.rectangles.append({
-            "coords": coords,
-            "label_id": class_id
-        })
 
-    def load_images(self):
-        """Load images from source directory."""
-        self.source_directory = filedialog.askdirectory(title="Select Source Directory")
-        if not self.source_directory:
+    def store_predetection(self, source, model_path, name, raw):
+        """Keep pre-computed detections for use when the image is shown."""
+        if source is self.image_source and model_path == self.model_path:
+            self.predetections[name] = raw
+
+    def toggle_uncertainty_order(self):
+        """Start or stop ranking the navigation queue by model uncertainty."""
+        if not self.uncertainty_order_var.get():
+            self.scoring_generation += 1
+            self.refresh_image_list()
+            self.update_status("Directory order restored")
             return
-            
-        self.destination_directory = filedialog.askdirectory(title="Select Destination Directory")
-        if not self.destination_directory:
+        if not self.model_path or not self.image_files:
+            self.uncertainty_order_var.set(False)
+            self.update_status("Load a model and images to rank by uncertainty")
             return
-            
-        self.image_files = [
-            f for f in os.listdir(self.source_directory) 
-            if f.lower().endswith(('.png', '.jpg', '.jpeg'))
-        ]
-        
+
+        self.sort_disagreement_var.set(False)
+        self.scoring_generation += 1
+        generation = self.scoring_generation
+        source = self.image_source
+        model_path = self.model_path
+        threshold = self.conf_threshold
+        if (model_path, threshold) != self.image_scores_key:
+            # Scores from another model or threshold would rank by the wrong predictions
+            self.image_scores = {}
+            self.image_scores_key = (model_path, threshold)
+        names = [n for n in self.all_image_files if n not in self.image_scores]
+
+        low_conf = max(0.01, threshold - UNCERTAINTY_BAND)
+
+        def score(batch):
+            def work(model):
+                # A stopped or restarted pass skips the batches it had queued
+                if generation != self.scoring_generation:
+                    return {}
+                inputs, readable = [], []
+                for name in batch:
+                    try:
+                        inputs.append(source.predict_input(name))
+                    except OSError:
+                        # Unreadable images (e.g. frames past the real end of a video) stay unscored
+                        continue
+                    readable.append(name)
+                if not readable:
+                    return {}
+                results = model.predict(inputs, conf=low_conf, verbose=False)
+                return {
+                    name: uncertainty_score(result.boxes.conf.cpu().numpy(), threshold)
+                    for name, result in zip(readable, results)
+                }
+            return work
+
+        def on_error(e):
+            if generation == self.scoring_generation:
+                self.scoring_generation += 1
+                messagebox.showerror("Error", f"Ranking images by uncertainty failed: {e}")
+                self.update_status("Ranking images by uncertainty failed")
+
+        if not names:
+            self.on_uncertainty_done(generation)
+            return
+        self.update_status("Ranking images by uncertainty...", duration=0)
+        for start in range(0, len(names), UNCERTAINTY_BATCH):
+            done = min(start + UNCERTAINTY_BATCH, len(names))
+            self.run_inference(
+                model_path, score(names[start:done]),
+                lambda scores, done=done: self.on_uncertainty_scores(generation, scores, done, len(names)),
+                on_error
+            )
+
+    def schedule_rescoring(self):
+        """Re-rank by uncertainty once the model or threshold stops changing, if the ranking is on."""
+        if self.rescore_job:
+            self.after_cancel(self.rescore_job)
+        self.rescore_job = self.after(500, self.rescore_uncertainty)
+
+    def rescore_uncertainty(self):
+        """Restart the uncertainty pass if its scores no longer match the model and threshold."""
+        self.rescore_job = None
+        if self.uncertainty_order_var.get() and (self.model_path, self.conf_threshold) != self.image_scores_key:
+            self.toggle_uncertainty_order()
+
+    def on_uncertainty_scores(self, generation, scores, done, total):
+        """Merge a batch of uncertainty scores, re-ranking the queue at most every two seconds."""
+        if generation != self.scoring_generation:
+            return
+        self.image_scores.update(scores)
+        if done == total:
+            self.on_uncertainty_done(generation)
+            return
+        if time.monotonic() - self.last_ranking_refresh > 2.0:
+            self.last_ranking_refresh = time.monotonic()
+            self.refresh_image_list()
+        self.update_status(f"Scored {done}/{total} images by uncertainty", duration=0)
+
+    def on_uncertainty_done(self, generation):
+        """Apply the final ranking once the background pass completes."""
+        if generation != self.scoring_generation:
+            return
+        self.refresh_image_list()
+        self.update_status(f"Uncertainty ranking complete ({len(self.image_scores)} images)")
+
+    def copy_annotations_to_duplicates(self):
+        """Write the current image's annotations to every near-duplicate of it."""
         if not self.image_files:
-            messagebox.showwarning("No Images", "No valid images found in the selected directory.")
-            self.update_status("No images found")
             return
-            
-        self.update_image_listbox()
-        if self.image_files:
-            self.current_index = 0
-            self.show_image(0)
-            self.update_status(f"Loaded {len(self.image_files)} images")
+        current = self.image_files[self.current_index]
+        duplicates = [n for n in self.duplicate_clusters.get(current, []) if n != current]
+        if not duplicates:
+            self.update_status("Current image has no known near-duplicates")
+            return
+
+        labeled = [n for n in duplicates if os.path.exists(self.label_file(n))]
+        if labeled:
+            overwrite = messagebox.askyesnocancel(
+                "Copy to Duplicates",
+                f"{len(labeled)} of {len(duplicates)} duplicates already have labels. Overwrite them?\n\n"
+                "Yes: replace their labels\n"
+                "No: only copy to duplicates without labels"
+            )
+            if overwrite is None:
+                return
+            if not overwrite:
+                duplicates = [n for n in duplicates if n not in labeled]
+
+        text = "\n".join(self.yolo_lines())
+        counts = Counter(rect["label_id"] for rect in self.rectangles)
+        for name in duplicates:
+            txt_filepath = self.label_file(name)
+            os.makedirs(os.path.dirname(txt_filepath), exist_ok=True)
+            atomic_write_text(txt_filepath, text)
+            if self.catalog:
+                self.catalog.update_labels(name, os.stat(txt_filepath).st_mtime_ns, counts)
+        self.update_status(f"Copied {len(self.rectangles)} annotations to {len(duplicates)} duplicates")
 
     def update_image_listbox(self):
         """Update the image listbox with loaded images."""
         self.image_listbox.delete(0, tk.END)
-        for f in self.image_files:
-            self.image_listbox.insert(tk.END, f)
+        if self.image_files:
+            # One Tcl call for the whole list; per-item inserts take seconds on large datasets
+            self.image_listbox.insert(tk.END, *self.image_files)
 
     def on_image_select(self, event):
         """Handle image selection from listbox."""
@@ -634,13 +4497,19 @@ class ImageDrawer(tk.Tk):
         if selection:
             index = selection[0]
             if index != self.current_index:
+                if self.free_index(index, 1) != index:
+                    self.update_status(f"{self.image_files[index]} is being labeled by someone else")
+                    self.image_listbox.selection_clear(0, tk.END)
+                    self.image_listbox.selection_set(self.current_index)
+                    return
                 self.current_index = index
                 self.show_image(index)
 
     def next_image(self, event=None):
         """Navigate to next image."""
-        if self.image_files and self.current_index < len(self.image_files) - 1:
-            self.current_index += 1
+        index = self.free_index(self.current_index + 1, 1) if self.image_files else None
+        if index is not None:
+            self.current_index = index
             self.show_image(self.current_index)
             self.image_listbox.selection_clear(0, tk.END)
             self.image_listbox.selection_set(self.current_index)
@@ -648,8 +4517,9 @@ class ImageDrawer(tk.Tk):
 
     def previous_image(self, event=None):
         """Navigate to previous image."""
-        if self.image_files and self.current_index > 0:
-            self.current_index -= 1
+        index = self.free_index(self.current_index - 1, -1) if self.image_files else None
+        if index is not None:
+            self.current_index = index
             self.show_image(self.current_index)
             self.image_listbox.selection_clear(0, tk.END)
             self.image_listbox.selection_set(self.current_index)
@@ -661,6 +4531,7 @@ class ImageDrawer(tk.Tk):
             self.canvas.yview_scroll(-1, "units")
         else:
             self.canvas.yview_scroll(1, "units")
+        self.schedule_render()
 
     def scroll_horizontal(self, event):
         """Handle horizontal scrolling."""
@@ -668,6 +4539,17 @@ class ImageDrawer(tk.Tk):
             self.canvas.xview_scroll(-1, "units")
         else:
             self.canvas.xview_scroll(1, "units")
+        self.schedule_render()
+
+    def scroll_view_y(self, *args):
+        """Scrollbar callback: move the view and re-render the visible region."""
+        self.canvas.yview(*args)
+        self.schedule_render()
+
+    def scroll_view_x(self, *args):
+        """Scrollbar callback: move the view and re-render the visible region."""
+        self.canvas.xview(*args)
+        self.schedule_render()
 
     def zoom(self, event):
         """Handle zoom with Ctrl+MouseWheel."""
@@ -677,18 +4559,7 @@ class ImageDrawer(tk.Tk):
         else:
             self.zoom_level /= 1.1
 
-        # Update image if original exists
-        if hasattr(self, 'current_image_original'):
-            width, height = self.current_image_original.size
-            new_width = int(width * self.zoom_level)
-            new_height = int(height * self.zoom_level)
-            img_resized = self.current_image_original.resize(
-                (new_width, new_height), 
-                Image.Resampling.LANCZOS
-            )
-            self.img_tk = ImageTk.PhotoImage(img_resized)
-            self.canvas.itemconfig(self.image_id, image=self.img_tk)
-            self.canvas.config(scrollregion=self.canvas.bbox("all"))
+        self.render_view(fast=True)
     
         # Update rectangle positions
         self.update_rectangles()
@@ -706,52 +4577,335 @@ class ImageDrawer(tk.Tk):
                 y2 * self.zoom_level
             )
             self.canvas.coords(self.rect_coords[idx], *new_coords)
+        for item, coords in self.review_items:
+            self.canvas.coords(item, *(c * self.zoom_level for c in coords))
 
-    def show_image(self, index):
-        """Display an image and load its annotations."""
-        self.clear_rectangles()
-        
-        # Reset zoom if option is enabled
-        if self.reset_zoom_var.get():
-            self.zoom_level = 1.0
-        
-        image_path = os.path.join(self.source_directory, self.image_files[index])
-        self.current_image_original = Image.open(image_path)
-        width, height = self.current_image_original.size
-        self.original_width = width
-        self.original_height = height
+    def remember_previous_frame(self):
+        """Keep the image being left and its boxes so they can be propagated."""
+        if self.working_image is None or self.shown_image is None or not self.rectangles:
+            # Leaving an unlabeled image: nothing to carry to the one after it
+            self.previous_frame = None
+            return
+        keep = image_nbytes(self.working_image) <= self.image_budget * PREVIOUS_FRAME_BUDGET_FRACTION
+        self.previous_frame = {
+            "name": self.shown_image,
+            # Just a reference: the grayscale conversion happens only when boxes are propagated
+            "image": self.working_image if keep else None,
+            "labels": [rect["label_id"] for rect in self.rectangles],
+            # Boxes normalized, so they map onto the next image at any size
+            "boxes": np.array([rect["coords"] for rect in self.rectangles], dtype=np.float64)
+                     / (self.original_width, self.original_height, self.original_width, self.original_height)
+        }
+
+    def propagate_boxes(self):
+        """Carry the previous image's boxes forward, following their motion, as one undoable batch."""
+        if cv2 is None:
+            messagebox.showerror("Error", "OpenCV not installed. Please install it to propagate boxes.")
+            return
+        if self.working_image is None or self.previous_frame is None:
+            self.update_status("No previous annotations to propagate")
+            return
+        # Only carry boxes forward to the next frame in list order
+        if self.current_index == 0 or self.image_files[self.current_index - 1] != self.previous_frame["name"]:
+            self.update_status("Previous image in the list has no annotations to propagate")
+            return
+
+        started = time.perf_counter()
+        previous_image = self.previous_frame["image"]
+        if previous_image is None:
+            try:
+                previous_image, _ = working_copy(
+                    self.image_source.open_image(self.previous_frame["name"]), self.image_budget
+                )
+            except (OSError, ValueError) as e:
+                self.update_status(f"Could not read the previous image: {e}")
+                return
+        current = np.asarray(self.working_image.convert("L"))
+        previous = np.asarray(previous_image.convert("L"))
+        height, width = current.shape
+        if previous.shape != current.shape:
+            previous = cv2.resize(previous, (width, height), interpolation=cv2.INTER_AREA)
+        boxes = self.previous_frame["boxes"] * (width, height, width, height)
+        moved, scores = track_boxes(previous, current, boxes)
+
+        # Back to original pixels, skipping boxes that duplicate ones already here
+        moved /= self.working_scale
+        labels = np.array(self.previous_frame["labels"])
+        add, _ = merge_detections(
+            moved, labels, scores,
+            [rect["coords"] for rect in self.rectangles],
+            [rect["label_id"] for rect in self.rectangles],
+            [1.0] * len(self.rectangles),
+            self.merge_iou,
+            "keep"
+        )
+        batch = []
+        for i in add:
+            self.add_detected_rectangle(int(labels[i]), tuple(float(c) for c in moved[i]))
+            batch.append({'type': 'add', 'data': self.rectangles[-1].copy()})
+        if batch:
+            self.undo_stack.append({'type': 'batch', 'actions': batch})
+            self.redo_stack.clear()
+
+        lost = int(np.sum(scores[add] < TRACK_MIN_SCORE)) if len(add) else 0
+        elapsed = (time.perf_counter() - started) * 1000
+        message = f"Propagated {len(batch)} boxes in {elapsed:.0f} ms"
+        if lost:
+            message += f" ({lost} not tracked, left in place)"
+        if len(add) < len(labels):
+            message += f", skipped {len(labels) - len(add)} already present"
+        self.update_status(message)
+
+    def schedule_render(self):
+        """Coalesce scroll and resize events into one fast render when the UI is idle."""
+        if self.render_job is None:
+            self.render_job = self.after_idle(self.render_view, True)
+
+    def schedule_refine(self):
+        """(Re)start the idle timer after which the viewport is rendered at full quality."""
+        if self.refine_job:
+            self.after_cancel(self.refine_job)
+        self.refine_job = self.after(RENDER_REFINE_DELAY, self.refine_view)
 
-        # Apply zoom
-        new_width = int(width * self.zoom_level)
-        new_height = int(height * self.zoom_level)
-        img_resized = self.current_image_original.resize(
-            (new_width, new_height), 
-            Image.Resampling.LANCZOS
+    def refine_view(self):
+        """Re-render the viewport with LANCZOS once input has gone idle."""
+        self.refine_job = None
+        self.render_view()
+
+    def visible_box(self):
+        """Return the visible canvas region, clipped to the zoomed image, or None."""
+        zoom = self.zoom_level
+        left = max(0, int(self.canvas.canvasx(0)))
+        top = max(0, int(self.canvas.canvasy(0)))
+        right = min(int(self.original_width * zoom), math.ceil(self.canvas.canvasx(self.canvas.winfo_width())))
+        bottom = min(int(self.original_height * zoom), math.ceil(self.canvas.canvasy(self.canvas.winfo_height())))
+        if right <= left or bottom <= top:
+            return None
+        return left, top, right, bottom
+
+    def read_full_region(self, box, cached_only=False):
+        """Return (region image, origin) covering an original-pixel box at full resolution.
+
+        The region is read with a margin and reused while panning stays inside it.
+        With cached_only, returns None instead of reading when the cache misses.
+        """
+        if self.full_region:
+            (x0, y0, x1, y1), region = self.full_region
+            if x0 <= box[0] and y0 <= box[1] and x1 >= box[2] and y1 >= box[3]:
+                return region, (x0, y0)
+        if cached_only:
+            return None
+        margin_x = (box[2] - box[0]) * REGION_MARGIN
+        margin_y = (box[3] - box[1]) * REGION_MARGIN
+        expanded = (
+            max(0, int(box[0] - margin_x)),
+            max(0, int(box[1] - margin_y)),
+            min(self.original_width, math.ceil(box[2] + margin_x)),
+            min(self.original_height, math.ceil(box[3] + margin_y))
+        )
+        self.full_region = None
+        with self.image_source.open_image(self.image_files[self.current_index]) as image:
+            region = image.crop(expanded)
+        self.full_region = (expanded, region)
+        return region, expanded[:2]
+
+    def resample_view(self, visible, fast):
+        """Resample the image region under a visible canvas box to its on-screen size."""
+        zoom = self.zoom_level
+        left, top, right, bottom = visible
+        box = (left / zoom, top / zoom, right / zoom, bottom / zoom)
+
+        region = None
+        if self.working_scale < 1.0 and zoom > self.working_scale:
+            region = self.read_full_region(box, cached_only=fast)
+        if region:
+            source, (origin_x, origin_y) = region
+            scale = 1.0
+        else:
+            source, origin_x, origin_y, scale = self.working_image, 0, 0, self.working_scale
+        source_box = (
+            (box[0] - origin_x) * scale,
+            (box[1] - origin_y) * scale,
+            (box[2] - origin_x) * scale,
+            (box[3] - origin_y) * scale
         )
-        self.img_tk = ImageTk.PhotoImage(img_resized)
+        resample = Image.Resampling.NEAREST if fast else Image.Resampling.LANCZOS
+        return source.resize((right - left, bottom - top), resample, box=source_box)
+
+    def render_view(self, fast=False):
+        """Render only the visible part of the image at the current zoom level.
+
+        Uses the working copy unless zoomed in past its resolution, in which
+        case the visible region is read from the full-resolution original.
+        A fast render (during zoom/pan) uses nearest-neighbour resampling and
+        never reads from the original; it schedules a full-quality refinement
+        that further input postpones. Display filters are applied to the
+        viewport only, and full-quality results are cached.
+        """
+        self.render_job = None
+        if fast:
+            self.schedule_refine()
+        elif self.refine_job:
+            self.after_cancel(self.refine_job)
+            self.refine_job = None
+        if self.working_image is None:
+            return
+        zoom = self.zoom_level
+        self.canvas.config(scrollregion=(0, 0, int(self.original_width * zoom), int(self.original_height * zoom)))
+        visible = self.visible_box()
+        if visible is None:
+            return
+        left, top = visible[:2]
+
+        filters = self.display_filters()
+        # Fast renders use full-quality results when cached, but never add to the cache
+        view = self.cached_view((zoom, visible, filters))
+        if view is None:
+            base = self.cached_view((zoom, visible, None))
+            if base is None:
+                base = self.resample_view(visible, fast)
+                if not fast:
+                    self.cache_view((zoom, visible, None), base)
+            view = base
+            if filters != DEFAULT_DISPLAY_FILTERS:
+                view = Image.fromarray(apply_display_filters(np.asarray(base.convert("RGB")), filters))
+                if not fast:
+                    self.cache_view((zoom, visible, filters), view)
+        self.img_tk = ImageTk.PhotoImage(view)
 
         # Create or update image on canvas
         if hasattr(self, 'image_id'):
             self.canvas.itemconfig(self.image_id, image=self.img_tk)
+            self.canvas.coords(self.image_id, left, top)
         else:
-            self.image_id = self.canvas.create_image(0, 0, image=self.img_tk, anchor="nw")
+            self.image_id = self.canvas.create_image(left, top, image=self.img_tk, anchor="nw")
 
         # Ensure image is behind annotations
         self.canvas.tag_lower(self.image_id)
-        self.canvas.config(scrollregion=self.canvas.bbox("all"))
+        self.update_memory_label(view)
+
+    def display_filters(self):
+        """Return the current display filter settings as a hashable tuple."""
+        return (self.gamma_var.get(), self.stretch_var.get(), self.clahe_var.get(), self.channel_var.get())
+
+    def cached_view(self, key):
+        """Return a cached viewport render, or None."""
+        view = self.view_cache.get(key)
+        if view is not None:
+            self.view_cache.move_to_end(key)
+        return view
+
+    def cache_view(self, key, view):
+        """Cache a viewport render, evicting the least recently used over VIEW_CACHE_BYTES."""
+        self.view_cache[key] = view
+        self.view_cache_bytes += image_nbytes(view)
+        while self.view_cache_bytes > VIEW_CACHE_BYTES and len(self.view_cache) > 1:
+            _, evicted = self.view_cache.popitem(last=False)
+            self.view_cache_bytes -= image_nbytes(evicted)
+
+    def clear_view_cache(self):
+        """Drop cached viewport renders (a new image was loaded)."""
+        self.view_cache.clear()
+        self.view_cache_bytes = 0
+
+    def on_display_filter_changed(self):
+        """Re-render the viewport with the new display filters."""
+        if self.clahe_var.get() and cv2 is None:
+            self.clahe_var.set(False)
+            messagebox.showerror("Error", "OpenCV not installed. Please install it to use CLAHE.")
+            return
+        self.render_view()
+        gamma, stretch, clahe, channel = self.display_filters()
+        active = [name for name, on in (
+            (f"gamma {gamma:g}", gamma != 1.0), ("stretch", stretch), ("CLAHE", clahe), (f"{channel} channel", channel != "all")
+        ) if on]
+        self.update_status("Display filters: " + (", ".join(active) if active else "none"))
+
+    def ask_gamma(self):
+        """Ask for a display gamma (values above 1 brighten shadows)."""
+        gamma = simpledialog.askfloat(
+            "Display Gamma", "Gamma (1.0 = unchanged, >1 brightens dark images):",
+            initialvalue=self.gamma_var.get(), minvalue=0.1, maxvalue=5.0
+        )
+        if gamma:
+            self.gamma_var.set(gamma)
+            self.on_display_filter_changed()
+
+    def reset_display_filters(self):
+        """Turn all display filters off."""
+        self.gamma_var.set(1.0)
+        self.stretch_var.set(False)
+        self.clahe_var.set(False)
+        self.channel_var.set("all")
+        self.on_display_filter_changed()
+
+    def update_memory_label(self, view):
+        """Show how much memory the current image occupies."""
+        held = image_nbytes(self.working_image) + view.width * view.height * 4 + self.view_cache_bytes
+        if self.previous_frame and self.previous_frame["image"] is not None:
+            held += image_nbytes(self.previous_frame["image"])
+        if self.full_region:
+            held += image_nbytes(self.full_region[1])
+        text = f"{self.original_width}x{self.original_height} | image memory {held / 2**20:.0f} MB"
+        if self.working_scale < 1.0:
+            text += f" (working copy at {self.working_scale:.0%})"
+        self.memory_label.config(text=text)
+
+    def show_image(self, index):
+        """Display an image and load its annotations."""
+        self.remember_previous_frame()
+        self.clear_review()
+        if self.leases:
+            self.claim_lease_window(index)
+        self.clear_rectangles(record=False)
+        if self.journal:
+            # Unsaved edits on the previous image are discarded, as before
+            self.journal.reset(self.image_files[index])
+        
+        # Reset zoom if option is enabled
+        if self.reset_zoom_var.get():
+            self.zoom_level = 1.0
+        
+        load_started = time.perf_counter()
+        # Drop the previous image's bitmaps before decoding the next one
+        self.working_image = None
+        self.full_region = None
+        self.clear_view_cache()
+        try:
+            image = self.image_source.open_image(self.image_files[index])
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            # e.g. a trailing video frame past the real end of the stream
+            self.shown_image = None
+            if hasattr(self, 'image_id'):
+                self.canvas.itemconfig(self.image_id, image="")
+            self.update_status(f"Cannot open {self.image_files[index]}: {e}", duration=0)
+            return
+        self.shown_image = self.image_files[index]
+        width, height = image.size
+        self.original_width = width
+        self.original_height = height
+        self.working_image, self.working_scale = working_copy(image, self.image_budget)
+        # Show the image at once (e.g. while holding an arrow key); refine when idle
+        self.render_view(fast=True)
+        self.metrics.observe("image_load_seconds", time.perf_counter() - load_started)
+        self.image_shown_at = time.monotonic()
 
         # Load existing annotations if present
-        txt_filename = os.path.splitext(self.image_files[index])[0] + ".txt"
-        txt_filepath = os.path.join(self.destination_directory, txt_filename)
+        txt_filepath = self.label_path(index)
 
         annotation_count = 0
+        skipped_count = 0
+        clamped_count = 0
         if os.path.exists(txt_filepath):
             with open(txt_filepath, 'r') as f:
                 lines = f.readlines()
     
             for line in lines:
                 parts = line.strip().split()
+                if not parts:
+                    continue
                 if len(parts) != 5:
+                    skipped_count += 1
                     continue
         
                 try:
@@ -761,6 +4915,7 @@ class ImageDrawer(tk.Tk):
                     w = float(parts[3])
                     h = float(parts[4])
                 except ValueError:
+                    skipped_count += 1
                     continue
             
                 # Convert YOLO coordinates to pixels
@@ -773,6 +4928,9 @@ class ImageDrawer(tk.Tk):
                 y1 = max(0, y_center_abs - h_abs/2)
                 x2 = min(width, x_center_abs + w_abs/2)
                 y2 = min(height, y_center_abs + h_abs/2)
+                if (x1, y1, x2, y2) != (x_center_abs - w_abs/2, y_center_abs - h_abs/2,
+                                        x_center_abs + w_abs/2, y_center_abs + h_abs/2):
+                    clamped_count += 1
         
                 # Scale coordinates based on current zoom
                 scaled_coords = (
@@ -792,13 +4950,16 @@ class ImageDrawer(tk.Tk):
                 self.rect_coords.append(rect_id)
                 self.rectangles.append({
                     "coords": (x1, y1, x2, y2),  # Original coordinates
-                    "label_id": label_id
+                    "label_id": label_id,
+                    "rect_id": rect_id
                 })
                 annotation_count += 1
         
                 if not any(l["id"] == label_id for l in self.labels):
                     self.create_new_label_from_id(label_id)
 
+        self.dirty = False
+
         # Run auto-detect if enabled
         if self.auto_detect_var.get() and self.model:
             self.run_yolo_detection()
@@ -807,6 +4968,8 @@ class ImageDrawer(tk.Tk):
         status_msg = f"Image {index + 1}/{len(self.image_files)}: {self.image_files[index]}"
         if annotation_count > 0:
             status_msg += f" ({annotation_count} annotations loaded)"
+        if skipped_count or clamped_count:
+            status_msg += f" [{skipped_count} invalid lines skipped, {clamped_count} boxes clamped]"
         self.update_status(status_msg, duration=0)
 
     def get_label_color(self, label_id):
@@ -859,6 +5022,13 @@ class ImageDrawer(tk.Tk):
                 
                 self.update_status(f"Deleted label: {selected_label['name']}")
 
+                if self.destination_directory and messagebox.askyesno(
+                    "Delete Boxes",
+                    f"Also remove all '{selected_label['name']}' boxes from the label files "
+                    "in the destination directory?"
+                ):
+                    self.run_class_operation({selected_label["id"]: None})
+
     def start_drawing(self, event):
         """Start drawing a bounding box."""
         x = self.canvas.canvasx(event.x) / self.zoom_level
@@ -917,17 +5087,21 @@ class ImageDrawer(tk.Tk):
             self.rect_coords.append(self.rect_id)
             self.undo_stack.append({'type': 'add', 'data': rect_data.copy()})
             self.redo_stack.clear()
+            self.record_edit("add", rect_data)
+            self.metrics.increment("boxes_drawn")
             
             self.update_status(f"Added annotation ({len(self.rectangles)} total)", duration=2000)
         
         self.start_x = None
         self.start_y = None
 
-    def delete_rectangle(self, rect_id):
+    def delete_rectangle(self, rect_id, by_user=True):
         """Delete a rectangle and add to undo stack."""
         index = next((i for i, r in enumerate(self.rect_coords) if r == rect_id), -1)
         if index >= 0:
             rect_data = self.rectangles[index]
+            if by_user and "conf" in rect_data:
+                self.metrics.increment("detected_boxes_deleted")
             
             # Add to undo stack
             self.undo_stack.append({
@@ -939,6 +5113,7 @@ class ImageDrawer(tk.Tk):
             self.canvas.delete(rect_id)
             del self.rect_coords[index]
             del self.rectangles[index]
+            self.record_edit("delete", rect_data)
             
             self.update_status(f"Deleted annotation ({len(self.rectangles)} remaining)", duration=2000)
 
@@ -946,113 +5121,167 @@ class ImageDrawer(tk.Tk):
         """Undo the last action."""
         if self.undo_stack:
             action = self.undo_stack.pop()
-        
-            if action['type'] == 'add':
-                rect_id = action['data']['rect_id']
-                self.canvas.delete(rect_id)
-                # Find index using rect_id
-                if rect_id in self.rect_coords:
-                    index = self.rect_coords.index(rect_id)
-                    del self.rect_coords[index]
-                    del self.rectangles[index]
-                self.redo_stack.append(action)
-            
-            elif action['type'] == 'delete':
-                rect_data = action['data']
-                new_id = self.canvas.create_rectangle(
-                    rect_data['coords'][0] * self.zoom_level,
-                    rect_data['coords'][1] * self.zoom_level,
-                    rect_data['coords'][2] * self.zoom_level,
-                    rect_data['coords'][3] * self.zoom_level,
-                    outline=self.get_label_color(rect_data['label_id']),
-                    width=2
-                )
-                self.rectangles.append({
-                    "coords": rect_data['coords'],
-                    "label_id": rect_data['label_id'],
-                    "rect_id": new_id
-                })
-                self.rect_coords.append(new_id)
-                self.redo_stack.append(action)
-            
+            self.undo_action(action)
+            self.redo_stack.append(action)
             self.update_status("Undo", duration=1000)
 
     def redo(self, event=None):
         """Redo the last undone action."""
         if self.redo_stack:
             action = self.redo_stack.pop()
-        
-            if action['type'] == 'add':
-                # Restore rectangle with zoom scaling
-                rect_data = action['data']
-                new_id = self.canvas.create_rectangle(
-                    rect_data['coords'][0] * self.zoom_level,
-                    rect_data['coords'][1] * self.zoom_level,
-                    rect_data['coords'][2] * self.zoom_level,
-                    rect_data['coords'][3] * self.zoom_level,
-                    outline=self.get_label_color(rect_data['label_id']),
-                    width=2
-                )
-                rect_data['rect_id'] = new_id
-                self.rectangles.append(rect_data)
-                self.rect_coords.append(new_id)
-                self.undo_stack.append(action)
-            
-            elif action['type'] == 'delete':
-                # Undo restoration
-                rect_id = action['data']['rect_id']
-                self.canvas.delete(rect_id)
-                self.rect_coords = [r for r in self.rect_coords if r != rect_id]
-                self.rectangles = [r for r in self.rectangles if r['rect_id'] != rect_id]
-                self.undo_stack.append(action)
-            
+            self.redo_action(action)
+            self.undo_stack.append(action)
             self.update_status("Redo", duration=1000)
 
-    def clear_rectangles(self):
+    def undo_action(self, action):
+        """Revert one undo-stack action; a batch is reverted in reverse order."""
+        if action['type'] == 'batch':
+            for inner in reversed(action['actions']):
+                self.undo_action(inner)
+
+        elif action['type'] == 'add':
+            rect_id = action['data']['rect_id']
+            self.canvas.delete(rect_id)
+            # Find index using rect_id
+            if rect_id in self.rect_coords:
+                index = self.rect_coords.index(rect_id)
+                del self.rect_coords[index]
+                del self.rectangles[index]
+                self.record_edit("delete", action['data'])
+        
+        elif action['type'] == 'delete':
+            rect_data = action['data']
+            new_id = self.canvas.create_rectangle(
+                rect_data['coords'][0] * self.zoom_level,
+                rect_data['coords'][1] * self.zoom_level,
+                rect_data['coords'][2] * self.zoom_level,
+                rect_data['coords'][3] * self.zoom_level,
+                outline=self.get_label_color(rect_data['label_id']),
+                width=2
+            )
+            rect_data['rect_id'] = new_id
+            self.rectangles.append({
+                "coords": rect_data['coords'],
+                "label_id": rect_data['label_id'],
+                "rect_id": new_id
+            })
+            self.rect_coords.append(new_id)
+            self.record_edit("add", rect_data)
+
+    def redo_action(self, action):
+        """Re-apply one undone action; a batch is re-applied in order."""
+        if action['type'] == 'batch':
+            for inner in action['actions']:
+                self.redo_action(inner)
+
+        elif action['type'] == 'add':
+            # Restore rectangle with zoom scaling
+            rect_data = action['data']
+            new_id = self.canvas.create_rectangle(
+                rect_data['coords'][0] * self.zoom_level,
+                rect_data['coords'][1] * self.zoom_level,
+                rect_data['coords'][2] * self.zoom_level,
+                rect_data['coords'][3] * self.zoom_level,
+                outline=self.get_label_color(rect_data['label_id']),
+                width=2
+            )
+            rect_data['rect_id'] = new_id
+            self.rectangles.append(rect_data)
+            self.rect_coords.append(new_id)
+            self.record_edit("add", rect_data)
+        
+        elif action['type'] == 'delete':
+            # Undo restoration
+            rect_id = action['data']['rect_id']
+            self.canvas.delete(rect_id)
+            self.rect_coords = [r for r in self.rect_coords if r != rect_id]
+            self.rectangles = [r for r in self.rectangles if r['rect_id'] != rect_id]
+            self.record_edit("delete", action['data'])
+
+    def clear_rectangles(self, record=True):
         """Clear all rectangles from canvas."""
         for rect_id in self.rect_coords:
             self.canvas.delete(rect_id)
         self.rectangles.clear()
         self.rect_coords.clear()
+        if record:
+            self.record_edit("clear")
         self.update_status("All annotations cleared")
 
+    def yolo_lines(self):
+        """Return the current annotations as YOLO label lines."""
+        width, height = self.original_width, self.original_height
+        yolo_coords = []
+        for rect in self.rectangles:
+            x1, y1, x2, y2 = rect["coords"]
+            label_id = rect["label_id"]
+            
+            # Convert to YOLO format (normalized)
+            x_center = (x1 + x2) / 2 / width
+            y_center = (y1 + y2) / 2 / height
+            obj_width = (x2 - x1) / width
+            obj_height = (y2 - y1) / height
+            
+            yolo_coords.append(f"{label_id} {x_center} {y_center} {obj_width} {obj_height}")
+        return yolo_coords
+
     def confirm_and_save(self):
         """Save current annotations and move to next image."""
         if not self.image_files:
             return
             
-        txt_filename = os.path.splitext(self.image_files[self.current_index])[0] + ".txt"
-        txt_filepath = os.path.join(self.destination_directory, txt_filename)
+        txt_filepath = self.label_path(self.current_index)
+        txt_filename = os.path.basename(txt_filepath)
+        name = self.image_files[self.current_index]
         
-        if self.rectangles:
-            image_path = os.path.join(self.source_directory, self.image_files[self.current_index])
-            image = Image.open(image_path)
-            width, height = image.size
-
-            yolo_coords = []
-            for rect in self.rectangles:
-                x1, y1, x2, y2 = rect["coords"]
-                label_id = rect["label_id"]
-                
-                # Convert to YOLO format (normalized)
-                x_center = (x1 + x2) / 2 / width
-                y_center = (y1 + y2) / 2 / height
-                obj_width = (x2 - x1) / width
-                obj_height = (y2 - y1) / height
-                
-                yolo_coords.append(f"{label_id} {x_center} {y_center} {obj_width} {obj_height}")
+        if self.leases and self.dirty:
+            # Our lease may have expired (e.g. laptop asleep) and been reclaimed
+            holder = self.leases.holder(name)
+            if holder not in (None, self.leases.owner) and not messagebox.askyesno(
+                "Leased by Someone Else",
+                f"{name} is now leased by {holder}.\n\n"
+                "Your lease expired and another annotator may be labeling it. Overwrite their labels?"
+            ):
+                return
 
-            with open(txt_filepath, "w") as file:
-                file.write("\n".join(yolo_coords))
+        if not self.dirty and os.path.exists(txt_filepath):
+            # Nothing changed since load: skip the rewrite
+            self.update_status(f"No changes to {txt_filename}")
+        elif self.rectangles:
+            os.makedirs(os.path.dirname(txt_filepath), exist_ok=True)
+            atomic_write_text(txt_filepath, "\n".join(self.yolo_lines()))
             
             self.update_status(f"Saved {len(self.rectangles)} annotations to {txt_filename}")
         else:
             # Create empty file if no annotations
-            open(txt_filepath, 'w').close()
+            os.makedirs(os.path.dirname(txt_filepath), exist_ok=True)
+            atomic_write_text(txt_filepath, "")
             self.update_status(f"Saved empty annotation file: {txt_filename}")
 
-        # Move to next image
-        self.current_index += 1
+        if self.catalog:
+            counts = Counter(rect["label_id"] for rect in self.rectangles)
+            self.catalog.update_labels(
+                name,
+                os.stat(txt_filepath).st_mtime_ns,
+                counts,
+                (self.original_width, self.original_height)
+            )
+
+        self.metrics.increment("images_saved")
+        if self.image_shown_at is not None:
+            self.metrics.observe("image_seconds", time.monotonic() - self.image_shown_at)
+
+        # The label file now holds every journaled edit
+        self.dirty = False
+        if self.journal:
+            self.journal.reset()
+
+        if self.leases:
+            self.leases.release(name)
+
+        # Move to next image, skipping images leased by others
+        next_index = self.free_index(self.current_index + 1, 1)
+        self.current_index = len(self.image_files) if next_index is None else next_index
         if self.current_index < len(self.image_files):
             self.show_image(self.current_index)
             self.image_listbox.selection_clear(0, tk.END)
@@ -1170,6 +5399,213 @@ class ImageDrawer(tk.Tk):
             self.sel_rect_id = None
 
 
-if __name__ == "__main__":
+def start_virtual_display():
+    """Start Xvfb when there is no X display; return the process, or None."""
+    if os.environ.get("DISPLAY") or sys.platform in ("win32", "darwin"):
+        return None
+    try:
+        process = subprocess.Popen(
+            ["Xvfb", VIRTUAL_DISPLAY, "-screen", "0", "1920x1080x24", "-nolisten", "tcp"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+    except OSError:
+        print("Warning: Xvfb not found. Replay needs an X display (set DISPLAY or install Xvfb).")
+        return None
+    os.environ["DISPLAY"] = VIRTUAL_DISPLAY
+    time.sleep(0.5)
+    return process
+
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)]
+
+
+def generate_event(widget, record):
+    """Feed one recorded event back into Tk, running its handlers synchronously."""
+    kind = record["type"]
+    options = {"x": record["x"], "y": record["y"], "state": record["state"]}
+    if kind == "KeyPress":
+        widget.focus_set()
+        widget.event_generate("<KeyPress>", keysym=record["keysym"], state=record["state"])
+    elif kind in ("ButtonPress", "ButtonRelease"):
+        widget.event_generate(f"<{kind}>", button=record["button"], **options)
+    elif kind == "MouseWheel":
+        widget.event_generate("<MouseWheel>", delta=record["delta"], **options)
+    else:
+        widget.event_generate("<Motion>", **options)
+
+
+def replay_session(session_path, speed=1.0):
+    """Replay a recorded session and return per-event latency measurements.
+
+    Handler latency is the time event_generate takes to run the bound
+    handlers; time-to-idle also includes redraws and idle callbacks. Labels
+    are written to a scratch copy of the destination, and dialogs are
+    answered with their default (cancel/no) so replay never blocks.
+
+    Settings and metrics also go to the scratch directory, and start with the
+    defaults (no model preload), so runs compare between versions and never
+    touch the user's settings or production metrics.
+    """
+    global SETTINGS_PATH
+    with open(session_path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+
+    dialogs = Counter()
+
+    def dismiss(name):
+        def answer(*args, **kwargs):
+            dialogs[name] += 1
+            return None
+        return answer
+
+    for module, names in (
+        (messagebox, ("showinfo", "showwarning", "showerror", "askyesno", "askokcancel", "askyesnocancel")),
+        (simpledialog, ("askinteger", "askstring", "askfloat")),
+        (filedialog, ("askopenfilename", "askdirectory", "asksaveasfilename"))
+    ):
+        for name in names:
+            setattr(module, name, dismiss(name))
+
+    scratch = tempfile.mkdtemp(prefix="labeler-replay-")
+    settings_path = SETTINGS_PATH
+    metrics_path = os.environ.pop(METRICS_ENV, None)
+    SETTINGS_PATH = os.path.join(scratch, "settings.json")
+    destinations = os.path.join(scratch, "destinations")
+    os.makedirs(destinations)
+    app = None
+    events = []
+    try:
+        app = ImageDrawer()
+        app.update()
+        started = time.perf_counter()
+        for record in records:
+            if speed > 0:
+                due = started + record["t"] / speed
+                while time.perf_counter() < due:
+                    app.update()
+                    time.sleep(0.002)
+
+            if record["step"] == "session":
+                app.geometry(record["geometry"])
+                app.update()
+            elif record["step"] == "source":
+                destination = os.path.join(destinations, str(len(os.listdir(destinations))))
+                if os.path.isdir(record["destination"]):
+                    shutil.copytree(
+                        record["destination"], destination,
+                        ignore=shutil.ignore_patterns(".labeler-journal-*", ".labeler-metrics-*")
+                    )
+                else:
+                    os.makedirs(destination)
+                app.destination_directory = destination
+                app.source_directory = record["source"]["path"]
+                app.open_source(open_described_source(record["source"], destination))
+                app.update()
+            elif record["step"] == "model" and YOLO is not None:
+                app.load_model_file(record["path"])
+                while app.model_loading:
+                    app.update()
+                    time.sleep(0.01)
+            elif record["step"] == "event":
+                try:
+                    widget = app.nametowidget(record["widget"])
+                except KeyError:
+                    widget = app
+                handler_started = time.perf_counter()
+                generate_event(widget, record)
+                handled = time.perf_counter()
+                app.update()
+                idle = time.perf_counter()
+                events.append({
+                    "index": len(events),
+                    "type": record["type"],
+                    "widget": record["widget"],
+                    "handler_ms": round((handled - handler_started) * 1000, 3),
+                    "idle_ms": round((idle - handler_started) * 1000, 3)
+                })
+    finally:
+        if app is not None:
+            app.on_close()
+        SETTINGS_PATH = settings_path
+        if metrics_path is not None:
+            os.environ[METRICS_ENV] = metrics_path
+        shutil.rmtree(scratch, ignore_errors=True)
+    return events, dict(dialogs)
+
+
+def latency_report(session_path, events, dialogs):
+    """Summarize replayed latencies per event type and widget."""
+    groups = {}
+    for event in events:
+        groups.setdefault(f"{event['type']} {event['widget']}", []).append(event)
+    summary = {}
+    for key in sorted(groups):
+        handler = [e["handler_ms"] for e in groups[key]]
+        idle = [e["idle_ms"] for e in groups[key]]
+        summary[key] = {
+            "count": len(handler),
+            "handler_p50_ms": percentile(handler, 0.5),
+            "handler_p95_ms": percentile(handler, 0.95),
+            "handler_max_ms": max(handler),
+            "idle_p50_ms": percentile(idle, 0.5),
+            "idle_p95_ms": percentile(idle, 0.95),
+            "idle_max_ms": max(idle)
+        }
+    return {"session": os.path.basename(session_path), "dialogs": dialogs, "summary": summary, "events": events}
+
+
+def print_comparison(baseline, report):
+    """Print p50/p95 time-to-idle per event group against a baseline report."""
+    print(f"{'event':<50} {'count':>6} {'p50 ms':>16} {'p95 ms':>16}")
+    for key, stats in report["summary"].items():
+        old = baseline["summary"].get(key)
+        p50 = f"{stats['idle_p50_ms']:.1f}"
+        p95 = f"{stats['idle_p95_ms']:.1f}"
+        if old:
+            p50 += f" ({stats['idle_p50_ms'] - old['idle_p50_ms']:+.1f})"
+            p95 += f" ({stats['idle_p95_ms'] - old['idle_p95_ms']:+.1f})"
+        print(f"{key:<50} {stats['count']:>6} {p50:>16} {p95:>16}")
+
+
+def main():
+    """Run the labeler, optionally recording a session or replaying one."""
+    parser = argparse.ArgumentParser(description="YOLO Image Labeler")
+    parser.add_argument("--record", metavar="SESSION", help="record input events to a JSONL session file")
+    parser.add_argument("--replay", metavar="SESSION", help="replay a recorded session and measure latency")
+    parser.add_argument("--report", metavar="JSON", help="write the replay latency report here")
+    parser.add_argument("--compare", metavar="JSON", help="baseline report to compare the replay against")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="replay speed multiplier; 0 replays without pauses (default 1)")
+    args = parser.parse_args()
+
+    if args.replay:
+        display = start_virtual_display()
+        try:
+            events, dialogs = replay_session(args.replay, args.speed)
+        finally:
+            if display:
+                display.terminate()
+        report = latency_report(args.replay, events, dialogs)
+        if args.report:
+            atomic_write_text(args.report, json.dumps(report, indent=2, sort_keys=True) + "\n")
+        baseline = {"summary": {}}
+        if args.compare:
+            with open(args.compare, encoding="utf-8") as f:
+                baseline = json.load(f)
+        print_comparison(baseline, report)
+        return
+
     app = ImageDrawer()
+    if args.record:
+        app.recorder = SessionRecorder(app, args.record)
     app.mainloop()
+
+
+if __name__ == "__main__":
+    main()